@@ -1,18 +1,26 @@
-from utils import hard_cut, get_values_from_table, get_api_name, filter_bijection_like_dict, compare_pandas_table, is_valid_result, get_sqlite_path, split_sql
+from utils import hard_cut, get_api_name, filter_bijection_like_dict, get_sqlite_path, split_sql, compare_result_files, summarize_result_csv
 from sql import SqlEnv
-import pandas as pd
-from io import StringIO
 import os
 import shutil
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 import csv
 from prompt import Prompts
 from typing import Type
 from chat import GPTChat
+from budget import PromptBudget
+from metrics import stage, set_context, get_context
+from tracing import span, start_span, end_span, propagate
+from cpu_pool import run_cpu
+from voter import check_cancelled
+from cascade import get_cascade
+from spending import BudgetSpent
+from deadline import RESERVED_ITERATIONS
 import sys
 csv.field_size_limit(sys.maxsize)
 
 class REFORCE:
-    def __init__(self, db_path, sql_data, search_directory, prompt_class: Type[Prompts], sql_env: Type[SqlEnv]=None, chat_session_pre: Type[GPTChat]=None, chat_session: Type[GPTChat]=None, log_save_path=None, db_id=None, task=None):
+    def __init__(self, db_path, sql_data, search_directory, prompt_class: Type[Prompts], sql_env: Type[SqlEnv]=None, chat_session_pre: Type[GPTChat]=None, chat_session: Type[GPTChat]=None, log_save_path=None, db_id=None, task=None, budget: PromptBudget=None):
         self.csv_save_name = "result.csv"
         self.sql_save_name = "result.sql"
         self.log_save_name = "log.log"
@@ -36,17 +44,33 @@ class REFORCE:
         self.sql_env = sql_env
         self.chat_session_pre = chat_session_pre
         self.chat_session = chat_session
+        self.budget = budget if budget is not None else PromptBudget()
+        self.vote_result_tokens = 1250
+        self.stop_event = None
+        self.deadline = None
+        self.knowledge = None
 
 
     def execute_sqls(self, sqls, logger):
         result_dic_list = []
         error_rec = []
+        query_span = None
         while sqls:
+            end_span(query_span)
             if len(result_dic_list) > 10 or len(self.chat_session_pre.messages) > 20:
                 break
+            query_span = start_span("execute_sqls.query")
             result_dic = {}
             sql = sqls[0]
             sqls = sqls[1:]
+            known = self.knowledge.known(sql) if self.knowledge is not None else None
+            if known is not None:
+                # run (and corrected) for an earlier instance on this database
+                known_sql, known_res, in_prior_info = known
+                logger.payload("Known result", f"Known result. SQL:\n{known_sql}\nResults:\n{known_res}")
+                if not in_prior_info:
+                    result_dic_list.append({'sql': known_sql, 'res': known_res})
+                continue
             logger.info("[Try to execute]\n" + sql + "\n[Try to execute]")
             results = self.sql_env.execute_sql_api(sql, self.sql_id, api=self.api, max_len=self.csv_max_len, sqlite_path=self.sqlite_path)
 
@@ -54,8 +78,10 @@ class REFORCE:
                 result_dic['sql'] = sql
                 result_dic['res'] = results
                 # self.chat_session_pre.messages.append({"role": "user", "content": f"Successfully executed. SQL:\n{sql}\nResults:\n{results}"})
-                logger.info("[Successfully executed]\n" +  f"Successfully executed. SQL:\n{sql}\nResults:\n{results}" + "\n[Successfully executed]")
+                logger.payload("Successfully executed", f"Successfully executed. SQL:\n{sql}\nResults:\n{results}")
                 result_dic_list.append(result_dic)
+                if self.knowledge is not None:
+                    self.knowledge.record(sql, sql, results)
             else:
                 logger.info("[Error occurred]\n" + str(results) + "\n[Error occurred]")
                 max_try = self.max_try
@@ -65,6 +91,10 @@ class REFORCE:
                     error_rec.append(0)
                     if max_try == 0:
                         break
+                    if self.deadline is not None and not self.deadline.fits("self-correct", RESERVED_ITERATIONS):
+                        # explore no further, keep self-refine's time
+                        end_span(query_span)
+                        return result_dic_list
                     if results == self.empty_result:
                         simplify = True
                     corrected_sql = self.self_correct(sql, results, logger, simplify=simplify)
@@ -79,14 +109,14 @@ class REFORCE:
 
                 if isinstance(results, str) and results != self.empty_result:
                     error_rec.append(1)
-                    if sqls != []:
+                    if sqls != [] and (self.deadline is None or self.deadline.fits("self-correct", RESERVED_ITERATIONS)):
                         response = self.chat_session_pre.get_model_response(self.prompt_class.get_exploration_refine_prompt(sql, corrected_sql, sqls), "sql")
 
                         if isinstance(response, list) and response != []:
                             response_sqls = []
                             for s in response:
                                 try:
-                                    queries = split_sql(s)
+                                    queries = run_cpu(split_sql, s)
                                     response_sqls += queries
                                 except:
                                     pass
@@ -97,16 +127,21 @@ class REFORCE:
                     error_rec.append(0)
                     # Many times error, return
                     if len(error_rec) > 3 and sum(error_rec[-3:]) == 0:
+                        end_span(query_span)
                         return result_dic_list
                     continue
                 if not corrected_sql:
                     continue
                 result_dic['sql'] = corrected_sql
                 result_dic['res'] = results
+                if self.knowledge is not None:
+                    self.knowledge.record(sql, corrected_sql, results)
                 # self.chat_session_pre.messages.append({"role": "user", "content": f"Successfully corrected. SQL:\n{corrected_sql}\nResults:\n{results}"})
                 logger.info("[Successfully corrected]\n" +  f"Successfully executed. SQL:\n{sql}\nResults:\n{results}" + "\n[Successfully corrected]")
+        end_span(query_span)
         return result_dic_list
 
+    @stage("self-correct")
     def self_correct(self, sql, error, logger, simplify=False):
         prompt = self.prompt_class.get_exploration_self_correct_prompt(sql, error)
         if simplify:
@@ -120,18 +155,29 @@ class REFORCE:
         logger.info("[Corrected SQL]\n" + self.chat_session_pre.messages[-1]['content'] + "\n[Corrected SQL]")
         return response
 
+    @stage("format")
+    @span("format_answer")
     def format_answer(self, task, chat_session: Type[GPTChat]):
         format_prompt = self.prompt_class.get_format_prompt()
         response_csv = chat_session.get_model_response("Task: " + task + format_prompt, "csv")
         response_csv = "```csv\n"+response_csv[0].split("\n")[0]+"\n```"
         return response_csv
 
+    @stage("exploration")
+    @span("exploration")
     def exploration(self, task, table_struct, table_info, logger):
-        pre_info = ''
+        # results of earlier instances on the database, see knowledge.py
+        prior_info = self.knowledge.prior_info(table_info, task, self.budget) if self.knowledge is not None else ''
+        pre_info = prior_info
         task = table_info + "\nTask: " + task + "\n"
         max_try = self.max_try
         while max_try > 0:
+            # a retry cut short is not a skipped stage: fits(), not allow()
+            if max_try < self.max_try and self.deadline is not None and not self.deadline.fits("exploration", RESERVED_ITERATIONS):
+                break
             exploration_prompt = task + self.prompt_class.get_exploration_prompt(self.api, table_struct)
+            if prior_info:
+                exploration_prompt += self.prompt_class.get_exploration_knowledge_prompt(prior_info)
 
             response_pre = self.chat_session_pre.get_model_response(exploration_prompt, "sql")
             response_pre_txt = self.chat_session_pre.messages[-1]['content']
@@ -141,7 +187,7 @@ class REFORCE:
                 continue
             
             if len(response_pre) == 1:
-                response_pre = split_sql(response_pre[0])
+                response_pre = run_cpu(split_sql, response_pre[0])
             if len(response_pre) < 3:
                 max_try -= 1
                 print(f"{self.sql_id}: Few sqls, retry preparation.")
@@ -153,19 +199,23 @@ class REFORCE:
                 if isinstance(dic['res'], str):
                     sql_count += 1
 
-            if sql_count == 0:
+            if sql_count == 0 and not prior_info:
                 print(f"{self.sql_id}: sql_count: {sql_count}, len(response_pre): {len(response_pre)}. Inadequate preparation, break.")
                 max_try = 0
                 break
 
-            if len(pre_info) < 1e5:
+            if self.budget.fits(pre_info, "exploration"):
                 break
             print(f"{self.sql_id}: Too long, retry preparation.")
-            pre_info = ''
+            pre_info = prior_info
             max_try -= 1
 
+        if self.knowledge is not None:
+            self.knowledge.record_metrics()
         return pre_info, response_pre_txt, max_try
 
+    @stage("self-refine")
+    @span("self_refine")
     def self_refine(self, args, logger, question, format_csv, table_struct, table_info, response_pre_txt, pre_info, csv_save_path, sql_save_path, task=None):
         itercount = 0
         results_values = []
@@ -174,9 +224,18 @@ class REFORCE:
         self_refine_prompt = self.prompt_class.get_self_refine_prompt(table_info, task, pre_info, question, self.api, format_csv, table_struct, args.omnisql_format_pth)
 
         error_rec = []
+        best = None  # (sql, csv, validated) to answer with if the deadline stops refinement
+        iteration_span = None
         while itercount < args.max_iter:
+            end_span(iteration_span)
+            check_cancelled(self.stop_event)
+            if itercount and self.deadline is not None and not self.deadline.fits("iteration"):
+                self.save_best(best, csv_save_path, sql_save_path, logger)
+                break
+            iteration_span = start_span("self_refine.iteration", iteration=itercount)
+            set_context(iteration=itercount)
             logger.info(f"itercount: {itercount}")
-            logger.info("[Self-refine]\n" + self_refine_prompt + "\n[Self-refine]")
+            logger.payload("Self-refine", self_refine_prompt, shared=(table_info, pre_info))
             
             max_try = self.max_try
             while max_try > 0:
@@ -212,32 +271,24 @@ class REFORCE:
                 with open(csv_save_path) as f:
                     csv_data = f.readlines()
                     csv_data_str = ''.join(csv_data)
-                logger.info(f"[Executed results in self-refine]\n{hard_cut(csv_data_str, self.csv_max_len)}\n[Executed results in self-refine]")
+                logger.payload("Executed results in self-refine", hard_cut(csv_data_str, self.csv_max_len))
                 self_consistency_prompt += "Current snswer: \n" + hard_cut(csv_data_str, self.csv_max_len)
                 self_consistency_prompt += f"Current sql:\n{response}"
                 if '"""' in csv_data_str:
                     self_consistency_prompt += 'Please remove """ in results. Use CAST: CAST(column_name AS STRING).\n'
 
                 # Filter results with null columns
-                csv_buffer = StringIO(csv_data_str)
-                df_csv = pd.read_csv(csv_buffer).fillna("")
-
-                nested_val = [(item) for i, row in enumerate(df_csv.values.tolist()) for j, item in enumerate(row) if isinstance(item, str) and '\n' in item in item]
-                df_csv_copy = df_csv.copy()
-                for col in df_csv.select_dtypes(include=['float']):
-                    df_csv_copy[col] = df_csv[col].round(2)
-                sort_col = df_csv_copy.columns[0]
-                df_csv_copy_sorted = df_csv_copy[sort_col].astype(str)
-                csv_data_str_round2 = df_csv_copy_sorted.to_string()
-                df_csv_str = df_csv.astype(str)
-                if get_values_from_table(csv_data_str_round2) not in results_values:
+                csv_values, nested_val, empty_columns = run_cpu(summarize_result_csv, csv_save_path)
+                validated = not nested_val and not empty_columns
+                if best is None or validated or not best[2]:
+                    best = (response, csv_data_str, validated)
+                if csv_values not in results_values:
                     if nested_val:
                         self_consistency_prompt += f"Values {nested_val} are nested. Please correct them. e.g. Transfer '[\nA,\n B\n]' to 'A, B'.\n"
-                    elif not ((df_csv_str == "0") | (df_csv_str == "")).all().any():
-                            results_values.append(get_values_from_table(csv_data_str_round2))
+                    elif not empty_columns:
+                            results_values.append(csv_values)
                             results_tables.append(csv_data_str)
                     else:
-                        empty_columns = df_csv_str.columns[((df_csv_str == "0") | (df_csv_str == "")).all()].to_list()
                         self_consistency_prompt += f"Empty results in Column {empty_columns}. Please correct them.\n"
                 else:
                     # self-consistency
@@ -257,6 +308,8 @@ class REFORCE:
 
             itercount += 1
 
+        end_span(iteration_span)
+        set_context(iteration=None)
         logger.info(f"Total iteration counts: {itercount}")
         if itercount == args.max_iter and not args.save_all_results:
             if os.path.exists(csv_save_path):
@@ -264,9 +317,170 @@ class REFORCE:
             logger.info("Max Iter, remove file")
         print(f"{self.sql_id}: chat_session len: {self.chat_session.get_message_len()}")
 
+    def save_best(self, best, csv_save_path, sql_save_path, logger):
+        """Answer with the best result so far when the deadline stops self-refine."""
+        self.deadline.stop_early()
+        logger.info(f"Deadline: {self.deadline.remaining():.1f}s left, stopping self-refine")
+        if best is None:
+            return
+        sql, csv_data_str, validated = best
+        with open(csv_save_path, "w") as f:
+            f.write(csv_data_str)
+        with open(sql_save_path, "w") as f:
+            f.write(sql)
+        logger.info(f"[Best result before the deadline{'' if validated else ', not validated'}]\n{hard_cut(csv_data_str, 500)}\n[Best result before the deadline]")
+
+    def ask_sql(self, chat_session, prompt):
+        """One SQL from chat_session, asking again if it returns none or several."""
+        max_try = self.max_try
+        while max_try > 0:
+            response = chat_session.get_model_response(prompt, "sql")
+            if not isinstance(response, list) or len(response) != 1:
+                prompt = "Please output one SQL only."
+            else:
+                break
+            max_try -= 1
+        return response
+
+    def refine_branch(self, chat_session, prompt, csv_path, sql_env, context):
+        """One speculative self-refine candidate from a fork of chat_session:
+        its SQL executed into csv_path on the branch slot's sql_env, with its
+        summary if it ran."""
+        set_context(**context)
+        check_cancelled(self.stop_event)
+        branch = {"session": chat_session.fork(), "csv_path": csv_path, "sql": None, "result": None, "summary": None}
+        response = self.ask_sql(branch["session"], prompt)
+        if not isinstance(response, list) or response == []:
+            return branch
+        branch["sql"] = response[0]
+        branch["result"] = sql_env.execute_sql_api(branch["sql"], self.sql_id, csv_path, api=self.api, sqlite_path=self.sqlite_path)
+        if branch["result"] == '0':
+            branch["summary"] = run_cpu(summarize_result_csv, csv_path)
+        return branch
+
+    @stage("self-refine")
+    @span("self_refine")
+    def self_refine_branches(self, args, logger, question, format_csv, table_struct, table_info, response_pre_txt, pre_info, csv_save_path, sql_save_path, task=None):
+        """self_refine asking args.refine_branches candidates per iteration in
+        parallel from the same conversation and executing them all. A result
+        two branches agree on, or one repeating an earlier result, is accepted
+        at once (without --do_self_consistency, the first that runs);
+        otherwise the first branch whose SQL ran carries the conversation on.
+        At most args.branch_budget candidates are asked for overall (0: K per
+        iteration), keeping one for each iteration left."""
+        itercount = 0
+        results_values = []
+        error_rec = []
+        accepted = None
+        best = None
+        branch_budget = args.branch_budget or args.refine_branches * args.max_iter
+        # one SqlEnv per branch slot for the whole vote, the first being the vote's own,
+        # so branches keep their connections from one iteration to the next
+        branch_envs = [SqlEnv() for _ in range(args.refine_branches - (self.sql_env is not None))]
+        if self.sql_env is not None:
+            branch_envs.insert(0, self.sql_env)
+
+        self_refine_prompt = self.prompt_class.get_self_refine_prompt(table_info, task, pre_info, question, self.api, format_csv, table_struct, args.omnisql_format_pth)
+
+        with ThreadPoolExecutor(max_workers=args.refine_branches, thread_name_prefix="refine-branch") as executor, contextlib.ExitStack() as cleanup:
+            for sql_env in branch_envs:
+                if sql_env is not self.sql_env:
+                    cleanup.callback(sql_env.close_db)
+            while itercount < args.max_iter and accepted is None:
+                check_cancelled(self.stop_event)
+                if itercount and self.deadline is not None and not self.deadline.fits("iteration"):
+                    self.save_best(best, csv_save_path, sql_save_path, logger)
+                    break
+                num_branches = max(1, min(args.refine_branches, branch_budget - (args.max_iter - itercount - 1)))
+                branch_budget -= num_branches
+                logger.info(f"itercount: {itercount}, branches: {num_branches}")
+                logger.payload("Self-refine", self_refine_prompt, shared=(table_info, pre_info))
+                with span("self_refine.iteration", iteration=itercount, branches=num_branches):
+                    futures = [executor.submit(propagate(self.refine_branch), self.chat_session, self_refine_prompt, f"{csv_save_path[:-4]}.branch{b}.csv",
+                                               branch_envs[b], dict(get_context(), iteration=itercount, branch=b))
+                               for b in range(num_branches)]
+                    branches = [future.result() for future in futures]
+
+                for branch in branches:
+                    logger.info("[Try to run SQL in self-refine]\n" + branch["session"].messages[-1]['content'] + "\n[Try to run SQL in self-refine]")
+                valid = [b for b in branches if b["summary"] is not None and not b["summary"][1] and not b["summary"][2]]
+                for branch in branches:
+                    if branch["result"] != '0':
+                        continue
+                    if not args.do_self_consistency or branch["summary"][0] in results_values or \
+                            (branch in valid and any(other is not branch and other["summary"][0] == branch["summary"][0] for other in valid)):
+                        accepted = branch
+                        break
+                ran = [b for b in branches if b["result"] == '0']
+                carrier = accepted or (ran or [b for b in branches if b["sql"] is not None] or [None])[0]
+                for branch in branches:
+                    self.chat_session.merge(branch["session"], adopt=branch is carrier)
+                if carrier is None:
+                    print(f"{self.sql_id}: Error when generating final SQL.")
+                    break
+                if carrier["result"] == '0':
+                    os.replace(carrier["csv_path"], csv_save_path)
+                elif os.path.exists(csv_save_path):
+                    os.remove(csv_save_path)
+                for branch in branches:
+                    if os.path.exists(branch["csv_path"]):
+                        os.remove(branch["csv_path"])
+                if accepted is not None:
+                    if args.do_self_consistency:
+                        with open(csv_save_path) as f:
+                            logger.info(f"[Consistent results]\n{hard_cut(f.read(), 500)}\n[Consistent results]")
+                    with open(sql_save_path, "w") as f:
+                        f.write(accepted["sql"])
+                    break
+
+                error_rec.append(str(carrier["result"]))
+                if args.early_stop and len(error_rec) > 3:
+                    # Eraly stop for repeatitive empty results
+                    if len(set(error_rec[-4:])) == 1 and error_rec[-1] == self.empty_result:
+                        logger.info("No data found for the specified query, remove file.")
+                        if os.path.exists(csv_save_path):
+                            os.remove(csv_save_path)
+                        break
+
+                for branch in valid:
+                    if branch["summary"][0] not in results_values:
+                        results_values.append(branch["summary"][0])
+                response = carrier["sql"]
+                if carrier["result"] == '0':
+                    with open(csv_save_path) as f:
+                        csv_data_str = f.read()
+                    if best is None or carrier in valid or not best[2]:
+                        best = (response, csv_data_str, carrier in valid)
+                    logger.payload("Executed results in self-refine", hard_cut(csv_data_str, self.csv_max_len))
+                    self_refine_prompt = self.prompt_class.get_self_consistency_prompt(question, format_csv)
+                    self_refine_prompt += "Current snswer: \n" + hard_cut(csv_data_str, self.csv_max_len)
+                    self_refine_prompt += f"Current sql:\n{response}"
+                    if '"""' in csv_data_str:
+                        self_refine_prompt += 'Please remove """ in results. Use CAST: CAST(column_name AS STRING).\n'
+                    _, nested_val, empty_columns = carrier["summary"]
+                    if nested_val:
+                        self_refine_prompt += f"Values {nested_val} are nested. Please correct them. e.g. Transfer '[\nA,\n B\n]' to 'A, B'.\n"
+                    elif empty_columns:
+                        self_refine_prompt += f"Empty results in Column {empty_columns}. Please correct them.\n"
+                    if any(keyword in response for keyword in self.prompt_class.get_condition_onmit_tables()):
+                        self_refine_prompt += self.prompt_class.get_prompt_dialect_list_all_tables(table_struct, self.api)
+                else:
+                    self_refine_prompt = f"Input sql:\n{response}\nThe error information is:\n" + str(carrier["result"]) + "\nPlease correct it and output only 1 complete SQL query."
+
+                itercount += 1
+
+        logger.info(f"Total iteration counts: {itercount}")
+        if accepted is None and not args.save_all_results:
+            if os.path.exists(csv_save_path):
+                os.remove(csv_save_path)
+            logger.info("Max Iter, remove file")
+        print(f"{self.sql_id}: chat_session len: {self.chat_session.get_message_len()}")
+
+    @stage("generation")
+    @span("gen")
     def gen(self, args, logger, question, format_csv, table_struct, table_info, response_pre_txt, pre_info, csv_save_path, sql_save_path, task=None):
         gen_prompt = self.prompt_class.get_self_refine_prompt(table_info, task, pre_info, question, self.api, format_csv, table_struct, args.omnisql_format_pth)
-        logger.info("[Gen]\n" + gen_prompt + "\n[Gen]")
+        logger.payload("Gen", gen_prompt, shared=(table_info, pre_info))
         max_try = self.max_try
         while max_try > 0:
             response = self.chat_session.get_model_response(gen_prompt, "sql")
@@ -286,12 +500,22 @@ class REFORCE:
             with open(sql_save_path, "w") as f:
                 f.write(response)
 
-    def model_vote(self, result, sql_paths, search_directory, args, table_info, task):
-        chat_session = GPTChat(args.azure, args.model_vote)
+    @stage("model_vote")
+    @span("model_vote")
+    def model_vote(self, result, sql_paths, search_directory, args, table_info, task, model=None):
+        """Let a model choose among the top candidates; True if its choice
+        was executed and saved."""
+        # a budget-degraded instance votes with its fallback model too
+        model = args.fallback_model or model or args.model_vote
+        chat_session = GPTChat(args.azure, model)
         max_value = max(result.values())
         max_dict = {k: v for k, v in result.items() if v == max_value}
         # print(max_dict)
 
+        # trimmed for the voting model, not the generation model of self.budget
+        budget = PromptBudget(model)
+        table_info = budget.fit_table_info(table_info)
+        result_tokens = min(self.vote_result_tokens, budget.section_limit("exploration") // len(max_dict))
         prompt = f"You are gieven DB info, task and candidate SQLs and thier results. You should choose the most correct one based on database info:\n{table_info}. The task is: {task}. Here are some candidate sqls and answers: \n"
         for sql, counts in max_dict.items():
             sql_path = os.path.join(search_directory, sql)
@@ -303,7 +527,7 @@ class REFORCE:
                     prompt += f.read()
                 prompt += "CSV file name: " + sql_paths[sql] + "\n"
                 with open(csv_path) as f:
-                    prompt += hard_cut(f.read(), 5000)
+                    prompt += budget.cut(f.read(), result_tokens)
 
         max_try = 3
         prompt += "Compare the SQL and results of each answer, think step by step and choose one SQL as the correct answer. Output thinking process and the name of sql in ```plaintext\nxxx.sql``` format. You should not ingnore 'plaintext'.\n"
@@ -319,18 +543,31 @@ class REFORCE:
             max_try -= 1
         if max_try == 0:
             print(f"{search_directory} Empty")
-            return
+            return False
         with open(os.path.join(search_directory, response[0].strip())) as f:
             selected_sql = f.read()
         sql_env = SqlEnv()
-        if sql_env.execute_sql_api(selected_sql, self.sql_id, self.complete_csv_save_path, api=self.api, sqlite_path=self.sqlite_path) == '0':
+        chosen = sql_env.execute_sql_api(selected_sql, self.sql_id, self.complete_csv_save_path, api=self.api, sqlite_path=self.sqlite_path) == '0'
+        if chosen:
             with open(self.complete_sql_save_path, "w") as f:
                 f.write(selected_sql)
             with open(self.complete_vote_log_path, "w") as f:
                 f.write("[Vote]\n"+prompt+"\n[Vote]")
                 f.write(chat_session.messages[-1]['content'])
         sql_env.close_db()
-
+        return chosen
+
+    def cascade_model_vote(self, result, sql_paths, search_directory, args, table_info, task):
+        """model_vote up the cascade's model_vote ladder until a choice is saved."""
+        def vote(model):
+            return self.model_vote(result, sql_paths, search_directory, args, table_info, task, model=model)
+        try:
+            return get_cascade().run("model_vote", "no_choice", vote, lambda chosen: not chosen)
+        except BudgetSpent as e:
+            print(f"{search_directory}: {e}, no model vote")
+            return False
+
+    @span("voting")
     def vote_result(self, search_directory, args, sql_paths, table_info, task):
         # filter answer
         result = {}
@@ -342,18 +579,13 @@ class REFORCE:
                 all_values.append(os.path.join(search_directory, v))
 
         if len(all_values) > 1:
+            matches = run_cpu(compare_result_files, all_values)
             for key, value in sql_paths.items():
                 complete_value = os.path.join(search_directory, value)
-                if os.path.exists(complete_value):
-                    same_ans = 0
-                    for v in all_values:
-                        v_df = pd.read_csv(v)
-                        c_df = pd.read_csv(complete_value)
-                        if v != complete_value and is_valid_result(v_df) and compare_pandas_table(v_df, c_df, ignore_order=True) and v_df.shape == c_df.shape:
-                            same_ans += 1
-                            result_name[v] = result_name.get(v, []) + [complete_value]
-                        # print(result)
-                    result_all[key] = same_ans
+                if complete_value in matches:
+                    for v in matches[complete_value]:
+                        result_name[v] = result_name.get(v, []) + [complete_value]
+                    result_all[key] = len(matches[complete_value])
             result_name = filter_bijection_like_dict(result_name)
             for key, value in result_name.items():
                 result[key.split("/")[-1].replace(".csv", ".sql")] = len(value)
@@ -365,7 +597,7 @@ class REFORCE:
                 assert all(v == 0 for k, v in result_all.items()), result
                 result_all = {k: v + 1 for k, v in result_all.items()}
                 # print(result_all)
-                self.model_vote(result_all, sql_paths, search_directory, args, table_info, task)
+                self.cascade_model_vote(result_all, sql_paths, search_directory, args, table_info, task)
             elif args.final_choose:
                 csv_pth = all_values[0]
                 shutil.copy2(csv_pth.replace(".csv", ".sql"), self.complete_sql_save_path)
@@ -385,7 +617,7 @@ class REFORCE:
         if has_tie:
             assert num_with_max_vote % (max_vote + 1) == 0, result_name
             if args.model_vote:
-                self.model_vote(result, sql_paths, search_directory, args, table_info, task)
+                self.cascade_model_vote(result, sql_paths, search_directory, args, table_info, task)
                 return
             if not args.random_vote_for_tie:
                 print(f"{search_directory} has_tie {sorted_dict}, return")
@@ -0,0 +1,227 @@
+"""Answers of api.query_one cached by database content and question.
+
+An entry is the SQL that answered a question on a sqlite database, keyed on
+(sha256 of the database file, model, sha256 of the prompt context, normalized
+question). The prompt context is the schema text the model was given,
+extra_schema notes included, so an answer found with other notes or by
+another model is never reused. The file digest is cached by path, size and
+mtime, so an unchanged database is not read again. A lookup takes the entry
+of the same database, model and context whose question is most similar: the
+cosine of their content words (lowercased, plurals folded, stop words
+dropped), at least the threshold, and the same literals in both, meaning the
+numbers, quoted strings, capitalized names and ordering or negation words,
+so "top 5" never answers "top 10". The cached SQL is run again on the
+current database, so the answer is always fresh; SQL that no longer runs is
+dropped and counts as a miss.
+
+Invalidation follows the content: once a database file changes, the
+entries of its old digest are dropped (unless another cached path still has
+that content). Lookups count hits, misses, stale entries and invalidations
+in the cache file:
+
+    python answer_cache.py --cache ~/.cache/reforce/answers.sqlite
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+DEFAULT_CACHE_PATH = os.path.join("~", ".cache", "reforce", "answers.sqlite")
+DEFAULT_SIMILARITY = 0.9
+STATS = ("hit", "miss", "stale", "invalidated")
+STOP_WORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "by", "with", "and", "or", "at", "from", "as",
+    "is", "are", "was", "were", "be", "been", "do", "does", "did", "there", "that", "which", "who",
+    "what", "whats", "how", "me", "show", "list", "give", "find", "tell", "please", "can", "you", "i",
+    "all", "each", "every", "its", "their", "this", "these", "those", "s",
+}
+# words that change the answer however similar the rest of the question is
+LITERAL_WORDS = {
+    "not", "no", "without", "except", "never", "top", "bottom", "first", "last", "most", "least",
+    "max", "maximum", "min", "minimum", "highest", "lowest", "largest", "smallest", "best", "worst",
+    "ascending", "descending", "before", "after", "above", "below", "more", "less", "over", "under",
+}
+TOKEN_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"|\d+(?:\.\d+)?|[A-Za-z_][A-Za-z0-9_]*")
+ANSWER_COLUMNS = ["db_hash", "model", "context", "question", "terms", "sql", "created", "hits"]
+
+
+def normalize_question(question):
+    return " ".join(question.lower().split()).rstrip("?.! ")
+
+
+def question_terms(question):
+    """(content words of question, its literals)."""
+    words, literals = [], set()
+    for i, token in enumerate(TOKEN_PATTERN.findall(question)):
+        lowered = token.lower()
+        if token[0] in "'\"" or token[0].isdigit():
+            literals.add(token.strip("'\"").lower())
+            words.append(lowered.strip("'\""))
+            continue
+        if lowered in LITERAL_WORDS or (i and token[0].isupper()):
+            literals.add(lowered)
+        if lowered in STOP_WORDS:
+            continue
+        if len(lowered) > 3 and lowered.endswith("s") and not lowered.endswith("ss"):
+            lowered = lowered[:-1]
+        words.append(lowered)
+    return words, literals
+
+
+def context_hash(context):
+    return hashlib.sha256((context or "").strip().encode("utf-8")).hexdigest()
+
+
+def cosine(a, b):
+    a, b = Counter(a), Counter(b)
+    dot = sum(count * b[word] for word, count in a.items())
+    if not dot:
+        return 0.0
+    return dot / math.sqrt(sum(v * v for v in a.values()) * sum(v * v for v in b.values()))
+
+
+class AnswerCache:
+    def __init__(self, path=None, similarity=DEFAULT_SIMILARITY):
+        self.path = os.path.abspath(os.path.expanduser(path or DEFAULT_CACHE_PATH))
+        self.similarity = similarity
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.connect() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(answers)")]
+            if columns and columns != ANSWER_COLUMNS:
+                # a cache written before answers were keyed on model and context
+                conn.execute("DROP TABLE answers")
+            conn.execute("""CREATE TABLE IF NOT EXISTS answers (
+                db_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                context TEXT NOT NULL,
+                question TEXT NOT NULL,
+                terms TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                created REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (db_hash, model, context, question))""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS databases (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                db_hash TEXT NOT NULL)""")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, count INTEGER NOT NULL)")
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def count(self, conn, name, n=1):
+        conn.execute("INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET count = count + ?", (name, n, n))
+
+    def db_hash(self, sqlite_path):
+        """sha256 of the database file; entries of its previous content are
+        dropped when it changed."""
+        sqlite_path = os.path.abspath(sqlite_path)
+        stat = os.stat(sqlite_path)
+        with self.connect() as conn:
+            known = conn.execute("SELECT size, mtime_ns, db_hash FROM databases WHERE path = ?", (sqlite_path,)).fetchone()
+        if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            return known[2]
+        digest = hashlib.sha256()
+        with open(sqlite_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        db_hash = digest.hexdigest()
+        with self.lock, self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO databases VALUES (?, ?, ?, ?)", (sqlite_path, stat.st_size, stat.st_mtime_ns, db_hash))
+            if known and known[2] != db_hash:
+                shared = conn.execute("SELECT 1 FROM databases WHERE db_hash = ?", (known[2],)).fetchone()
+                if not shared:
+                    dropped = conn.execute("DELETE FROM answers WHERE db_hash = ?", (known[2],)).rowcount
+                    self.count(conn, "invalidated", dropped)
+        return db_hash
+
+    def match(self, db_hash, model, context, question):
+        """(sql, similarity, cached question) of the closest entry for the
+        model and context hash, or None."""
+        normalized = normalize_question(question)
+        words, literals = question_terms(question)
+        with self.connect() as conn:
+            rows = conn.execute("SELECT question, terms, sql FROM answers WHERE db_hash = ? AND model = ? AND context = ?",
+                                (db_hash, model, context)).fetchall()
+        best = None
+        for cached_question, terms, sql in rows:
+            if cached_question == normalized:
+                return sql, 1.0, cached_question
+            cached_words, cached_literals = json.loads(terms)
+            if set(cached_literals) != literals:
+                continue
+            similarity = cosine(words, cached_words)
+            if similarity >= self.similarity and (best is None or similarity > best[1]):
+                best = (sql, similarity, cached_question)
+        return best
+
+    def lookup(self, sqlite_path, question, model, context=""):
+        """(sql, answer DataFrame, similarity) of a cached answer by model
+        with the same prompt context, run on the current database, or None."""
+        import pandas as pd
+        db_hash = self.db_hash(sqlite_path)
+        key = (db_hash, model, context_hash(context))
+        found = self.match(*key, question)
+        if found is not None:
+            sql, similarity, cached_question = found
+            try:
+                conn = sqlite3.connect(f"file:{os.path.abspath(sqlite_path)}?mode=ro", uri=True)
+                try:
+                    answer = pd.read_sql_query(sql, conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"Answer cache: cached SQL for {cached_question!r} failed, dropping it: {e}")
+                with self.lock, self.connect() as conn:
+                    conn.execute("DELETE FROM answers WHERE db_hash = ? AND model = ? AND context = ? AND question = ?", key + (cached_question,))
+                    self.count(conn, "stale")
+            else:
+                with self.lock, self.connect() as conn:
+                    conn.execute("UPDATE answers SET hits = hits + 1 WHERE db_hash = ? AND model = ? AND context = ? AND question = ?", key + (cached_question,))
+                    self.count(conn, "hit")
+                return sql, answer, similarity
+        with self.lock, self.connect() as conn:
+            self.count(conn, "miss")
+        return None
+
+    def store(self, sqlite_path, question, sql, model, context=""):
+        db_hash = self.db_hash(sqlite_path)
+        words, literals = question_terms(question)
+        terms = json.dumps([words, sorted(literals)])
+        with self.lock, self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO answers (db_hash, model, context, question, terms, sql, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (db_hash, model, context_hash(context), normalize_question(question), terms, sql, time.time()))
+
+    def stats(self):
+        """{hit, miss, stale, invalidated: count, hit_rate, entries, databases}."""
+        with self.connect() as conn:
+            counts = dict(conn.execute("SELECT name, count FROM stats").fetchall())
+            entries = conn.execute("SELECT COUNT(*), COUNT(DISTINCT db_hash) FROM answers").fetchone()
+        stats = {name: counts.get(name, 0) for name in STATS}
+        lookups = stats["hit"] + stats["miss"]
+        stats.update(hit_rate=stats["hit"] / lookups if lookups else 0.0, entries=entries[0], databases=entries[1])
+        return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cache", type=str, default=DEFAULT_CACHE_PATH)
+    parser.add_argument("--clear", action="store_true", help="drop every cached answer")
+    args = parser.parse_args()
+    cache = AnswerCache(args.cache)
+    if args.clear:
+        with cache.connect() as conn:
+            conn.execute("DELETE FROM answers")
+    stats = cache.stats()
+    print(f"{stats['entries']} answers on {stats['databases']} databases; {stats['hit']} hits, {stats['miss']} misses "
+          f"({stats['hit_rate']:.1%} hit rate), {stats['stale']} stale, {stats['invalidated']} invalidated")
@@ -2,6 +2,10 @@
 from __future__ import annotations
 import subprocess, json, shutil, tempfile, uuid, sqlite3, textwrap
 from pathlib import Path
+try:
+    from .answer_cache import AnswerCache, DEFAULT_SIMILARITY
+except ImportError:
+    from answer_cache import AnswerCache, DEFAULT_SIMILARITY
 
 _RUN_PY = (Path(__file__).resolve().parent / "run.py").resolve()
 
@@ -38,7 +42,10 @@ def query_one(*,
               max_iter    : int = 5,
               self_refine : bool = True,
               show_log_tail: bool = False,
-              log_tail_lines: int = 40) -> dict:
+              log_tail_lines: int = 40,
+              deadline    : float | None = None,
+              cache       : bool | str | Path = False,
+              cache_similarity: float = DEFAULT_SIMILARITY) -> dict:
     """
     Run ReFoRCE on a single NL question.
 
@@ -53,10 +60,21 @@ def query_one(*,
     self_refine      : bool → add / drop --do_self_refinement
     show_log_tail    : if True, print the last N lines of log.log
     log_tail_lines   : how many lines to print
+    deadline         : latency budget in seconds, forwarded to run.py --deadline;
+                       stages that no longer fit are skipped and self-refine
+                       answers with its best result so far (empty sql and
+                       answer, with stopped_early, if nothing ran in time)
+    cache            : True or a cache file path → answer a question already
+                       answered by the same model, on the same database content
+                       and extra_schema (or one at least cache_similarity
+                       alike), by re-running its cached SQL; see answer_cache.py
+    cache_similarity : minimum similarity of a cached question to reuse its SQL
 
     Returns
     -------
-    dict {sql:str, answer:pandas.DataFrame, log:Path, workdir:Path}
+    dict {sql:str, answer:pandas.DataFrame, log:Path, workdir:Path,
+          stopped_early:bool, skipped_stages:list[str], cached:bool,
+          similarity:float|None}  (log and workdir are None for a cached answer)
     """
     import pandas as _pd, subprocess, tempfile, shutil, sqlite3, uuid, json, textwrap, os
     from pathlib import Path
@@ -65,19 +83,9 @@ def query_one(*,
     if not sqlite_path.exists():
         raise FileNotFoundError(sqlite_path)
 
-    # temp work area ----------------------------------------------------
-    workdir = Path(tempfile.mkdtemp(prefix="reforce_tmp_"))
-    ex_id   = f"local-{uuid.uuid4().hex[:8]}"
-    ex_dir  = workdir / ex_id
-    ex_dir.mkdir(parents=True)
-
-    # copy DB
-    db_copy = ex_dir / "mydb.sqlite"
-    shutil.copy2(sqlite_path, db_copy)
-
     # build prompts.txt -------------------------------------------------
     def _ddl_from(db: Path) -> str:
-        con = sqlite3.connect(db)
+        con = sqlite3.connect(f"file:{db}?mode=ro", uri=True)
         ddl = "\n\n".join(row[0]
                           for row in con.execute(
                               "SELECT sql FROM sqlite_master "
@@ -86,17 +94,36 @@ def query_one(*,
         con.close()
         return ddl or "-- (empty schema)"
 
-    ddl = _ddl_from(db_copy)
+    ddl = _ddl_from(sqlite_path)
     if extra_schema:
         ddl += f"\n\n-- Extra notes\n{extra_schema.strip()}"
 
-    (ex_dir / "prompts.txt").write_text(
-        textwrap.dedent(f"""
+    prompt = textwrap.dedent(f"""
         The database contains the following tables / columns:
 
         {ddl}
         """).lstrip()
-    )
+
+    # answers are cached per model and prompt, extra_schema included
+    answer_cache = None
+    if cache:
+        answer_cache = AnswerCache(None if cache is True else cache, cache_similarity)
+        hit = answer_cache.lookup(sqlite_path, question, model, prompt)
+        if hit is not None:
+            sql_txt, answer, similarity = hit
+            return {"sql": sql_txt, "answer": answer, "log": None, "workdir": None,
+                    "stopped_early": False, "skipped_stages": [],
+                    "cached": True, "similarity": similarity}
+
+    # temp work area ----------------------------------------------------
+    workdir = Path(tempfile.mkdtemp(prefix="reforce_tmp_"))
+    ex_id   = f"local-{uuid.uuid4().hex[:8]}"
+    ex_dir  = workdir / ex_id
+    ex_dir.mkdir(parents=True)
+
+    # copy DB
+    shutil.copy2(sqlite_path, ex_dir / "mydb.sqlite")
+    (ex_dir / "prompts.txt").write_text(prompt)
 
     # spider2-lite.jsonl -----------------------------------------------
     (workdir / "spider2-lite.jsonl").write_text(
@@ -115,23 +142,38 @@ def query_one(*,
     ]
     if self_refine:
         cmd.append("--do_self_refinement")
+    if deadline is not None:
+        cmd += ["--deadline", str(deadline)]
 
     subprocess.run(cmd, check=True)
 
     # collect output ----------------------------------------------------
     outdir  = workdir / "out" / ex_id
     sql_files = list(outdir.glob("*.sql"))
-    if not sql_files:
+    deadline_file = outdir / "deadline.json"
+    deadline_info = json.loads(deadline_file.read_text()) if deadline_file.exists() else {}
+    if sql_files:
+        sql_txt = sql_files[0].read_text()
+        answer  = _pd.read_csv(next(outdir.glob("*.csv")))
+    elif deadline_info.get("stopped_early"):
+        # the deadline came before any SQL ran
+        sql_txt, answer = "", _pd.DataFrame()
+    else:
         raise RuntimeError(f"ReFoRCE produced no SQL; inspect {outdir/'log.log'}")
 
-    sql_txt = sql_files[0].read_text()
-    answer  = _pd.read_csv(next(outdir.glob("*.csv")))
-
     if show_log_tail:
         print(f"\n─ log tail ({log_tail_lines} lines) • {outdir/'log.log'} ─")
         print("\n".join(outdir.joinpath("log.log").read_text().splitlines()[-log_tail_lines:]))
 
+    # a best-so-far answer cut short by the deadline is not reused
+    if answer_cache is not None and not deadline_info.get("stopped_early"):
+        answer_cache.store(sqlite_path, question, sql_txt, model, prompt)
+
     return {"sql": sql_txt,
             "answer": answer,
             "log": outdir / "log.log",
-            "workdir": workdir}
+            "workdir": workdir,
+            "stopped_early": deadline_info.get("stopped_early", False),
+            "skipped_stages": deadline_info.get("skipped", []),
+            "cached": False,
+            "similarity": None}
@@ -0,0 +1,184 @@
+"""Single-file SQLite store for run artifacts.
+
+Holds what run.py otherwise leaves in <output_path>/<instance_id>/: the SQL,
+CSV result and log of every vote ({i}result.sql, {i}result.csv, {i}log.log)
+and the final result.sql, result.csv, log.log and vote.log. Rows are keyed by
+(instance_id, name), where name is the file name in that layout, and carry
+the vote number and kind parsed from it.
+
+With run.py --artifact_store, each instance is worked on in a local scratch
+directory: artifacts already in the store are materialized there first, and
+the directory is synced back after every vote and after the vote itself, so
+the output directory only sees the store file. Keep the store on local disk
+(SQLite WAL needs shared memory), or open it with shared=True (run.py --role)
+when workers on several nodes write to it, and export it where it is needed:
+
+    python artifact_store.py --artifact_store runs/o3-lite.db --export output/o3-lite-log
+    python artifact_store.py --artifact_store runs/o3-lite.db --import_dir output/o3-lite-log
+"""
+import argparse
+import os
+import re
+import time
+from logs import BLOB_DIR_NAME
+from shared_db import SharedDB
+
+ARTIFACT_NAMES = {"sql": "result.sql", "csv": "result.csv", "log": "log.log", "vote_log": "vote.log"}
+NAME_PATTERN = re.compile(r"^(\d*)(result\.sql|result\.csv|log\.log|vote\.log)$")
+ALL_VOTES = "all"
+
+
+def artifact_name(vote, kind):
+    return ("" if vote is None else str(vote)) + ARTIFACT_NAMES[kind]
+
+
+def parse_name(name):
+    """File name -> (vote, kind); kind is "file" for names outside the layout."""
+    match = NAME_PATTERN.match(name)
+    if not match:
+        return None, "file"
+    kind = {v: k for k, v in ARTIFACT_NAMES.items()}[match.group(2)]
+    return (int(match.group(1)) if match.group(1) else None), kind
+
+
+class ArtifactStore:
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.db = SharedDB(path, shared)
+        with self.db.transaction() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS artifacts (
+                instance_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                vote INTEGER,
+                kind TEXT NOT NULL,
+                content BLOB NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (instance_id, name))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS artifacts_kind ON artifacts (kind, vote)")
+
+    def connect(self):
+        return self.db.connect()
+
+    def put(self, instance_id, vote, kind, content):
+        self.put_file(instance_id, artifact_name(vote, kind), content)
+
+    def put_file(self, instance_id, name, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        vote, kind = parse_name(name)
+        with self.db.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?)",
+                         (instance_id, name, vote, kind, content, time.time()))
+
+    def get(self, instance_id, vote, kind):
+        content = self.get_file(instance_id, artifact_name(vote, kind))
+        return content.decode("utf-8") if content is not None else None
+
+    def get_file(self, instance_id, name):
+        row = self.connect().execute("SELECT content FROM artifacts WHERE instance_id = ? AND name = ?", (instance_id, name)).fetchone()
+        return row[0] if row else None
+
+    def has(self, instance_id, vote, kind):
+        return self.connect().execute("SELECT 1 FROM artifacts WHERE instance_id = ? AND name = ?",
+                                      (instance_id, artifact_name(vote, kind))).fetchone() is not None
+
+    def delete(self, instance_id, vote=ALL_VOTES, kind=None):
+        query, params = self.filter(instance_id, vote, kind)
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM artifacts" + query, params)
+
+    def filter(self, instance_id, vote=ALL_VOTES, kind=None):
+        clauses, params = ["instance_id = ?"], [instance_id]
+        if vote is None:
+            clauses.append("vote IS NULL")
+        elif vote != ALL_VOTES:
+            clauses.append("vote = ?")
+            params.append(vote)
+        if kind is not None:
+            clauses.append("kind = ?")
+            params.append(kind)
+        return " WHERE " + " AND ".join(clauses), params
+
+    def files(self, instance_id, vote=ALL_VOTES, kind=None):
+        """{name: content} of an instance's artifacts."""
+        query, params = self.filter(instance_id, vote, kind)
+        return dict(self.connect().execute("SELECT name, content FROM artifacts" + query, params).fetchall())
+
+    def votes(self, instance_id, kind):
+        """{vote: content} of the per-vote artifacts of one kind."""
+        rows = self.connect().execute("SELECT vote, content FROM artifacts WHERE instance_id = ? AND kind = ? AND vote IS NOT NULL ORDER BY vote",
+                                      (instance_id, kind)).fetchall()
+        return {vote: content.decode("utf-8") for vote, content in rows}
+
+    def instances(self, kind=None):
+        if kind is None:
+            rows = self.connect().execute("SELECT DISTINCT instance_id FROM artifacts ORDER BY instance_id")
+        else:
+            rows = self.connect().execute("SELECT DISTINCT instance_id FROM artifacts WHERE kind = ? AND vote IS NULL ORDER BY instance_id", (kind,))
+        return [row[0] for row in rows]
+
+    def materialize(self, instance_id, directory):
+        """Write an instance's artifacts into directory (the per-instance layout)."""
+        os.makedirs(directory, exist_ok=True)
+        for name, content in self.files(instance_id).items():
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(content)
+
+    def sync_dir(self, instance_id, directory, vote=ALL_VOTES):
+        """Make the stored artifacts of instance_id (optionally one vote) match
+        the files in directory: changed files are written, removed ones deleted."""
+        current = {}
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                file_path = os.path.join(directory, name)
+                if os.path.isfile(file_path) and (vote == ALL_VOTES or parse_name(name)[0] == vote):
+                    with open(file_path, "rb") as f:
+                        current[name] = f.read()
+        stored = self.files(instance_id, vote)
+        now = time.time()
+        with self.db.transaction() as conn:
+            for name in stored.keys() - current.keys():
+                conn.execute("DELETE FROM artifacts WHERE instance_id = ? AND name = ?", (instance_id, name))
+            for name, content in current.items():
+                if stored.get(name) != content:
+                    conn.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?)",
+                                 (instance_id, name, *parse_name(name), content, now))
+
+    def export(self, out_dir, instances=None, kinds=None):
+        """Write the store out in the <out_dir>/<instance_id>/<file> layout."""
+        instances = instances or self.instances()
+        for instance_id in instances:
+            directory = os.path.join(out_dir, instance_id)
+            os.makedirs(directory, exist_ok=True)
+            for name, content in self.files(instance_id).items():
+                if kinds is None or parse_name(name)[1] in kinds:
+                    with open(os.path.join(directory, name), "wb") as f:
+                        f.write(content)
+        return out_dir
+
+    def import_dir(self, out_dir):
+        """Load an existing <out_dir>/<instance_id>/ tree into the store."""
+        instances = [name for name in sorted(os.listdir(out_dir)) if os.path.isdir(os.path.join(out_dir, name)) and name != BLOB_DIR_NAME]
+        for instance_id in instances:
+            self.sync_dir(instance_id, os.path.join(out_dir, instance_id))
+        return instances
+
+    def close(self):
+        self.db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--artifact_store', type=str, required=True)
+    parser.add_argument('--export', type=str, default=None, help="write the store out as <export>/<instance_id>/ directories")
+    parser.add_argument('--import_dir', type=str, default=None, help="load an existing output directory into the store")
+    parser.add_argument('--instances', nargs="+", default=None)
+    args = parser.parse_args()
+
+    store = ArtifactStore(args.artifact_store)
+    if args.import_dir:
+        print(f"Imported {len(store.import_dir(args.import_dir))} instances from {args.import_dir}")
+    if args.export:
+        store.export(args.export, args.instances)
+        print(f"Exported {len(args.instances or store.instances())} instances to {args.export}")
+    store.close()
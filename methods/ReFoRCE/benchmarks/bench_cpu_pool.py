@@ -0,0 +1,99 @@
+"""CPU post-processing with and without run.py --cpu_workers.
+
+Writes num_instances x num_votes result CSVs, then runs the vote comparison
+(compare_result_files) and self-refine summaries (summarize_result_csv) of
+every instance from --threads threads, inline and through pools of each
+--cpu_workers size. A probe thread that sleeps 10 ms in a loop stands in for
+the threads waiting on LLM/database I/O: its wake-up lag shows how long the
+GIL keeps them from running.
+
+    python benchmarks/bench_cpu_pool.py --cpu_workers 0 1 2 4 --num_rows 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+from cpu_pool import init_cpu_pool, shutdown_cpu_pool, run_cpu
+from utils import compare_result_files, summarize_result_csv
+
+
+def write_votes(work_dir, num_instances, num_votes, num_rows, seed):
+    rng = np.random.default_rng(seed)
+    instances = []
+    for i in range(num_instances):
+        base = pd.DataFrame({"id": np.arange(num_rows), "name": [f"item_{j}" for j in rng.integers(0, 1000, num_rows)],
+                             "value": rng.random(num_rows) * 1000, "count": rng.integers(0, 100, num_rows)})
+        paths = []
+        for vote in range(num_votes):
+            df = base.sample(frac=1, random_state=int(rng.integers(1 << 31)))
+            if vote % 2:
+                df = df.assign(value=df["value"] + 1)
+            path = os.path.join(work_dir, f"{i}-{vote}result.csv")
+            df.to_csv(path, index=False)
+            paths.append(path)
+        instances.append(paths)
+    return instances
+
+
+def process_instance(paths):
+    for path in paths:
+        run_cpu(summarize_result_csv, path)
+    return run_cpu(compare_result_files, paths)
+
+
+def probe(stop, lags):
+    while not stop.is_set():
+        start = time.perf_counter()
+        time.sleep(0.01)
+        lags.append(time.perf_counter() - start - 0.01)
+
+
+def run(cpu_workers, instances, threads):
+    init_cpu_pool(cpu_workers)
+    with ThreadPoolExecutor(max(cpu_workers, 1)) as executor:  # start the pool processes outside the timing
+        list(executor.map(lambda paths: run_cpu(summarize_result_csv, paths[0]), instances[:max(cpu_workers, 1)]))
+    stop, lags = threading.Event(), []
+    probe_thread = threading.Thread(target=probe, args=(stop, lags))
+    probe_thread.start()
+    start_time = time.time()
+    with ThreadPoolExecutor(threads) as executor:
+        results = list(executor.map(process_instance, instances))
+    wall = time.time() - start_time
+    stop.set()
+    probe_thread.join()
+    shutdown_cpu_pool()
+    return {"cpu_workers": cpu_workers, "wall_s": wall, "instances_per_s": len(instances) / wall,
+            "lag_p50_ms": np.percentile(lags, 50) * 1000, "lag_p95_ms": np.percentile(lags, 95) * 1000, "results": results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cpu_workers', nargs="+", type=int, default=[0, 1, 2, 4])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--num_instances', type=int, default=16)
+    parser.add_argument('--num_votes', type=int, default=5)
+    parser.add_argument('--num_rows', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work_dir', type=str, default=None)
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="reforce_cpu_")
+    os.makedirs(work_dir, exist_ok=True)
+    instances = write_votes(work_dir, args.num_instances, args.num_votes, args.num_rows, args.seed)
+    print(f"{os.cpu_count()} cores, {args.threads} threads, {args.num_instances} instances x {args.num_votes} votes x {args.num_rows} rows")
+
+    results = [run(n, instances, args.threads) for n in args.cpu_workers]
+    assert all(r["results"] == results[0]["results"] for r in results), "pool results differ from inline"
+    print(f"{'cpu_workers':>12}{'wall(s)':>9}{'inst/s':>8}{'speedup':>9}{'lag p50(ms)':>13}{'lag p95(ms)':>13}")
+    for r in results:
+        print(f"{r['cpu_workers']:>12}{r['wall_s']:>9.2f}{r['instances_per_s']:>8.2f}{results[0]['wall_s'] / r['wall_s']:>9.2f}"
+              f"{r['lag_p50_ms']:>13.1f}{r['lag_p95_ms']:>13.1f}")
@@ -0,0 +1,83 @@
+"""Scaling of run.py --role worker processes sharing one --state_db.
+
+Each worker process stands in for a node: it gets its own --num_workers
+threads and claims instances from the shared state db, writing results to a
+shared --artifact_store. Reports wall time and instances/min per worker
+count, and how the instances were split between workers.
+
+    python benchmarks/bench_distributed.py --workers 1 2 4 --num_instances 24 --latency_mean 0.5
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REFORCE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REFORCE_DIR)
+sys.path.insert(0, BENCH_DIR)
+from mock_llm_server import start_server, add_llm_args, llm_from_args
+from synthetic_db import generate
+from run_bench import SCENARIOS
+
+
+def run_workers(num_workers, data_dir, work_dir, base_url, args):
+    run_dir = os.path.join(work_dir, f"workers-{num_workers}")
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    cmd = [sys.executable, os.path.join(REFORCE_DIR, "run.py"),
+           "--task", "lite", "--subtask", "sqlite",
+           "--db_path", data_dir, "--output_path", os.path.join(run_dir, "output"),
+           "--generation_model", args.model, "--num_workers", str(args.threads),
+           "--state_db", os.path.join(run_dir, "state.db"), "--artifact_store", os.path.join(run_dir, "artifacts.db"),
+           "--role", "worker", "--poll_interval", "1", "--lease_seconds", "60"]
+    cmd += [a.format(model=args.model) for a in SCENARIOS[args.scenario]]
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY="bench")
+
+    start_time = time.time()
+    procs = []
+    for i in range(num_workers):
+        log = open(os.path.join(run_dir, f"worker-{i}.log"), "w")
+        procs.append((subprocess.Popen(cmd + ["--worker_id", f"worker-{i}"], cwd=REFORCE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT), log))
+    for proc, log in procs:
+        proc.wait()
+        log.close()
+    wall = time.time() - start_time
+
+    from run_state import RunState
+    state = RunState(os.path.join(run_dir, "state.db"))
+    done = state.summary().get("instance", {}).get("done", 0)
+    return {"workers": num_workers, "wall_s": wall, "done": done, "instances_per_min": done / wall * 60, "split": state.owners()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=2, help="--num_workers of each worker process")
+    parser.add_argument('--scenario', type=str, default="votes", choices=list(SCENARIOS))
+    parser.add_argument('--model', type=str, default="gpt-4o")
+    parser.add_argument('--num_instances', type=int, default=16)
+    parser.add_argument('--num_dbs', type=int, default=2)
+    parser.add_argument('--num_tables', type=int, default=5)
+    parser.add_argument('--num_rows', type=int, default=1000)
+    parser.add_argument('--num_columns', type=int, default=6)
+    parser.add_argument('--work_dir', type=str, default=None)
+    add_llm_args(parser)
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="reforce_dist_")
+    os.makedirs(work_dir, exist_ok=True)
+    data_dir = str(generate(os.path.join(work_dir, "data"), args.num_instances, args.num_dbs, args.num_tables, args.num_rows, args.num_columns, args.seed))
+    server, base_url = start_server(llm_from_args(args))
+
+    results = [run_workers(n, data_dir, work_dir, base_url, args) for n in args.workers]
+    server.shutdown()
+
+    base = results[0]["instances_per_min"] / results[0]["workers"]
+    print(f"{'workers':>8}{'done':>6}{'wall(s)':>9}{'inst/min':>10}{'scaling':>9}  split")
+    for r in results:
+        scaling = r["instances_per_min"] / (base * r["workers"]) if base else 0.0
+        print(f"{r['workers']:>8}{r['done']:>6}{r['wall_s']:>9.1f}{r['instances_per_min']:>10.1f}{scaling:>9.2f}  {r['split']}")
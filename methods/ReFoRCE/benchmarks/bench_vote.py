@@ -0,0 +1,110 @@
+"""Vote clustering time: fingerprints (utils.compare_result_files) against
+the previous pairwise loop of vote_result.
+
+Writes num_candidates result CSVs drawn from a few distinct answers, each
+copy with shuffled rows and columns and float noise below the tolerance,
+plus invalid (all-empty column) results, and checks that both methods
+return the same matches.
+
+The pairwise relation is one-way (every column of one result found in the
+other) and not transitive, while classes are. --cases prints the fixed
+cases where the two differ (see utils.ResultClasses).
+
+    python benchmarks/bench_vote.py --num_candidates 8 32 64 --num_rows 2000
+    python benchmarks/bench_vote.py --cases
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+from utils import compare_result_files, compare_pandas_table, is_valid_result
+
+
+def pairwise_result_files(csv_paths):
+    """vote_result before fingerprints: every ordered pair read and compared."""
+    matches = {}
+    for complete_value in csv_paths:
+        matches[complete_value] = []
+        for v in csv_paths:
+            v_df = pd.read_csv(v)
+            c_df = pd.read_csv(complete_value)
+            if v != complete_value and is_valid_result(v_df) and compare_pandas_table(v_df, c_df, ignore_order=True) and v_df.shape == c_df.shape:
+                matches[complete_value].append(v)
+    return matches
+
+
+# (description, candidate tables) on which classes and the pairwise loop disagree
+DIFFERING_CASES = [
+    ("one-way match: a's columns are all in b, b's z is not in a",
+     {"a": pd.DataFrame({"x": [1, 2], "y": [1, 2]}), "b": pd.DataFrame({"x": [1, 2], "z": [3, 4]})}),
+    ("chain within tolerance: a ~ b and b ~ c, but not a ~ c",
+     {"a": pd.DataFrame({"v": [1.0]}), "b": pd.DataFrame({"v": [1.0008]}), "c": pd.DataFrame({"v": [1.0016]})}),
+]
+
+
+def show_differing_cases(work_dir):
+    for description, tables in DIFFERING_CASES:
+        paths = {}
+        for name, df in tables.items():
+            paths[name] = os.path.join(work_dir, f"case-{name}result.csv")
+            df.to_csv(paths[name], index=False)
+        names = {path: name for name, path in paths.items()}
+        print(description)
+        for label, matches in (("classes", compare_result_files(list(paths.values()))), ("pairwise", pairwise_result_files(list(paths.values())))):
+            agreeing = {names[k]: sorted(names[v] for v in vs) for k, vs in matches.items()}
+            print(f"  {label:<9}{agreeing}")
+
+
+def write_candidates(work_dir, num_candidates, num_answers, num_rows, seed):
+    rng = np.random.default_rng(seed)
+    answers = []
+    for _ in range(num_answers):
+        answers.append(pd.DataFrame({"name": [f"item_{j}" for j in rng.integers(0, 500, num_rows)],
+                                     "value": rng.random(num_rows) * 1000, "count": rng.integers(0, 100, num_rows)}))
+    paths = []
+    for i in range(num_candidates):
+        df = answers[rng.integers(num_answers)].copy()
+        if i % 7 == 6:
+            df["count"] = 0
+        df["value"] += rng.uniform(-1e-5, 1e-5, num_rows)
+        df = df.sample(frac=1, random_state=int(rng.integers(1 << 31)))[list(rng.permutation(df.columns))]
+        path = os.path.join(work_dir, f"{num_candidates}-{i}result.csv")
+        df.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_candidates', nargs="+", type=int, default=[8, 32, 64])
+    parser.add_argument('--num_answers', type=int, default=3)
+    parser.add_argument('--num_rows', type=int, default=2000)
+    parser.add_argument('--skip_pairwise_above', type=int, default=32, help="the pairwise loop is quadratic; skip it for more candidates")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cases', action="store_true", help="print the fixed cases where classes and the pairwise loop disagree")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="reforce_vote_")
+    if args.cases:
+        show_differing_cases(work_dir)
+        sys.exit()
+    print(f"{'candidates':>11}{'fingerprint(s)':>16}{'pairwise(s)':>13}{'classes':>9}  same")
+    for n in args.num_candidates:
+        paths = write_candidates(work_dir, n, args.num_answers, args.num_rows, args.seed)
+        start_time = time.time()
+        matches = compare_result_files(paths)
+        fingerprint_s = time.time() - start_time
+        classes = len({tuple(sorted(v + [k])) for k, v in matches.items()})
+        if n <= args.skip_pairwise_above:
+            start_time = time.time()
+            same = pairwise_result_files(paths) == matches
+            print(f"{n:>11}{fingerprint_s:>16.2f}{time.time() - start_time:>13.2f}{classes:>9}  {same}")
+        else:
+            print(f"{n:>11}{fingerprint_s:>16.2f}{'-':>13}{classes:>9}  -")
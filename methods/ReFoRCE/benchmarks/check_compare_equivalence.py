@@ -0,0 +1,181 @@
+"""Equivalence of utils.compare_pandas_table with compare_pandas_table_legacy.
+
+First runs FIXED_CASES, deterministic edge cases (NaN and None, mixed
+dtypes, tolerance boundaries, infinities, duplicates under ignore_order,
+condition_cols) each with its expected result, which both functions must
+return. Then generates random pred/gold table pairs meant to sit on the edges of the
+matching rules: values within and just outside the tolerance, ints against
+floats, NaN/None, infinities, strings that look like numbers, shuffled rows
+and columns, condition_cols and non-string objects. Every pair is checked
+with both tolerances (voting 1e-3, evaluation 1e-2) and both orderings;
+any disagreement is printed and makes the script exit 1. Then times both on
+a wide, long table.
+
+    python benchmarks/check_compare_equivalence.py --cases 3000
+"""
+import argparse
+import decimal
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+from utils import compare_pandas_table, compare_pandas_table_legacy
+
+TOLERANCES = [1e-3, 1e-2]
+NAN = float("nan")
+INF = float("inf")
+
+
+def table(*columns):
+    return pd.DataFrame({f"c{i}": values for i, values in enumerate(columns)})
+
+
+# (name, pred, gold, condition_cols, ignore_order, tolerance, expected)
+FIXED_CASES = [
+    ("NaN matches NaN", table([1.0, NAN]), table([1.0, NAN]), [], False, 1e-3, 1),
+    ("None matches NaN", table([1, None, "a"]), table([1, NAN, "a"]), [], False, 1e-3, 1),
+    ("NaN does not match 0", table([1.0, NAN]), table([1.0, 0.0]), [], False, 1e-3, 0),
+    ("int matches float", table([1, 2]), table([1.0, 2.0]), [], False, 1e-3, 1),
+    ("bool matches int", table([True, False]), table([1, 0]), [], False, 1e-3, 1),
+    ("numeric string does not match number", table(["1", "2"]), table([1, 2]), [], False, 1e-3, 0),
+    ("mixed object column", table([1, "a", None, 2.5]), table([1.0, "a", NAN, 2.5]), [], False, 1e-3, 1),
+    ("mixed object column, one string differs", table([1, "a", None]), table([1, "b", None]), [], False, 1e-3, 0),
+    ("Decimal matches equal Decimal", table([decimal.Decimal(1), decimal.Decimal(2)]), table([decimal.Decimal(1), decimal.Decimal(2)]), [], False, 1e-3, 1),
+    ("Decimal compares by ==, not within tolerance", table([decimal.Decimal(1)]), table([1.0005]), [], False, 1e-3, 0),
+    ("within tolerance", table([1.0, 2.0]), table([1.0009, 2.0]), [], False, 1e-3, 1),
+    ("at the tolerance", table([0.0]), table([0.001]), [], False, 1e-3, 1),
+    ("just outside tolerance", table([1.0]), table([1.0011]), [], False, 1e-3, 0),
+    ("within the evaluation tolerance", table([1.0]), table([1.0099]), [], False, 1e-2, 1),
+    ("outside the evaluation tolerance", table([1.0]), table([1.0101]), [], False, 1e-2, 0),
+    ("relative tolerance of large numbers", table([1e12]), table([1e12 + 1]), [], False, 1e-3, 1),
+    ("-0.0 matches 0.0", table([-0.0]), table([0.0]), [], False, 1e-3, 1),
+    ("inf matches inf", table([INF, -INF]), table([INF, -INF]), [], False, 1e-3, 1),
+    ("inf does not match -inf", table([INF]), table([-INF]), [], False, 1e-3, 0),
+    ("inf does not match a large number", table([INF]), table([1e308]), [], False, 1e-3, 0),
+    ("row order matters without ignore_order", table(["a", "b"]), table(["b", "a"]), [], False, 1e-3, 0),
+    ("row order ignored", table(["a", "b"]), table(["b", "a"]), [], True, 1e-3, 1),
+    ("ignore_order keeps duplicates", table(["a", "b", "b"]), table(["a", "a", "b"]), [], True, 1e-3, 0),
+    ("ignore_order with the same duplicates", table(["b", "a", "a"]), table(["a", "a", "b"]), [], True, 1e-3, 1),
+    ("ignore_order on numbers within tolerance", table([3.0, 1.0, 2.0]), table([1.0005, 2.0, 3.0]), [], True, 1e-3, 1),
+    ("ignore_order on mixed values", table([None, "1", 1]), table([1, "1", None]), [], True, 1e-3, 1),
+    ("ignore_order on NaN among numbers", table([NAN, 2.0, 1.0]), table([1.0, NAN, 2.0]), [], True, 1e-3, 1),
+    ("different lengths", table([1, 2, 3]), table([1, 2]), [], True, 1e-3, 0),
+    ("gold columns found in other order", table(["x", "y"], [1, 2]), table([1, 2], ["x", "y"]), [], False, 1e-3, 1),
+    ("pred may have extra columns", table([1, 2], [5, 6]), table([1, 2]), [], False, 1e-3, 1),
+    ("a gold column missing from pred", table([1, 2]), table([1, 2], [5, 6]), [], False, 1e-3, 0),
+    ("condition_cols only check those columns", table([1, 2]), table([1, 2], [5, 6]), [0], False, 1e-3, 1),
+    ("condition_cols column missing from pred", table([1, 2]), table([1, 2], [5, 6]), [1], False, 1e-3, 0),
+    ("one pred column can match several gold columns", table([1, 2]), table([1, 2], [1.0, 2.0]), [], False, 1e-3, 1),
+    ("empty tables", table([]), table([]), [], False, 1e-3, 1),
+]
+
+
+def check_fixed():
+    failures = 0
+    for name, pred, gold, condition_cols, ignore_order, tolerance, expected in FIXED_CASES:
+        legacy = compare_pandas_table_legacy(pred, gold, condition_cols, ignore_order, tolerance)
+        vectorized = compare_pandas_table(pred, gold, condition_cols, ignore_order, tolerance)
+        if not legacy == vectorized == expected:
+            failures += 1
+            print(f"fixed case {name!r}: expected={expected} legacy={legacy} vectorized={vectorized}")
+    return failures
+
+
+def random_value(rng, kind):
+    if kind == "int":
+        return int(rng.integers(-20, 20))
+    if kind == "float":
+        return float(rng.choice([rng.normal() * 100, round(rng.normal() * 10, 2), np.inf, -np.inf, 0.0, -0.0]))
+    if kind == "str":
+        return str(rng.choice(["a", "b", "10", "9", "1.0", "nan", "", "None", "x y"]))
+    if kind == "mixed":
+        return random_value(rng, str(rng.choice(["int", "float", "str", "na"])))
+    if kind == "na":
+        return None if rng.random() < 0.5 else np.nan
+    return decimal.Decimal(int(rng.integers(0, 3)))
+
+
+def random_table(rng, num_rows, num_cols):
+    kinds = rng.choice(["int", "float", "str", "mixed", "na", "object"], size=num_cols, p=[0.3, 0.3, 0.2, 0.1, 0.05, 0.05])
+    columns = {}
+    for i, kind in enumerate(kinds):
+        values = [random_value(rng, kind) for _ in range(num_rows)]
+        if kind in ("int", "float") and num_rows and rng.random() < 0.3:
+            values[int(rng.integers(num_rows))] = np.nan
+        columns[f"c{i}"] = values
+    return pd.DataFrame(columns)
+
+
+def perturb(rng, df):
+    """A variant of df that may or may not still match it."""
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_float_dtype(df[col]):
+            noise = rng.choice([0, 5e-4, 1e-3, 2e-3, 9e-3, 1e-2, 2e-2])
+            df[col] = df[col] + noise * rng.choice([-1, 1], size=len(df))
+        elif pd.api.types.is_integer_dtype(df[col]) and rng.random() < 0.3:
+            df[col] = df[col].astype(float)
+    if len(df) and rng.random() < 0.2:
+        row, col = int(rng.integers(len(df))), int(rng.integers(df.shape[1]))
+        df.iat[row, col] = random_value(rng, "mixed") if df.dtypes.iloc[col] == object else np.nan
+    if rng.random() < 0.5:
+        df = df.sample(frac=1, random_state=int(rng.integers(1 << 31)))
+    if rng.random() < 0.5:
+        df = df[list(rng.permutation(df.columns))]
+    if rng.random() < 0.2 and df.shape[1] > 1:
+        df = df.drop(columns=df.columns[int(rng.integers(df.shape[1]))])
+    return df
+
+
+def check(cases, seed):
+    rng = np.random.default_rng(seed)
+    failures = 0
+    for case in range(cases):
+        gold = random_table(rng, int(rng.integers(0, 12)), int(rng.integers(1, 5)))
+        pred = perturb(rng, gold) if rng.random() < 0.8 else random_table(rng, len(gold), int(rng.integers(1, 5)))
+        condition_cols = sorted(rng.choice(gold.shape[1], size=int(rng.integers(1, gold.shape[1] + 1)), replace=False).tolist()) if rng.random() < 0.3 else []
+        for tolerance in TOLERANCES:
+            for ignore_order in (False, True):
+                expected = compare_pandas_table_legacy(pred, gold, condition_cols, ignore_order, tolerance)
+                got = compare_pandas_table(pred, gold, condition_cols, ignore_order, tolerance)
+                if expected != got:
+                    failures += 1
+                    print(f"case {case}: tolerance={tolerance} ignore_order={ignore_order} condition_cols={condition_cols} legacy={expected} vectorized={got}")
+                    print(f"gold:\n{gold}\npred:\n{pred}\n")
+    return failures
+
+
+def timing(num_rows, num_cols, seed):
+    rng = np.random.default_rng(seed)
+    gold = pd.DataFrame({f"c{i}": rng.normal(size=num_rows) * 100 if i % 2 else [f"s{j}" for j in rng.integers(0, 1000, num_rows)]
+                         for i in range(num_cols)})
+    pred = gold.sample(frac=1, random_state=seed)[list(reversed(gold.columns))]
+    results = {}
+    for name, func in [("vectorized", compare_pandas_table), ("legacy", compare_pandas_table_legacy)]:
+        start_time = time.time()
+        results[name] = func(pred, gold, ignore_order=True)
+        results[name + "_s"] = time.time() - start_time
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', type=int, default=3000)
+    parser.add_argument('--num_rows', type=int, default=20000)
+    parser.add_argument('--num_cols', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    fixed_failures = check_fixed()
+    print(f"{len(FIXED_CASES)} fixed cases: {fixed_failures} failures")
+    failures = fixed_failures + check(args.cases, args.seed)
+    print(f"{args.cases} cases x {len(TOLERANCES)} tolerances x 2 orderings: {failures} mismatches")
+    r = timing(args.num_rows, args.num_cols, args.seed)
+    print(f"{args.num_rows} rows x {args.num_cols} columns, ignore_order: vectorized {r['vectorized_s']:.2f}s, legacy {r['legacy_s']:.2f}s "
+          f"({r['legacy_s'] / r['vectorized_s']:.1f}x), results {r['vectorized']} / {r['legacy']}")
+    sys.exit(1 if failures else 0)
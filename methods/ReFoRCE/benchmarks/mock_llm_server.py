@@ -0,0 +1,217 @@
+"""OpenAI-compatible stub server for offline benchmarks.
+
+Serves POST /v1/chat/completions and POST /v1/responses with a configurable
+latency distribution, random 429 injection and scripted responses, and
+GET /stats with call counts and server-side latencies.
+
+The default responder answers every ReFoRCE stage (answer format,
+exploration, self-refine, model vote) with SQL against the tables named in
+the conversation. A script file overrides it: a JSON list of
+{"match": regex, "response": text} tried in order on the last user message;
+"{table}" in a response is replaced by the first table of the schema.
+
+    python benchmarks/mock_llm_server.py --port 8765 --latency lognormal --latency_mean 1.5 --rate_429 0.05
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TABLE_PATTERNS = [
+    re.compile(r"Table full name:\s*([^\s]+)"),
+    re.compile(r"CREATE TABLE\s+(?:IF NOT EXISTS\s+)?[\"`]?(\w+)", re.IGNORECASE),
+]
+
+
+def find_tables(messages):
+    for message in messages:
+        content = message_text(message)
+        for pattern in TABLE_PATTERNS:
+            tables = pattern.findall(content)
+            if tables:
+                return list(dict.fromkeys(tables))
+    return []
+
+
+def message_text(message):
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def default_response(messages):
+    prompt = message_text(messages[-1])
+    tables = find_tables(messages) or ["sqlite_master"]
+    table = tables[0]
+    if "```csv```" in prompt:
+        return "```csv\ncol_a,col_b\nvalue_a:str,value_b:int\n```"
+    if "Write at most 10" in prompt:
+        sqls = [f'--Description: peek at "{t}"\nSELECT * FROM "{t}" LIMIT 20;' for t in tables[:5]]
+        while len(sqls) < 3:
+            sqls.append(f'--Description: count rows\nSELECT COUNT(*) FROM "{table}" LIMIT 20;')
+        return "Exploring the data.\n" + "".join(f"```sql\n{sql}\n```\n" for sql in sqls)
+    if "```plaintext" in prompt:
+        return "The first candidate aligns with the task.\n```plaintext\n0result.sql\n```"
+    return f'Thinking step by step.\n```sql\nSELECT * FROM "{table}" LIMIT 5;\n```'
+
+
+class MockLLM:
+    def __init__(self, latency="fixed", latency_mean=0.0, latency_sigma=0.5, rate_429=0.0, script=None, seed=0):
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        self.script = [(re.compile(item["match"], re.DOTALL), item["response"]) for item in (script or [])]
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "rate_limited": 0, "in_flight": 0, "max_in_flight": 0, "latencies": []}
+
+    def sample_latency(self):
+        with self.lock:
+            if self.latency == "fixed" or self.latency_mean <= 0:
+                return max(self.latency_mean, 0.0)
+            if self.latency == "uniform":
+                return self.random.uniform(0, 2 * self.latency_mean)
+            if self.latency == "exponential":
+                return self.random.expovariate(1 / self.latency_mean)
+            if self.latency == "lognormal":
+                mu = math.log(self.latency_mean) - self.latency_sigma ** 2 / 2
+                return self.random.lognormvariate(mu, self.latency_sigma)
+        raise NotImplementedError(f"Unsupported latency distribution: {self.latency}")
+
+    def should_rate_limit(self):
+        with self.lock:
+            return self.random.random() < self.rate_429
+
+    def respond(self, messages):
+        prompt = message_text(messages[-1])
+        for pattern, response in self.script:
+            if pattern.search(prompt):
+                tables = find_tables(messages)
+                return response.replace("{table}", tables[0] if tables else "sqlite_master")
+        return default_response(messages)
+
+
+def usage(messages, text):
+    prompt_tokens = sum(len(message_text(m)) for m in messages) // 4
+    return prompt_tokens, len(text) // 4
+
+
+def make_handler(llm):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, code, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                with llm.lock:
+                    stats = dict(llm.stats, latencies=list(llm.stats["latencies"]))
+                self.send_json(200, stats)
+            else:
+                self.send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if llm.should_rate_limit():
+                with llm.lock:
+                    llm.stats["rate_limited"] += 1
+                self.send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}}, {"retry-after": "0"})
+                return
+
+            with llm.lock:
+                llm.stats["in_flight"] += 1
+                llm.stats["max_in_flight"] = max(llm.stats["max_in_flight"], llm.stats["in_flight"])
+            start_time = time.time()
+            try:
+                time.sleep(llm.sample_latency())
+                if self.path.rstrip("/").endswith("/responses"):
+                    messages = request.get("input", [])
+                    if isinstance(messages, str):
+                        messages = [{"role": "user", "content": messages}]
+                    text = llm.respond(messages)
+                    prompt_tokens, completion_tokens = usage(messages, text)
+                    body = {
+                        "id": f"resp_{uuid.uuid4().hex}", "object": "response", "created_at": int(time.time()),
+                        "model": request.get("model"), "status": "completed",
+                        "output": [{"type": "message", "id": f"msg_{uuid.uuid4().hex}", "role": "assistant", "status": "completed",
+                                    "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+                        "usage": {"input_tokens": prompt_tokens, "output_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens,
+                                  "input_tokens_details": {"cached_tokens": 0}, "output_tokens_details": {"reasoning_tokens": 0}},
+                    }
+                else:
+                    messages = request.get("messages", [])
+                    text = llm.respond(messages)
+                    prompt_tokens, completion_tokens = usage(messages, text)
+                    body = {
+                        "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+                        "model": request.get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens,
+                                  "prompt_tokens_details": {"cached_tokens": 0}, "completion_tokens_details": {"reasoning_tokens": 0}},
+                    }
+            finally:
+                with llm.lock:
+                    llm.stats["in_flight"] -= 1
+                    llm.stats["calls"] += 1
+                    llm.stats["latencies"].append(time.time() - start_time)
+            self.send_json(200, body)
+
+    return Handler
+
+
+def start_server(llm, host="127.0.0.1", port=0):
+    """Start the server in a daemon thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), make_handler(llm))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def add_llm_args(parser):
+    parser.add_argument('--latency', type=str, default="fixed", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument('--latency_mean', type=float, default=0.0)
+    parser.add_argument('--latency_sigma', type=float, default=0.5)
+    parser.add_argument('--rate_429', type=float, default=0.0)
+    parser.add_argument('--script', type=str, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def llm_from_args(args):
+    script = None
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+    return MockLLM(args.latency, args.latency_mean, args.latency_sigma, args.rate_429, script, args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    add_llm_args(parser)
+    args = parser.parse_args()
+    server, base_url = start_server(llm_from_args(args), args.host, args.port)
+    print(f"Mock LLM listening on {base_url} (export OPENAI_BASE_URL={base_url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
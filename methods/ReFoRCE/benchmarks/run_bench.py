@@ -0,0 +1,200 @@
+"""End-to-end throughput benchmark against the mock LLM server.
+
+Generates synthetic SQLite instances, starts the OpenAI-compatible stub and
+drives run.py (or api.query_one) through each scenario, reporting
+instances/min, p50/p95 instance latency (from the run's trace file), LLM call
+counts, peak RSS and peak thread count of the run process.
+
+    python benchmarks/run_bench.py --scenarios refine votes exploration --num_instances 20 --latency lognormal --latency_mean 0.5
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REFORCE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REFORCE_DIR)
+sys.path.insert(0, BENCH_DIR)
+from mock_llm_server import start_server, add_llm_args, llm_from_args
+from synthetic_db import generate
+
+SCENARIOS = {
+    "generate": [],
+    "refine": ["--do_self_refinement", "--max_iter", "5"],
+    "votes": ["--do_self_refinement", "--max_iter", "5", "--do_vote", "--num_votes", "8"],
+    "exploration": ["--do_self_refinement", "--max_iter", "5", "--do_column_exploration", "--column_exploration_model", "{model}",
+                    "--do_vote", "--num_votes", "4"],
+    "full": ["--do_format_restriction", "--format_model", "{model}", "--do_self_refinement", "--max_iter", "5",
+             "--do_column_exploration", "--column_exploration_model", "{model}", "--do_vote", "--num_votes", "8"],
+}
+
+
+def proc_status(pid):
+    status = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                status[key] = value.strip()
+    except OSError:
+        pass
+    return status
+
+
+class ProcessSampler(threading.Thread):
+    """Samples peak RSS and thread count of a child process (Linux /proc)."""
+    def __init__(self, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_mb = 0.0
+        self.peak_threads = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            status = proc_status(self.pid)
+            if not status:
+                break
+            if "VmHWM" in status:
+                self.peak_rss_mb = max(self.peak_rss_mb, int(status["VmHWM"].split()[0]) / 1024)
+            if "Threads" in status:
+                self.peak_threads = max(self.peak_threads, int(status["Threads"]))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def llm_stats(base_url):
+    with urllib.request.urlopen(base_url + "/stats") as r:
+        return json.load(r)
+
+
+def instance_latencies(trace_path):
+    from tracing import load_spans
+    if not os.path.exists(trace_path):
+        return []
+    return [e["dur"] / 1e6 for e in load_spans(trace_path) if e["name"] == "instance"]
+
+
+def summarize(name, wall, latencies, num_instances, stats_before, stats_after, peak_rss_mb, peak_threads):
+    calls = stats_after["calls"] - stats_before["calls"]
+    server_latencies = stats_after["latencies"][len(stats_before["latencies"]):]
+    return {
+        "scenario": name,
+        "instances": num_instances,
+        "wall_s": wall,
+        "instances_per_min": num_instances / wall * 60 if wall else 0.0,
+        "p50_instance_s": float(np.percentile(latencies, 50)) if latencies else None,
+        "p95_instance_s": float(np.percentile(latencies, 95)) if latencies else None,
+        "llm_calls": calls,
+        "rate_limited": stats_after["rate_limited"] - stats_before["rate_limited"],
+        "max_llm_in_flight": stats_after["max_in_flight"],
+        "p95_llm_s": float(np.percentile(server_latencies, 95)) if server_latencies else None,
+        "peak_rss_mb": peak_rss_mb,
+        "peak_threads": peak_threads,
+    }
+
+
+def run_scenario(name, data_dir, work_dir, base_url, args):
+    output_path = os.path.join(work_dir, f"out-{name}")
+    trace_path = os.path.join(work_dir, f"trace-{name}.json")
+    shutil.rmtree(output_path, ignore_errors=True)
+    cmd = [sys.executable, os.path.join(REFORCE_DIR, "run.py"),
+           "--task", "lite", "--subtask", "sqlite",
+           "--db_path", data_dir, "--output_path", output_path,
+           "--generation_model", args.model, "--num_workers", str(args.num_workers),
+           "--trace_path", trace_path]
+    cmd += [a.format(model=args.model) for a in SCENARIOS[name]]
+    cmd += args.extra_args
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY="bench")
+
+    stats_before = llm_stats(base_url)
+    start_time = time.time()
+    with open(os.path.join(work_dir, f"run-{name}.log"), "w") as log:
+        proc = subprocess.Popen(cmd, cwd=REFORCE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        sampler = ProcessSampler(proc.pid)
+        sampler.start()
+        proc.wait()
+        sampler.stop()
+    wall = time.time() - start_time
+    if proc.returncode != 0:
+        print(f"{name}: run.py exited with {proc.returncode}, see {log.name}")
+    return summarize(name, wall, instance_latencies(trace_path), args.num_instances, stats_before, llm_stats(base_url), sampler.peak_rss_mb, sampler.peak_threads)
+
+
+def run_query_one(data_dir, base_url, args):
+    from api import query_one
+    os.environ.update(OPENAI_BASE_URL=base_url, OPENAI_API_KEY="bench")
+    with open(os.path.join(data_dir, "spider2-lite.jsonl")) as f:
+        examples = [json.loads(line) for line in f]
+    stats_before = llm_stats(base_url)
+    latencies = []
+    start_time = time.time()
+    for ex in examples:
+        t = time.time()
+        out = query_one(sqlite_path=os.path.join(data_dir, "databases", ex["db_id"], ex["db_id"] + ".sqlite"),
+                        question=ex["question"], model=args.model, max_iter=5)
+        latencies.append(time.time() - t)
+        shutil.rmtree(out["workdir"], ignore_errors=True)
+    wall = time.time() - start_time
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return summarize("query_one", wall, latencies, len(examples), stats_before, llm_stats(base_url), peak_rss_mb, None)
+
+
+def print_report(results):
+    header = f"{'scenario':<14}{'inst':>6}{'wall(s)':>9}{'inst/min':>10}{'p50(s)':>8}{'p95(s)':>8}{'calls':>7}{'429s':>6}{'rss(MB)':>9}{'threads':>9}"
+    print(header)
+    fmt = lambda v, spec: format(v, spec) if v is not None else "-"
+    for r in results:
+        print(f"{r['scenario']:<14}{r['instances']:>6}{r['wall_s']:>9.1f}{r['instances_per_min']:>10.1f}{fmt(r['p50_instance_s'], '>8.2f'):>8}{fmt(r['p95_instance_s'], '>8.2f'):>8}"
+              f"{r['llm_calls']:>7}{r['rate_limited']:>6}{r['peak_rss_mb']:>9.0f}{fmt(r['peak_threads'], '>9d'):>9}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', nargs="+", default=["refine", "votes"], choices=list(SCENARIOS) + ["query_one"])
+    parser.add_argument('--model', type=str, default="gpt-4o")
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--num_instances', type=int, default=8)
+    parser.add_argument('--num_dbs', type=int, default=2)
+    parser.add_argument('--num_tables', type=int, default=5)
+    parser.add_argument('--num_rows', type=int, default=1000)
+    parser.add_argument('--num_columns', type=int, default=6)
+    parser.add_argument('--work_dir', type=str, default=None)
+    parser.add_argument('--report', type=str, default=None)
+    parser.add_argument('--extra_args', nargs=argparse.REMAINDER, default=[], help="passed through to run.py")
+    add_llm_args(parser)
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="reforce_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    data_dir = str(generate(os.path.join(work_dir, "data"), args.num_instances, args.num_dbs, args.num_tables, args.num_rows, args.num_columns, args.seed))
+    server, base_url = start_server(llm_from_args(args))
+    print(f"Mock LLM at {base_url}, data in {data_dir}")
+
+    results = []
+    for name in args.scenarios:
+        if name == "query_one":
+            results.append(run_query_one(data_dir, base_url, args))
+        else:
+            results.append(run_scenario(name, data_dir, work_dir, base_url, args))
+    server.shutdown()
+
+    print_report(results)
+    report_path = args.report or os.path.join(work_dir, "report.json")
+    with open(report_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Report saved to {report_path}")
@@ -0,0 +1,106 @@
+"""Generate synthetic SQLite instances for offline benchmarks.
+
+Layout follows scripts/setup_custom_data.py, plus a link to the database
+directly in each instance folder (where get_sqlite_path looks when no db_id is
+known):
+
+  <out>/
+    ├─ databases/<db>/<db>.sqlite       (master copies)
+    ├─ local-bench-0000/
+    │   ├─ prompts.txt                  (same format as reconstruct_data.py)
+    │   ├─ <db>.sqlite
+    │   └─ databases/<db>/<db>.sqlite
+    └─ spider2-lite.jsonl
+
+    python benchmarks/synthetic_db.py --out bench_data --num_instances 20 --num_dbs 4 --num_tables 8 --num_rows 5000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from reconstruct_data import get_sqlite_data
+
+CATEGORIES = ["Fruit", "Household", "Stationery", "Electronics", "Furniture", "Toys", "Garden", "Books"]
+QUESTIONS = [
+    "What is the total amount per category in {table}?",
+    "List the ten most recent rows of {table} with their names.",
+    "How many distinct names appear in {table}?",
+    "For each category, what is the average amount in {table} during 2024?",
+]
+
+
+def build_sqlite(db_file: Path, num_tables, num_rows, num_columns, rnd):
+    conn = sqlite3.connect(db_file)
+    for t in range(num_tables):
+        table = f"t{t:03d}"
+        extra = [f"metric_{c} REAL" for c in range(max(num_columns - 5, 0))]
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, name TEXT, category TEXT, amount REAL, created_at TEXT"
+                     + "".join(", " + c for c in extra) + ")")
+        rows = [
+            (i, f"item_{rnd.randrange(num_rows)}", rnd.choice(CATEGORIES), round(rnd.uniform(0, 1000), 2),
+             f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}", *[rnd.random() for _ in extra])
+            for i in range(num_rows)
+        ]
+        conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * (5 + len(extra)))})", rows)
+    conn.commit()
+    conn.close()
+
+
+def make_prompts(db_file, ex_id):
+    table_names, prompts = get_sqlite_data(str(db_file), ex_id, add_sample_rows=True)
+    prompts += "External knowledge that might be helpful: \nNone\n"
+    prompts += "The table structure information is (table names): \n" + str(table_names) + "\n"
+    return prompts
+
+
+def link_or_copy(src: Path, dst: Path):
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        dst.write_bytes(src.read_bytes())
+
+
+def generate(out, num_instances=10, num_dbs=2, num_tables=5, num_rows=1000, num_columns=6, seed=0):
+    out = Path(out).resolve()
+    rnd = random.Random(seed)
+    db_names = [f"benchdb{d}" for d in range(num_dbs)]
+    prompts = {}
+    for db in db_names:
+        master = out / "databases" / db
+        master.mkdir(parents=True, exist_ok=True)
+        build_sqlite(master / f"{db}.sqlite", num_tables, num_rows, num_columns, rnd)
+        prompts[db] = make_prompts(master / f"{db}.sqlite", db)
+
+    with open(out / "spider2-lite.jsonl", "w", encoding="utf-8") as f:
+        for i in range(num_instances):
+            ex_id = f"local-bench-{i:04d}"
+            db = db_names[i % num_dbs]
+            ex_dir = out / ex_id
+            (ex_dir / "databases" / db).mkdir(parents=True, exist_ok=True)
+            link_or_copy(out / "databases" / db / f"{db}.sqlite", ex_dir / "databases" / db / f"{db}.sqlite")
+            link_or_copy(out / "databases" / db / f"{db}.sqlite", ex_dir / f"{db}.sqlite")
+            (ex_dir / "prompts.txt").write_text(prompts[db], encoding="utf-8")
+            question = QUESTIONS[i % len(QUESTIONS)].format(table=f"t{rnd.randrange(num_tables):03d}")
+            f.write(json.dumps({"instance_id": ex_id, "question": question, "db_id": db, "db": db}) + "\n")
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", type=str, default="bench_data")
+    parser.add_argument("--num_instances", type=int, default=10)
+    parser.add_argument("--num_dbs", type=int, default=2)
+    parser.add_argument("--num_tables", type=int, default=5)
+    parser.add_argument("--num_rows", type=int, default=1000)
+    parser.add_argument("--num_columns", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(generate(args.out, args.num_instances, args.num_dbs, args.num_tables, args.num_rows, args.num_columns, args.seed))
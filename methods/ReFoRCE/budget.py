@@ -0,0 +1,193 @@
+"""Token counting and per-model context budgets for prompt assembly.
+
+Token counts use the model's tiktoken encoding. tiktoken needs its BPE files
+locally (set TIKTOKEN_CACHE_DIR for offline machines); when the encoding cannot
+be loaded we fall back to the usual ~4 characters per token estimate, which
+keeps the old character thresholds as the effective behaviour.
+"""
+import math
+import re
+from functools import lru_cache
+
+CHARS_PER_TOKEN = 4
+# Same size as the old 200000-character THRESHOLD.
+SCHEMA_TOKEN_THRESHOLD = 50000
+
+MODEL_CONTEXT = {
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-4.1-mini": 1047576,
+    "o1-preview": 128000,
+    "o1-mini": 128000,
+    "o1": 200000,
+    "o3": 200000,
+    "o3-mini": 200000,
+    "o3-pro": 200000,
+    "o4-mini": 200000,
+    "deepseek-reasoner": 64000,
+}
+DEFAULT_CONTEXT = 128000
+
+# Tokens kept free for the completion (reasoning models think inside it).
+RESERVED_OUTPUT = {
+    "o1-preview": 32768,
+    "o1-mini": 32768,
+    "o1": 32768,
+    "o3": 32768,
+    "o3-mini": 32768,
+    "o3-pro": 32768,
+    "o4-mini": 32768,
+    "deepseek-reasoner": 16384,
+}
+DEFAULT_RESERVED_OUTPUT = 8192
+
+# Share of the usable context given to each budgeted prompt section; the
+# rest is left to the task text, instructions and conversation history.
+DEFAULT_ALLOCATION = {
+    "schema": 0.6,
+    "exploration": 0.2,
+}
+
+TABLE_SEPARATOR = "-" * 50
+TAIL_MARKER = "External knowledge that might be helpful"
+SAMPLE_ROWS_PATTERN = re.compile(r"Sample rows:\n.*?(?=\n-{10,}\n|\n" + TAIL_MARKER + r"|\Z)", re.DOTALL)
+DESCRIPTION_PATTERN = re.compile(r"Description:[^\n]*")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text, model="gpt-4o"):
+    if not text:
+        return 0
+    enc = get_encoding(model)
+    if enc is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def cut_tokens(text, max_tokens, model="gpt-4o"):
+    """Token counterpart of utils.hard_cut."""
+    if not max_tokens or count_tokens(text, model) <= max_tokens:
+        return text
+    enc = get_encoding(model)
+    if enc is None:
+        return text[:int(max_tokens * CHARS_PER_TOKEN)] + "\n"
+    return enc.decode(enc.encode(text, disallowed_special=())[:int(max_tokens)]) + "\n"
+
+
+def split_table_info(table_info):
+    """Split a prompts.txt text into (header, table blocks, tail)."""
+    tail_start = table_info.find(TAIL_MARKER)
+    if tail_start == -1:
+        tail_start = len(table_info)
+    body, tail = table_info[:tail_start], table_info[tail_start:]
+    parts = body.split(TABLE_SEPARATOR)
+    header = ""
+    blocks = []
+    for part in parts:
+        if "Table full name:" in part:
+            blocks.append(part)
+        elif not blocks:
+            header += (TABLE_SEPARATOR if header else "") + part
+        else:
+            blocks[-1] += TABLE_SEPARATOR + part
+    return header, blocks, tail
+
+
+def join_table_info(header, blocks, tail):
+    body = header + "".join(TABLE_SEPARATOR + block for block in blocks)
+    if body and not body.endswith("\n"):
+        body += "\n"
+    return body + tail
+
+
+def column_signature(block):
+    return tuple(DESCRIPTION_PATTERN.sub("", line).strip() for line in block.splitlines() if line.strip().startswith("Column name:"))
+
+
+def drop_redundant_tables(blocks):
+    seen = set()
+    kept = []
+    for block in blocks:
+        signature = column_signature(block)
+        if signature and signature in seen:
+            continue
+        seen.add(signature)
+        kept.append(block)
+    return kept
+
+
+class PromptBudget:
+    def __init__(self, model="gpt-4o", context_tokens=None, reserved_output=None, allocation=None):
+        self.model = model or "gpt-4o"
+        self.context_tokens = context_tokens or MODEL_CONTEXT.get(self.model, DEFAULT_CONTEXT)
+        self.reserved_output = reserved_output if reserved_output is not None else RESERVED_OUTPUT.get(self.model, DEFAULT_RESERVED_OUTPUT)
+        self.allocation = dict(DEFAULT_ALLOCATION)
+        if allocation:
+            self.allocation.update(allocation)
+
+    @property
+    def usable_tokens(self):
+        return max(self.context_tokens - self.reserved_output, 0)
+
+    def section_limit(self, section):
+        return int(self.usable_tokens * self.allocation[section])
+
+    def count(self, text):
+        return count_tokens(text, self.model)
+
+    def fits(self, text, section):
+        return self.count(text) <= self.section_limit(section)
+
+    def cut(self, text, max_tokens=None, section=None):
+        if max_tokens is None:
+            max_tokens = self.section_limit(section)
+        return cut_tokens(text, max_tokens, self.model)
+
+    def fit_table_info(self, table_info, max_tokens=None):
+        """Trim schema text by priority until it fits: column descriptions,
+        then sample rows, then tables repeating an earlier column layout, then
+        trailing tables. The table structure listing in the tail is always kept."""
+        if max_tokens is None:
+            max_tokens = self.section_limit("schema")
+        if self.count(table_info) <= max_tokens:
+            return table_info
+
+        table_info = DESCRIPTION_PATTERN.sub("", table_info)
+        if self.count(table_info) <= max_tokens:
+            return table_info
+
+        table_info = SAMPLE_ROWS_PATTERN.sub("", table_info)
+        if self.count(table_info) <= max_tokens:
+            return table_info
+
+        header, blocks, tail = split_table_info(table_info)
+        blocks = drop_redundant_tables(blocks)
+        table_info = join_table_info(header, blocks, tail)
+        if self.count(table_info) <= max_tokens or not blocks:
+            return self.cut(table_info, max_tokens)
+
+        fixed = self.count(header) + self.count(tail)
+        block_tokens = [self.count(TABLE_SEPARATOR + block) for block in blocks]
+        total = fixed + sum(block_tokens)
+        while len(blocks) > 1 and total > max_tokens:
+            blocks.pop()
+            total -= block_tokens.pop()
+        return self.cut(join_table_info(header, blocks, tail), max_tokens)
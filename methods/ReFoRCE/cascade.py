@@ -0,0 +1,128 @@
+"""Model cascades: a cheap model first, a stronger one only when it fails.
+
+run.py --cascade_config reads a JSON file giving stages a ladder of models
+and the triggers that move a stage one rung up:
+
+    {
+        "exploration": {"models": ["gpt-4o-mini", "o3"], "escalate_on": ["inadequate"]},
+        "generation": {"models": ["gpt-4o-mini", "o3"], "escalate_on": ["no_convergence"]},
+        "vote": {"escalate_on": ["disagreement"], "min_agreement": 0.5},
+        "model_vote": {"models": ["o3"]}
+    }
+
+    exploration  inadequate      exploration ran out of tries
+    generation   no_convergence  self-refine (or gen) saved no SQL
+    model_vote   no_choice       the model named no candidate SQL
+    vote         disagreement    at most min_agreement of the votes agree;
+                                 the instance votes again with exploration
+                                 and generation one rung up, and only the
+                                 new votes are counted
+
+A stage is still switched on by its run.py flag; the config replaces the
+single --format_model/--column_exploration_model/--generation_model/
+--model_vote by a ladder, so without a config every stage keeps its model
+and nothing escalates. Every cascaded stage run records a "cascade" metric
+(stage, model, level, escalated, trigger) and print_summary reports the
+escalation rate of each stage.
+"""
+import json
+import threading
+from collections import defaultdict
+from metrics import get_recorder
+
+TRIGGERS = {
+    "format": set(),
+    "exploration": {"inadequate"},
+    "generation": {"no_convergence"},
+    "model_vote": {"no_choice"},
+    "vote": {"disagreement"},
+}
+# vote indices of an escalated vote round start at level * VOTE_INDEX_STRIDE
+VOTE_INDEX_STRIDE = 100
+
+
+class Cascade:
+    def __init__(self, config=None, default_models=None):
+        config = config or {}
+        for stage_name, policy in config.items():
+            if stage_name not in TRIGGERS:
+                raise ValueError(f"Unknown cascade stage {stage_name}, expected one of {sorted(TRIGGERS)}")
+            unknown = set(policy.get("escalate_on", [])) - TRIGGERS[stage_name]
+            if unknown:
+                raise ValueError(f"Unknown escalation triggers {sorted(unknown)} for stage {stage_name}")
+        self.config = config
+        self.ladders = {stage_name: [model] for stage_name, model in (default_models or {}).items()}
+        for stage_name, policy in config.items():
+            if policy.get("models"):
+                self.ladders[stage_name] = list(policy["models"])
+        self.counts = defaultdict(lambda: [0, 0])  # stage: [runs, escalated runs]
+        self.lock = threading.Lock()
+
+    def model(self, stage_name, level=0):
+        ladder = self.ladders.get(stage_name) or [None]
+        return ladder[min(level, len(ladder) - 1)]
+
+    def escalates(self, stage_name, trigger, level=0):
+        """Whether trigger moves stage_name from level to a model it has not tried."""
+        if trigger not in self.config.get(stage_name, {}).get("escalate_on", []):
+            return False
+        if stage_name == "vote":
+            return level + 1 < max(len(self.ladders.get(s) or [None]) for s in ("exploration", "generation"))
+        return level + 1 < len(self.ladders.get(stage_name) or [None])
+
+    def vote_disagrees(self, voter, level=0):
+        """Whether the votes of an IncrementalVoter call for another round one
+        rung up; votes stopped by --early_majority have a decided answer."""
+        if voter is None or voter.stop_event.is_set() or not self.escalates("vote", "disagreement", level):
+            return False
+        return voter.agreement() <= self.config["vote"].get("min_agreement", 0.5)
+
+    def run(self, stage_name, trigger, attempt, failed, level=0):
+        """attempt(model) from the model at level up the ladder while
+        failed(result) and the trigger escalates; returns the last result."""
+        start_level = level
+        while True:
+            result = attempt(self.model(stage_name, level))
+            if not (failed(result) and self.escalates(stage_name, trigger, level)):
+                break
+            print(f"Cascade: {stage_name} {trigger} with {self.model(stage_name, level)}, escalating to {self.model(stage_name, level + 1)}")
+            level += 1
+        if self.config:
+            self.record(stage_name, start_level, level, trigger)
+        return result
+
+    def record(self, stage_name, start_level, level, trigger=None):
+        escalated = level > start_level
+        with self.lock:
+            self.counts[stage_name][0] += 1
+            self.counts[stage_name][1] += escalated
+        model = self.model("generation" if stage_name == "vote" else stage_name, level)
+        get_recorder().record(kind="cascade", stage=stage_name, model=model, start_level=start_level,
+                              level=level, escalated=escalated, trigger=trigger if escalated else None)
+
+    def print_summary(self):
+        if not self.config or not self.counts:
+            return
+        print(f"{'cascade stage':<16}{'runs':>7}{'escalated':>11}{'rate':>8}")
+        with self.lock:
+            for stage_name, (runs, escalated) in sorted(self.counts.items()):
+                print(f"{stage_name:<16}{runs:>7}{escalated:>11}{escalated / runs:>8.1%}")
+
+
+_cascade = Cascade()
+
+
+def get_cascade():
+    return _cascade
+
+
+def init_cascade(config_path=None, default_models=None):
+    """Cascade of a --cascade_config file; stages it leaves out keep their
+    default_models ({stage: model})."""
+    global _cascade
+    config = None
+    if config_path:
+        with open(config_path) as f:
+            config = json.load(f)
+    _cascade = Cascade(config, default_models)
+    return _cascade
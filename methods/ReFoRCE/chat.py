@@ -1,11 +1,20 @@
 from openai import OpenAI, AzureOpenAI
 from utils import extract_all_blocks
+from history import get_history_policy
+from metrics import get_recorder, usage_fields, estimate_cost
+from replay import get_bundle, is_replaying
+from voter import VoteCancelled, check_cancelled
+from spending import get_spend
+import copy
 import os
 import sys
+import time
 
 class GPTChat:
-    def __init__(self, azure=False, model="gpt-4o", temperature=1) -> None:
-        if not azure:
+    def __init__(self, azure=False, model="gpt-4o", temperature=1, history_policy=None) -> None:
+        if is_replaying():
+            self.client = None
+        elif not azure:
             if model in ["o1-preview", "o1-mini"]:
                 self.client = OpenAI(
                     api_key=os.environ.get("OPENAI_API_KEY"),
@@ -45,23 +54,53 @@ class GPTChat:
         self.messages = []
         self.model = model
         self.temperature = float(temperature)
+        self.history_policy = history_policy if history_policy is not None else get_history_policy()
+        self.sent_prompt_len = 0
+        self.full_prompt_len = 0
+        self.retries = 0
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "reasoning_tokens": 0}
+        self.stop_event = None
 
     def get_response(self, prompt) -> str:
+        check_cancelled(self.stop_event)
+        get_spend().check()
         self.messages.append({"role": "user", "content": prompt})
-        if self.model in ["o3-pro"]:
-            response = self.client.responses.create(
-                model=self.model,
-                input=self.messages,
-                temperature=self.temperature
-            )
-            main_content = response.output_text
+        messages = self.history_policy.apply(self.messages)
+        self.sent_prompt_len += sum(len(item["content"]) for item in messages)
+        self.full_prompt_len += sum(len(item["content"]) for item in self.messages)
+        start_time = time.time()
+        bundle = get_bundle()
+        try:
+            if bundle and bundle.replaying:
+                replayed = bundle.replay_llm(self.model, prompt)
+                main_content = replayed["response"]
+            elif self.model in ["o3-pro"]:
+                response = self.client.responses.create(
+                    model=self.model,
+                    input=messages,
+                    temperature=self.temperature
+                )
+                main_content = response.output_text
+            else:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature
+                )
+                main_content = response.choices[0].message.content
+        except Exception as e:
+            get_recorder().record(kind="llm", model=self.model, latency=time.time() - start_time, retries=self.retries, error=str(e)[:500], **usage_fields(None))
+            raise
+        if bundle and bundle.replaying:
+            usage = replayed["usage"]
         else:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=self.messages,
-                temperature=self.temperature
-            )
-            main_content = response.choices[0].message.content
+            usage = usage_fields(getattr(response, "usage", None))
+            if bundle:
+                bundle.record_llm(self.model, prompt, main_content, usage)
+        for k, v in usage.items():
+            self.usage[k] += v
+        get_recorder().record(kind="llm", model=self.model, latency=time.time() - start_time, retries=self.retries,
+                              cost=estimate_cost(self.model, usage["prompt_tokens"], usage["completion_tokens"], usage["cached_tokens"]), **usage)
         self.messages.append({"role": "assistant", "content": main_content})
         return main_content
 
@@ -70,8 +109,11 @@ class GPTChat:
         max_try = 3
         while code_blocks == [] and max_try > 0:
             max_try -= 1
+            self.retries = 2 - max_try
             try:
                 response = self.get_response(prompt)
+            except VoteCancelled:
+                raise
             except Exception as e:
                 print(f"max_try: {max_try}, exception: {e}")
                 continue
@@ -86,8 +128,11 @@ class GPTChat:
         max_try = 3
         while max_try > 0:
             max_try -= 1
+            self.retries = 2 - max_try
             try:
                 response = self.get_response(prompt)
+            except VoteCancelled:
+                raise
             except Exception as e:
                 print(f"max_try: {max_try}, exception: {e}")
                 continue
@@ -98,11 +143,34 @@ class GPTChat:
         
         return response
 
+    def fork(self):
+        """A session continuing this conversation on its own, for a parallel
+        branch; it shares the client and starts with empty counters."""
+        branch = copy.copy(self)
+        branch.messages = list(self.messages)
+        branch.sent_prompt_len = 0
+        branch.full_prompt_len = 0
+        branch.usage = dict.fromkeys(self.usage, 0)
+        return branch
+
+    def merge(self, branch, adopt=False):
+        """Add a fork's counters to this session; with adopt, continue from
+        its conversation."""
+        self.sent_prompt_len += branch.sent_prompt_len
+        self.full_prompt_len += branch.full_prompt_len
+        for k, v in branch.usage.items():
+            self.usage[k] += v
+        if adopt:
+            self.messages = branch.messages
+
     def get_message_len(self):
         return {
             "prompt_len": sum(len(item["content"]) for item in self.messages if item["role"] == "user"),
             "response_len": sum(len(item["content"]) for item in self.messages if item["role"] == "assistant"),
-            "num_calls": len(self.messages) // 2
+            "num_calls": len(self.messages) // 2,
+            "sent_len": self.sent_prompt_len,
+            "saved_len": self.full_prompt_len - self.sent_prompt_len,
+            **self.usage
         }
     
     def init_messages(self):
@@ -0,0 +1,40 @@
+"""Process pool for the CPU-bound post-processing of worker threads.
+
+Worker threads mostly wait on LLM and database calls, but reading and
+comparing result CSVs in vote_result, summarizing a result in self_refine
+and splitting SQL with sqlparse are pure Python/pandas work that holds the
+GIL and stalls every other thread. With run.py --cpu_workers N these calls
+run in a pool of N processes instead; a thread blocks on its own call only.
+
+Tables are handed over by path: the CSVs are already on disk, so only file
+names go to the pool and small summaries come back, with no DataFrame
+pickling either way. Without a pool (the default) run_cpu calls the function
+inline. Functions must be importable module-level functions.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+_pool = None
+
+
+def init_cpu_pool(workers):
+    """Start a pool of workers processes (none for 0). Processes are spawned,
+    not forked, since the parent already runs threads."""
+    global _pool
+    shutdown_cpu_pool()
+    if workers:
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def run_cpu(func, *args, **kwargs):
+    if _pool is None:
+        return func(*args, **kwargs)
+    return _pool.submit(func, *args, **kwargs).result()
+
+
+def shutdown_cpu_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
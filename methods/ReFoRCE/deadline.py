@@ -0,0 +1,76 @@
+"""Latency budget of an instance (run.py --deadline, api.query_one(deadline=)).
+
+The clock starts when the instance does. Before an optional stage the
+pipeline asks whether the time left still covers the stage plus
+RESERVED_ITERATIONS self-refine iterations, and skips format_answer or
+column exploration if not (allow(), which records the skipped stage);
+inside exploration, a failed probe is not self-corrected once the
+correction would not fit, and exploration ends with the results so far
+(fits(): the stage ran, cut short, and is not recorded as skipped); before each self-refine iteration it stops once
+one more iteration would not fit. Stage times are estimated as LLM calls
+(STAGE_CALLS) at the mean latency of the run's recent calls. A call or
+query already sent is not interrupted, so an instance can overrun by one
+call.
+
+A self-refine stopped by the deadline saves its best validated result so
+far (the last one that ran with no nested values or empty columns, else the
+last one that ran) instead of nothing; with none yet, the instance has no
+answer and api.query_one returns an empty one. <instance dir>/deadline.json
+records the skipped stages and whether the instance stopped early.
+"""
+import json
+import os
+import threading
+import time
+from metrics import get_recorder
+
+DEADLINE_FILE = "deadline.json"
+DEFAULT_CALL_SECONDS = 5.0
+STAGE_CALLS = {"format": 1, "exploration": 3, "self-correct": 1, "iteration": 1}
+RESERVED_ITERATIONS = 2
+
+
+def call_seconds(recent=20):
+    """Mean latency of the last LLM calls of this run."""
+    recorder = get_recorder()
+    with recorder.lock:
+        latencies = [r["latency"] for r in recorder.records[-200:] if r.get("kind", "llm") == "llm" and not r.get("error")][-recent:]
+    return sum(latencies) / len(latencies) if latencies else DEFAULT_CALL_SECONDS
+
+
+class Deadline:
+    def __init__(self, seconds, start_time=None):
+        self.seconds = seconds
+        self.start_time = start_time if start_time is not None else time.time()
+        self.skipped = []
+        self.stopped_early = False
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        return self.seconds - (time.time() - self.start_time)
+
+    def fits(self, stage_name, reserve=0):
+        """Whether stage_name and reserve more self-refine iterations fit in
+        the time left."""
+        calls = STAGE_CALLS[stage_name] + reserve * STAGE_CALLS["iteration"]
+        return self.remaining() >= calls * call_seconds()
+
+    def allow(self, stage_name):
+        """fits() for an optional stage, keeping RESERVED_ITERATIONS for
+        self-refine; a skipped stage is recorded."""
+        if self.fits(stage_name, RESERVED_ITERATIONS):
+            return True
+        with self.lock:
+            if stage_name not in self.skipped:
+                self.skipped.append(stage_name)
+        print(f"Deadline: {self.remaining():.1f}s left, skipping {stage_name}")
+        return False
+
+    def stop_early(self):
+        with self.lock:
+            self.stopped_early = True
+
+    def save(self, search_directory):
+        with open(os.path.join(search_directory, DEADLINE_FILE), "w") as f:
+            json.dump({"deadline": self.seconds, "elapsed": time.time() - self.start_time,
+                       "skipped": self.skipped, "stopped_early": self.stopped_early}, f)
@@ -1,17 +1,25 @@
 import re
 import os
 import json
-import math
 import pandas as pd
 import argparse
 from io import StringIO
 import csv
 from tqdm import tqdm
-from sql import SqlEnv
-from utils import get_api_name, get_db_id, get_sqlite_path
+import utils
+from logs import BLOB_DIR_NAME
+from artifact_store import ArtifactStore
+from precompute_gold import precompute_gold, spider2_gold_jobs
+import tempfile
+import shutil
 import sys
+import hashlib
+import functools
+import concurrent.futures
 csv.field_size_limit(sys.maxsize)
 
+EVAL_MANIFEST = ".eval_manifest.json"
+
 def load_jsonl_to_dict(jsonl_file):
     data_dict = {}
     with open(jsonl_file, 'r') as file:
@@ -27,6 +35,27 @@ def load_json_list_to_dict(json_file_path):
     data_dict = {item['instance_id']: item for item in data_list}
     return data_dict
 
+@functools.lru_cache(maxsize=None)
+def load_eval_standard(gold_result_dir, task):
+    return load_jsonl_to_dict(os.path.join('/'.join(gold_result_dir.split("/")[:-1]), f"spider2{task}_eval.jsonl"))
+
+@functools.lru_cache(maxsize=None)
+def list_gold_dir(gold_result_dir):
+    return sorted(os.listdir(gold_result_dir))
+
+def gold_csv_files(gold_result_dir, example_id):
+    pattern = re.compile(rf'^{re.escape(example_id)}(_[a-z])?\.csv$')
+    return [file for file in list_gold_dir(gold_result_dir) if pattern.match(file)]
+
+@functools.lru_cache(maxsize=256)
+def read_gold_csv(path):
+    return pd.read_csv(path)
+
+@functools.lru_cache(maxsize=256)
+def read_gold_tuples(path):
+    with open(path) as f:
+        return set(get_tuple(f.read()))
+
 def compare_multi_pandas_table(pred, multi_gold, multi_condition_cols=[], multi_ignore_order=False):
     if multi_condition_cols == [] or multi_condition_cols == [[]] or multi_condition_cols == [None] or multi_condition_cols == None:
         multi_condition_cols = [[] for _ in range(len(multi_gold))]
@@ -40,7 +69,7 @@ def compare_multi_pandas_table(pred, multi_gold, multi_condition_cols=[], multi_
     return 0
 
 def compare_pandas_table(pred, gold, condition_cols=[], ignore_order=False):
-    """_summary_
+    """utils.compare_pandas_table with the evaluation tolerance of 1e-2.
 
     Args:
         pred (Dataframe): _description_
@@ -49,62 +78,20 @@ def compare_pandas_table(pred, gold, condition_cols=[], ignore_order=False):
         ignore_order (bool, optional): _description_. Defaults to False.
 
     """
-    # print('condition_cols', condition_cols)
-    
-    tolerance = 1e-2
-
-    def vectors_match(v1, v2, tol=tolerance, ignore_order_=False):
-        if ignore_order_:
-            v1, v2 = (sorted(v1, key=lambda x: (x is None, str(x), isinstance(x, (int, float)))),
-                    sorted(v2, key=lambda x: (x is None, str(x), isinstance(x, (int, float)))))
-        if len(v1) != len(v2):
-            return False
-        for a, b in zip(v1, v2):
-            if pd.isna(a) and pd.isna(b):
-                continue
-            elif isinstance(a, (int, float)) and isinstance(b, (int, float)):
-                if not math.isclose(float(a), float(b), abs_tol=tol):
-                    return False
-            elif a != b:
-                return False
-        return True
-    
-    if condition_cols != []:
-        gold_cols = gold.iloc[:, condition_cols]
-    else:
-        gold_cols = gold
-    pred_cols = pred
-
-    t_gold_list = gold_cols.transpose().values.tolist()
-    t_pred_list = pred_cols.transpose().values.tolist()
-    score = 1
-    for _, gold in enumerate(t_gold_list):
-        if not any(vectors_match(gold, pred, ignore_order_=ignore_order) for pred in t_pred_list):
-            score = 0
-        else:
-            for j, pred in enumerate(t_pred_list):
-                if vectors_match(gold, pred, ignore_order_=ignore_order):
-                    break
-
-    return score
+    return utils.compare_pandas_table(pred, gold, condition_cols, ignore_order, tolerance=1e-2)
 
 
 def evaluate_spider2sql(gold_result_dir, csv_pth, example_id, task="lite"):
-    eval_standard_dict = load_jsonl_to_dict(os.path.join('/'.join(gold_result_dir.split("/")[:-1]), f"spider2{task}_eval.jsonl"))
-    eval_ids = list(eval_standard_dict.keys())
-    eval_ids = sorted(eval_ids)  # sorted, for reproduce result
+    eval_standard_dict = load_eval_standard(gold_result_dir, task)
     
     try:
         pred_pd = pd.read_csv(csv_pth)
-        pattern = re.compile(rf'^{re.escape(example_id)}(_[a-z])?\.csv$')
-        all_files = os.listdir(gold_result_dir)
-        csv_files = [file for file in all_files if pattern.match(file)]
-        csv_files = sorted(csv_files)
+        csv_files = gold_csv_files(gold_result_dir, example_id)
         if len(csv_files) == 1:
-            gold_pd = pd.read_csv(os.path.join(gold_result_dir, example_id+".csv"))
+            gold_pd = read_gold_csv(os.path.join(gold_result_dir, example_id+".csv"))
             score = compare_pandas_table(pred_pd, gold_pd, eval_standard_dict.get(example_id)['condition_cols'], eval_standard_dict.get(example_id)['ignore_order'])
         elif len(csv_files) > 1:
-            gold_pds = [pd.read_csv(os.path.join(gold_result_dir, file)) for file in csv_files]
+            gold_pds = [read_gold_csv(os.path.join(gold_result_dir, file)) for file in csv_files]
             score = compare_multi_pandas_table(pred_pd, gold_pds, eval_standard_dict.get(example_id)['condition_cols'], eval_standard_dict.get(example_id)['ignore_order'])
     except Exception as e:
         print(f"{example_id} ERROR: {e}")
@@ -119,11 +106,10 @@ def get_tuple(csv_str):
 
 def evaluate_bird(gold_result_dir, exec_result_path, example_id, task=None):
     try:
-        with open(os.path.join(gold_result_dir, example_id+".csv")) as f:
-            gold_csv = f.read()
+        gold_tuples = read_gold_tuples(os.path.join(gold_result_dir, example_id+".csv"))
         with open(os.path.join(exec_result_path)) as f:
             exec_result = f.read()
-        if set(get_tuple(exec_result)) == set(get_tuple(gold_csv)):
+        if set(get_tuple(exec_result)) == gold_tuples:
             return 1
         return 0
     except Exception as e:
@@ -131,24 +117,46 @@ def evaluate_bird(gold_result_dir, exec_result_path, example_id, task=None):
     return 0
 
 def update_results(gold_result_dir):
-    sql_env = SqlEnv()
-    gold_sql_dir = gold_result_dir.replace("exec_result", "sql")
-    for sql in os.listdir(gold_sql_dir):
-        api = get_api_name(sql)
-        with open(os.path.join(gold_sql_dir, sql)) as f:
-            sql_query = f.read()
-        save_pth = os.path.join(gold_result_dir, sql.replace(".sql", ".csv"))
-        if api != "sqlite":
-            result = sql_env.execute_sql_api(sql_query, sql.replace("sql", ""), save_pth, api)
-            print(sql, result)
-        else:
-            db_id = get_db_id("../../spider2-lite", sql.replace(".sql", ""))
-            sqlite_path = get_sqlite_path(db_id=db_id)
-            # print(sql, db_id, sqlite_path)
-            result = sql_env.execute_sql_api(sql_query, sql.replace(".sql", ""), save_pth, api, sqlite_path=sqlite_path)
-            print(sql, result)            
+    precompute_gold(spider2_gold_jobs(gold_result_dir))
+
+def gold_signature(gold_result_dir, example_id, task):
+    """What a score depends on besides the candidate CSV: the gold files'
+    names, sizes and mtimes and the instance's evaluation standard."""
+    standard = None
+    if os.path.exists(os.path.join('/'.join(gold_result_dir.split("/")[:-1]), f"spider2{task}_eval.jsonl")):
+        standard = load_eval_standard(gold_result_dir, task).get(example_id)
+    files = []
+    for file in gold_csv_files(gold_result_dir, example_id) if os.path.isdir(gold_result_dir) else []:
+        stat = os.stat(os.path.join(gold_result_dir, file))
+        files.append([file, stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha256(json.dumps([files, standard], sort_keys=True).encode()).hexdigest()
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {}
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def score_files(func, gold_result_dir, ex_pth, ex, task, files):
+    """{file: score} for candidate CSVs of one instance, so its gold tables
+    are read once per worker."""
+    return {file: func(gold_result_dir, os.path.join(ex_pth, file), ex, task=task) for file in files}
 
-def evaluate_passk(pth, task, update_res=False):
+def evaluate_passk(pth, task, update_res=False, workers=None, rescore=False, manifest_path=None):
+    """Score every CSV under pth/<instance>/. Scores are kept in
+    manifest_path (default pth/.eval_manifest.json) with the CSV's hash and
+    the gold signature, and reused for files that did not change since; the
+    rest is scored in a process pool of workers (default: one per CPU)."""
     eval_func = [evaluate_spider2sql]
     if task == "BIRD":
         gold_result_dir = "../../data/BIRD/gold_result"
@@ -159,20 +167,55 @@ def evaluate_passk(pth, task, update_res=False):
         update_results(gold_result_dir)
     final_score = {}
     passk_score = {}
+    manifest_path = manifest_path or os.path.join(pth, EVAL_MANIFEST)
+    manifest = {} if rescore else load_manifest(manifest_path)
+    workers = workers or os.cpu_count()
     
     for func in eval_func:
         print("Evaluate function:", func)
-        for ex in tqdm(os.listdir(pth)):
-            if ex.endswith("original"):
-                continue
+        entries = manifest.get(f"{func.__name__}:{gold_result_dir}", {})
+        new_entries = {}
+        scores = {}
+        jobs = []
+        for ex in os.listdir(pth):
             ex_pth = os.path.join(pth, ex)
-            ex_score = []
+            if ex.endswith("original") or ex == BLOB_DIR_NAME or not os.path.isdir(ex_pth):
+                continue
+            scores[ex] = {}
+            signature = gold_signature(gold_result_dir, ex, task)
+            todo = []
             for file in os.listdir(ex_pth):
-                file_pth = os.path.join(ex_pth, file)
-                if file_pth.endswith(".csv") and file != "result.csv":
-                    ex_score.append(func(gold_result_dir, file_pth, ex, task=task))
-                elif file == "result.csv":
-                    final_score[ex] = func(gold_result_dir, file_pth, ex, task=task)
+                if not file.endswith(".csv"):
+                    continue
+                key = f"{ex}/{file}"
+                digest = file_digest(os.path.join(ex_pth, file))
+                entry = entries.get(key)
+                if entry and entry["csv"] == digest and entry["gold"] == signature:
+                    scores[ex][file] = entry["score"]
+                    new_entries[key] = entry
+                else:
+                    todo.append(file)
+                    new_entries[key] = {"csv": digest, "gold": signature}
+            if todo:
+                jobs.append((ex, ex_pth, todo))
+        print(f"Scoring {sum(len(files) for _, _, files in jobs)} changed CSVs, {sum(map(len, scores.values()))} unchanged")
+
+        if workers > 1 and len(jobs) > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(score_files, func, gold_result_dir, ex_pth, ex, task, files): ex for ex, ex_pth, files in jobs}
+                results = [(futures[future], future.result()) for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures))]
+        else:
+            results = [(ex, score_files(func, gold_result_dir, ex_pth, ex, task, files)) for ex, ex_pth, files in tqdm(jobs)]
+        for ex, ex_scores in results:
+            scores[ex].update(ex_scores)
+            for file, score in ex_scores.items():
+                new_entries[f"{ex}/{file}"]["score"] = score
+        manifest[f"{func.__name__}:{gold_result_dir}"] = new_entries
+
+        for ex, ex_scores in scores.items():
+            ex_score = [score for file, score in ex_scores.items() if file != "result.csv"]
+            if "result.csv" in ex_scores:
+                final_score[ex] = ex_scores["result.csv"]
             if ex_score and sum(ex_score) >= 1:
                 passk_score[ex] = 1
             else:
@@ -183,6 +226,7 @@ def evaluate_passk(pth, task, update_res=False):
         print("Pass@k score dic", {k: v for k, v in passk_score.items() if v == 1})
         print(f"Final score: {sum(final_score.values())}/{len(passk_score)}={sum(final_score.values())/len(passk_score)}, valid: {len(final_score)}/{len(passk_score)}={len(final_score)/len(passk_score)}")
         print(f"Final score: {sum(passk_score.values())}/{len(passk_score)}={sum(passk_score.values())/len(passk_score)}")
+    save_manifest(manifest_path, manifest)
 
 
 if __name__ == '__main__':
@@ -190,6 +234,23 @@ if __name__ == '__main__':
     parser.add_argument("--log_folder", default=None, type=str)
     parser.add_argument("--task", type=str, default=None)
     parser.add_argument("--update_res", action="store_true")
+    parser.add_argument("--artifact_store", type=str, default=None, help="evaluate the CSVs of a run.py --artifact_store file, exported to --log_folder if given, else to a temporary directory")
+    parser.add_argument("--eval_workers", type=int, default=None, help="scoring processes, defaults to one per CPU")
+    parser.add_argument("--rescore", action="store_true", help="ignore the score manifest of the log folder")
 
     args = parser.parse_args()
-    evaluate_passk(args.log_folder, args.task, args.update_res)
\ No newline at end of file
+    if not args.artifact_store:
+        evaluate_passk(args.log_folder, args.task, args.update_res, args.eval_workers, args.rescore)
+    else:
+        # the score manifest stays with the export folder, or next to the store file
+        # when the export is temporary, so unchanged CSVs are not scored again
+        export_dir = args.log_folder or tempfile.mkdtemp(prefix="reforce-eval-")
+        manifest_path = None if args.log_folder else args.artifact_store + EVAL_MANIFEST
+        store = ArtifactStore(args.artifact_store)
+        try:
+            store.export(export_dir, kinds=["csv"])
+            evaluate_passk(export_dir, args.task, args.update_res, args.eval_workers, args.rescore, manifest_path)
+        finally:
+            store.close()
+            if not args.log_folder:
+                shutil.rmtree(export_dir, ignore_errors=True)
\ No newline at end of file
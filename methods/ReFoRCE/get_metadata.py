@@ -2,6 +2,8 @@ import os
 import json
 import shutil
 import argparse
+from logs import BLOB_DIR_NAME
+from artifact_store import ArtifactStore
 
 def save_to_jsonl(folder_names, file_path):
     with open(file_path, 'w', encoding='utf-8') as file:
@@ -16,19 +18,34 @@ def get_csv_from_dic(folder_names, output_dic, file_type):
             path_csv = os.path.join(directory, name)
             shutil.copy(path_csv, os.path.join(output_dic, f"{sql}.{file_type}"))
 
+def get_csv_from_store(store, folder_names, output_dic, file_type):
+    for sql in folder_names:
+        content = store.get_file(sql, f"result.{file_type}")
+        if content is not None:
+            with open(os.path.join(output_dic, f"{sql}.{file_type}"), "wb") as f:
+                f.write(content)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--result_path', type=str, default="output/o1-preview-snow-log")
     parser.add_argument('--output_path', type=str, default="output/o1-preview-snow")
     parser.add_argument('--file_type', type=str, default="csv")
+    parser.add_argument('--artifact_store', type=str, default=None, help="read results from a run.py --artifact_store file instead of result_path")
     args = parser.parse_args()
 
     directory = args.result_path
     output_dic = args.output_path
     if not os.path.exists(output_dic):
         os.makedirs(output_dic)
-    folder_names = [name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name))]
+    if args.artifact_store:
+        store = ArtifactStore(args.artifact_store)
+        folder_names = store.instances()
+    else:
+        folder_names = [name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)) and name != BLOB_DIR_NAME]
     if args.file_type == "csv":
         save_to_jsonl(folder_names, os.path.join(output_dic, 'results_metadata.jsonl'))
-    get_csv_from_dic(folder_names, output_dic, args.file_type)
\ No newline at end of file
+    if args.artifact_store:
+        get_csv_from_store(store, folder_names, output_dic, args.file_type)
+    else:
+        get_csv_from_dic(folder_names, output_dic, args.file_type)
\ No newline at end of file
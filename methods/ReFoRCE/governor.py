@@ -0,0 +1,181 @@
+"""Concurrency and spend limits for Snowflake and BigQuery queries.
+
+Every SqlEnv query on a warehouse (Snowflake warehouse or BigQuery project,
+named in its credential file) goes through the governor. With run.py
+--warehouse_limits snowflake=4 bigquery=8 (a backend, or backend:name for
+one warehouse) at most that many queries run at once; the others queue, and
+a freed slot goes to the waiting query whose instance has the fewest
+queries running, oldest first, so one instance's votes cannot crowd out
+the rest.
+
+Bytes billed (BigQuery) and credits (Snowflake, estimated at
+--snowflake_credits_per_hour, as per-query credits are not reported) add
+up per backend. A warehouse bills the time it runs, however many queries it
+runs at once, so credits follow the time a warehouse has any query running:
+a query ending is charged the busy time not charged yet. Once --bigquery_budget_gb or --snowflake_budget_credits is
+spent, queries on that backend return an error instead of running and
+run.py starts no more instances on it. Each query records a "sql_queue"
+metric (warehouse, wait, latency, usage) and print_summary reports queue
+waits per warehouse, for sizing warehouses and limits.
+"""
+import functools
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import numpy as np
+from metrics import get_context, get_recorder
+
+
+class BudgetExhausted(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=None)
+def credential_field(path, field):
+    """A field of a credential file (warehouse, project_id), None if absent."""
+    try:
+        with open(path) as f:
+            return json.load(f).get(field)
+    except (OSError, ValueError):
+        return None
+
+
+class WarehouseState:
+    def __init__(self):
+        self.running = 0
+        self.per_instance = defaultdict(int)
+        self.waiters = []
+        self.max_queue = 0
+        self.waits = []
+        self.latency = 0.0
+        self.busy = 0.0  # seconds with a query running, up to busy_since
+        self.busy_since = None
+        self.charged = 0.0  # busy seconds already charged to a query
+        self.refused = 0
+        self.usage = defaultdict(float)
+
+
+class Governor:
+    def __init__(self, limits=None, budgets=None, credits_per_hour=1.0):
+        self.limits = limits or {}
+        self.budgets = budgets or {}  # backend: bytes (bigquery) or credits (snowflake)
+        self.credits_per_hour = credits_per_hour
+        self.spent = defaultdict(float)
+        self.warehouses = defaultdict(WarehouseState)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+
+    def limit(self, key, api):
+        return self.limits.get(key, self.limits.get(api))
+
+    def exhausted(self, api):
+        budget = self.budgets.get(api)
+        return budget is not None and self.spent[api] >= budget
+
+    @contextmanager
+    def query(self, api, name=None):
+        """Hold a query slot of the warehouse; the block may put "bytes_billed"
+        into the yielded dict. Raises BudgetExhausted instead of queueing
+        once the backend's budget is spent."""
+        key = f"{api}:{name}" if name else api
+        instance_id = get_context().get("instance_id")
+        if self.exhausted(api):
+            with self.cond:
+                self.warehouses[key].refused += 1
+            raise BudgetExhausted(f"{api} budget of {self.budgets[api]:g} {'bytes' if api == 'bigquery' else 'credits'} is spent")
+        wait = self.acquire(key, api, instance_id)
+        usage = {}
+        start_time = time.time()
+        try:
+            yield usage
+        finally:
+            latency = time.time() - start_time
+            busy = self.release(key, instance_id)
+            if api == "snowflake":
+                usage["credits"] = busy * self.credits_per_hour / 3600
+            self.account(key, api, wait, latency, usage)
+
+    def acquire(self, key, api, instance_id):
+        start_time = time.time()
+        limit = self.limit(key, api)
+        with self.cond:
+            state = self.warehouses[key]
+            if limit is None or (state.running < limit and not state.waiters):
+                if state.running == 0:
+                    state.busy_since = time.time()
+                state.running += 1
+                state.per_instance[instance_id] += 1
+            else:
+                ticket = {"instance_id": instance_id, "seq": next(self.seq), "granted": False}
+                state.waiters.append(ticket)
+                state.max_queue = max(state.max_queue, len(state.waiters))
+                self.cond.wait_for(lambda: ticket["granted"])
+        return time.time() - start_time
+
+    def release(self, key, instance_id):
+        """Free the query's slot; returns the warehouse busy time (s) not
+        charged to a query yet, charged to this one."""
+        with self.cond:
+            state = self.warehouses[key]
+            state.running -= 1
+            state.per_instance[instance_id] -= 1
+            if state.waiters:
+                ticket = min(state.waiters, key=lambda t: (state.per_instance[t["instance_id"]], t["seq"]))
+                state.waiters.remove(ticket)
+                state.running += 1
+                state.per_instance[ticket["instance_id"]] += 1
+                ticket["granted"] = True
+                self.cond.notify_all()
+            now = time.time()
+            busy = state.busy + (now - state.busy_since)
+            if state.running == 0:
+                state.busy, state.busy_since = busy, None
+            charge = busy - state.charged
+            state.charged = busy
+            return charge
+
+    def account(self, key, api, wait, latency, usage):
+        with self.cond:
+            state = self.warehouses[key]
+            state.waits.append(wait)
+            state.latency += latency
+            for k, v in usage.items():
+                state.usage[k] += v or 0
+            spent = usage.get("bytes_billed" if api == "bigquery" else "credits") or 0
+            was_exhausted = self.exhausted(api)
+            self.spent[api] += spent
+            if not was_exhausted and self.exhausted(api):
+                print(f"Governor: {api} budget spent ({self.spent[api]:g} of {self.budgets[api]:g}), no more {api} queries")
+        get_recorder().record(kind="sql_queue", warehouse=key, wait=wait, latency=latency, **usage)
+
+    def print_summary(self):
+        with self.cond:
+            warehouses = {k: v for k, v in self.warehouses.items() if v.waits or v.refused}
+            if not warehouses:
+                return
+            print(f"{'warehouse':<28}{'queries':>8}{'refused':>8}{'wait avg(s)':>12}{'wait p95(s)':>12}{'max queue':>10}{'run(s)':>9}{'GB billed':>11}{'credits':>9}")
+            for key, state in sorted(warehouses.items()):
+                waits = state.waits or [0.0]
+                print(f"{key:<28}{len(state.waits):>8}{state.refused:>8}{np.mean(waits):>12.2f}{np.percentile(waits, 95):>12.2f}{state.max_queue:>10}"
+                      f"{state.latency:>9.1f}{state.usage['bytes_billed'] / 1e9:>11.2f}{state.usage['credits']:>9.3f}")
+
+
+_governor = Governor()
+
+
+def get_governor():
+    return _governor
+
+
+def init_governor(limits=None, bigquery_budget_gb=None, snowflake_budget_credits=None, credits_per_hour=1.0):
+    global _governor
+    budgets = {}
+    if bigquery_budget_gb is not None:
+        budgets["bigquery"] = bigquery_budget_gb * 1e9
+    if snowflake_budget_credits is not None:
+        budgets["snowflake"] = snowflake_budget_credits
+    _governor = Governor(limits, budgets, credits_per_hour)
+    return _governor
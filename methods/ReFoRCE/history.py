@@ -0,0 +1,93 @@
+"""History policies deciding which part of a GPTChat conversation is re-sent.
+
+GPTChat always keeps the full conversation in ``messages`` (the agent reads
+``messages[-1]`` for logging); a policy only shapes the list sent to the API.
+"""
+import hashlib
+from utils import extract_all_blocks
+
+HISTORY_POLICIES = ["full", "last_k", "pin_schema", "digest"]
+
+
+def split_turns(messages):
+    """Return (system messages, completed user/assistant turns, pending tail)."""
+    system = [m for m in messages if m["role"] == "system"]
+    chat = [m for m in messages if m["role"] != "system"]
+    turns = []
+    i = 0
+    while i + 1 < len(chat) and chat[i]["role"] == "user" and chat[i + 1]["role"] == "assistant":
+        turns.append(chat[i:i + 2])
+        i += 2
+    return system, turns, chat[i:]
+
+
+def flatten(turns):
+    return [m for turn in turns for m in turn]
+
+
+class FullHistory:
+    def apply(self, messages):
+        return messages
+
+
+class LastKTurns:
+    """System messages plus the last ``k`` completed turns."""
+    def __init__(self, k=2):
+        self.k = k
+
+    def apply(self, messages):
+        system, turns, pending = split_turns(messages)
+        recent = turns[-self.k:] if self.k > 0 else []
+        return system + flatten(recent) + pending
+
+
+class PinFirstTurn(LastKTurns):
+    """Like LastKTurns, but the first turn (the prompt carrying the schema) is
+    always kept, so the schema is sent once per request instead of being lost."""
+    def apply(self, messages):
+        system, turns, pending = split_turns(messages)
+        if len(turns) <= self.k + 1:
+            return messages
+        recent = turns[-self.k:] if self.k > 0 else []
+        return system + flatten(turns[:1] + recent) + pending
+
+
+class DigestOldTurns(LastKTurns):
+    """Keep every turn, but replace the turns between the first one (schema)
+    and the last ``k`` by compact digests: long prompts such as execution
+    results are cut to their head and responses are reduced to their SQL."""
+    def __init__(self, k=2, keep_chars=300):
+        super().__init__(k)
+        self.keep_chars = keep_chars
+
+    def digest(self, message):
+        content = message["content"]
+        if message["role"] == "assistant":
+            sqls = extract_all_blocks(content, "sql")
+            if sqls:
+                return {"role": "assistant", "content": "".join(f"```sql\n{sql}\n```\n" for sql in sqls)}
+        if len(content) <= self.keep_chars:
+            return message
+        sha = hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+        omitted = len(content) - self.keep_chars
+        return {"role": message["role"], "content": content[:self.keep_chars] + f"\n[... {omitted} chars omitted, digest {sha}]\n"}
+
+    def apply(self, messages):
+        system, turns, pending = split_turns(messages)
+        if len(turns) <= self.k + 1:
+            return messages
+        split = len(turns) - self.k
+        old = [[self.digest(m) for m in turn] for turn in turns[1:split]]
+        return system + flatten(turns[:1] + old + turns[split:]) + pending
+
+
+def get_history_policy(name="full", k=2):
+    if name in (None, "full"):
+        return FullHistory()
+    elif name == "last_k":
+        return LastKTurns(k)
+    elif name == "pin_schema":
+        return PinFirstTurn(k)
+    elif name == "digest":
+        return DigestOldTurns(k)
+    raise ValueError(f"Unknown history policy {name}, expected one of {HISTORY_POLICIES}")
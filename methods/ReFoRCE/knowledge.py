@@ -0,0 +1,205 @@
+"""Exploration results shared by the instances of a database.
+
+Instances on the same database (the scheduler's database key: the spider2 or
+omnisql db, else the sqlite file) mostly explore the same facts: distinct
+values, date formats, nested column layouts. With run.py --knowledge_store,
+every exploration query that ran is kept in a SQLite file, with its
+result and with the SQL it was corrected to, if any, under the tables and
+columns it touches (parsed with sqlglot).
+
+When an instance explores, the stored results for its database are ranked.
+A result whose tables are all in the instance's schema counts; results on
+more of the question's columns, and those reused most, come first. The top
+ones go to the exploration prompt, so the model asks about something else,
+and into pre_info, up to half of the exploration section's tokens. With
+--knowledge_skip_probes, a query already stored for the database is not
+run (or corrected) again: its stored result is used as is, which saves the
+warehouse round trip and any self-correction calls, at the cost of results
+that may be stale if the data changed since.
+
+    python knowledge.py --knowledge_store runs/knowledge.db
+"""
+import argparse
+import hashlib
+import json
+import re
+import time
+from collections import defaultdict
+from shared_db import SharedDB
+from utils import extract_real_table_names, clear_name
+from cpu_pool import run_cpu
+from metrics import get_recorder
+
+COMMENT_PATTERN = re.compile(r"--[^\n]*")
+WORD_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+DIALECTS = {"sqlite": "sqlite", "snowflake": "snowflake", "bigquery": "bigquery"}
+
+
+def probe_key(sql):
+    """sha256 of the SQL without comments, whitespace or trailing semicolons."""
+    normalized = " ".join(COMMENT_PATTERN.sub(" ", sql).split()).rstrip("; ")
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def probe_terms(sql, api):
+    """(tables, columns) of a query, upper-cased; empty when it does not parse."""
+    try:
+        tables, columns = run_cpu(extract_real_table_names, sql, DIALECTS.get(api, "sqlite"))
+    except Exception:
+        return [], []
+    return sorted(clear_name(tables, do_remove_digits=False)), sorted(clear_name(columns, do_remove_digits=False))
+
+
+def format_probe(sql, result):
+    # the layout of pre_info in REFORCE.exploration
+    return "Query:\n" + sql + "\nAnswer:\n" + str(result)
+
+
+class KnowledgeStore:
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.db = SharedDB(path, shared)
+        with self.db.transaction() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS probes (
+                db TEXT NOT NULL,
+                probe TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                result TEXT NOT NULL,
+                tables TEXT NOT NULL,
+                columns TEXT NOT NULL,
+                instance_id TEXT,
+                uses INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                PRIMARY KEY (db, probe))""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS probe_terms (
+                db TEXT NOT NULL,
+                term TEXT NOT NULL,
+                probe TEXT NOT NULL,
+                PRIMARY KEY (db, term, probe))""")
+
+    def connect(self):
+        return self.db.connect()
+
+    def record(self, db, asked_sql, sql, result, api, instance_id=None):
+        """Keep the result of asked_sql (run as sql, after any correction)."""
+        key = probe_key(asked_sql)
+        tables, columns = probe_terms(sql, api)
+        with self.db.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO probes (db, probe, sql, result, tables, columns, instance_id, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (db, key, sql, result, json.dumps(tables), json.dumps(columns), instance_id, time.time()))
+            conn.executemany("INSERT OR IGNORE INTO probe_terms VALUES (?, ?, ?)",
+                             [(db, "table:" + t.split(".")[-1], key) for t in tables] + [(db, "column:" + c, key) for c in columns])
+
+    def known(self, db, asked_sql):
+        """(sql, result) stored for asked_sql on db, or None."""
+        key = probe_key(asked_sql)
+        with self.db.transaction() as conn:
+            row = conn.execute("SELECT sql, result FROM probes WHERE db = ? AND probe = ?", (db, key)).fetchone()
+            if row:
+                conn.execute("UPDATE probes SET uses = uses + 1 WHERE db = ? AND probe = ?", (db, key))
+        return row
+
+    def relevant(self, db, table_info, question):
+        """[(probe, sql, result)] on tables all named in table_info, those
+        touching more of the question's columns and reused more first."""
+        schema_words = {w.upper() for w in WORD_PATTERN.findall(table_info)}
+        question_words = {w.upper() for w in WORD_PATTERN.findall(question)}
+        tables = sorted(schema_words)
+        conn = self.connect()
+        # probes on at least one table of the schema, through the term index
+        candidates = set()
+        for start in range(0, len(tables), 500):
+            chunk = ["table:" + t for t in tables[start:start + 500]]
+            rows = conn.execute(f"SELECT DISTINCT probe FROM probe_terms WHERE db = ? AND term IN ({', '.join('?' * len(chunk))})", [db] + chunk)
+            candidates.update(row[0] for row in rows)
+        if not candidates:
+            return []
+        ranked = []
+        for probe, sql, result, probe_tables, probe_columns, uses in conn.execute(
+                "SELECT probe, sql, result, tables, columns, uses FROM probes WHERE db = ?", (db,)):
+            if probe not in candidates:
+                continue
+            # a table is qualified (db.schema.table) in the query but not always in the schema
+            if not all(t.split(".")[-1] in schema_words for t in json.loads(probe_tables)):
+                continue
+            overlap = len(set(json.loads(probe_columns)) & question_words)
+            ranked.append((-overlap, -uses, probe, sql, result))
+        ranked.sort()
+        return [(probe, sql, result) for _, _, probe, sql, result in ranked]
+
+    def summary(self):
+        """{db: (probes, uses)}."""
+        with self.db.transaction() as conn:
+            rows = conn.execute("SELECT db, COUNT(*), SUM(uses) FROM probes GROUP BY db").fetchall()
+        return {db: (count, uses or 0) for db, count, uses in rows}
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+        print(f"{'knowledge db':<40}{'probes':>8}{'reused':>8}")
+        for db, (count, uses) in sorted(summary.items()):
+            print(f"{db:<40}{count:>8}{uses:>8}")
+
+    def close(self):
+        self.db.close()
+
+
+class DatabaseKnowledge:
+    """The store as seen by one instance: its database, backend and whether
+    stored probes are reused instead of run."""
+    def __init__(self, store, db, api, instance_id=None, skip_probes=False):
+        self.store = store
+        self.db = db
+        self.api = api
+        self.instance_id = instance_id
+        self.skip_probes = skip_probes
+        self.injected = set()
+        self.counts = defaultdict(int)
+
+    def prior_info(self, table_info, question, budget):
+        """Stored results for the instance, formatted as pre_info, within
+        half of the exploration section."""
+        limit = budget.section_limit("exploration") // 2
+        info = ""
+        for probe, sql, result in self.store.relevant(self.db, table_info, question):
+            entry = format_probe(sql, result)
+            if budget.count(info + entry) > limit:
+                break
+            info += entry
+            self.injected.add(probe)
+        self.counts["injected"] = len(self.injected)
+        return info
+
+    def known(self, asked_sql):
+        """(sql, result, already in prior_info) of a stored probe, or None;
+        always None without skip_probes."""
+        if not self.skip_probes:
+            return None
+        row = self.store.known(self.db, asked_sql)
+        if row is None:
+            return None
+        self.counts["reused"] += 1
+        return row[0], row[1], probe_key(asked_sql) in self.injected
+
+    def record(self, asked_sql, sql, result):
+        self.store.record(self.db, asked_sql, sql, result, self.api, self.instance_id)
+        self.counts["recorded"] += 1
+
+    def record_metrics(self):
+        get_recorder().record(kind="knowledge", db=self.db, injected=self.counts["injected"],
+                              reused=self.counts["reused"], recorded=self.counts["recorded"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--knowledge_store", type=str, required=True)
+    parser.add_argument("--db", type=str, default=None, help="list the probes of this database")
+    args = parser.parse_args()
+    store = KnowledgeStore(args.knowledge_store)
+    if args.db:
+        for sql, result, uses in store.connect().execute("SELECT sql, result, uses FROM probes WHERE db = ? ORDER BY uses DESC", (args.db,)):
+            print(f"-- reused {uses} times\n{sql}\n{result}\n")
+    else:
+        store.print_summary()
+    store.close()
@@ -0,0 +1,279 @@
+"""Run logs written by a background thread, with large payloads stored once.
+
+get_logger() returns a logger whose records go onto one shared queue; a
+single QueueListener thread formats them and writes them to their log files,
+so worker threads never wait on disk. Large payloads (schema text, prompts,
+CSV results) go through RunLogger.payload(): they are written once to
+<blob_dir>/<sha256[:2]>/<sha256>[.gz|.zst] and the log line only carries a
+<<blob:sha256>> reference, so the same table_info logged by every vote and
+every instance of a database costs one file.
+
+With log_format="jsonl" each line is a JSON object with ts, level,
+instance_id, vote, stage, iteration, tag, message and blobs.
+
+    python logs.py --log output/xxx/local001/0log.log
+prints a log with its blob references expanded.
+"""
+import argparse
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from metrics import get_context
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BLOB_DIR_NAME = "blobs"
+BLOB_MIN_CHARS = 2048
+BLOB_REF = "<<blob:{}>>"
+BLOB_REF_PATTERN = re.compile(r"<<blob:([0-9a-f]{64})>>")
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+CONTEXT_FIELDS = ["instance_id", "vote", "stage", "iteration"]
+
+
+def blob_digest(content):
+    return hashlib.sha256(content.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+
+class BlobStore:
+    SUFFIX = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+    def __init__(self, blob_dir, compress=None):
+        self.blob_dir = blob_dir
+        self.compress = compress
+        self.known = set()
+
+    def path(self, digest, compress=None):
+        return os.path.join(self.blob_dir, digest[:2], digest + self.SUFFIX[compress])
+
+    def put(self, digest, content):
+        if digest in self.known:
+            return
+        path = self.path(digest, self.compress)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = content.encode("utf-8", errors="surrogatepass")
+            if self.compress == "zstd":
+                data = zstandard.ZstdCompressor().compress(data)
+            elif self.compress == "gzip":
+                data = gzip.compress(data)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        self.known.add(digest)
+
+    def get(self, digest):
+        for compress in self.SUFFIX:
+            path = self.path(digest, compress)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+                if compress == "zstd":
+                    data = zstandard.ZstdDecompressor().decompress(data)
+                elif compress == "gzip":
+                    data = gzip.decompress(data)
+                return data.decode("utf-8", errors="surrogatepass")
+        return None
+
+
+class RunLogger(logging.Logger):
+    """Logger bound to one log file. Not registered with logging.getLogger,
+    so it is garbage collected with its vote instead of piling up."""
+    def __init__(self, name, log_path, blob_dir, writer):
+        super().__init__(name, logging.INFO)
+        self.log_path = log_path
+        self.blob_dir = blob_dir
+        self.writer = writer
+        self.addHandler(QueueHandler(writer.queue))
+
+    def makeRecord(self, *args, **kwargs):
+        record = super().makeRecord(*args, **kwargs)
+        record.log_path = self.log_path
+        record.blob_dir = self.blob_dir
+        record.context = get_context()
+        if not hasattr(record, "tag"):
+            record.tag = None
+        if not hasattr(record, "blobs"):
+            record.blobs = {}
+        return record
+
+    def control(self, action):
+        record = self.makeRecord(self.name, logging.INFO, "", 0, action, None, None)
+        record.control = action
+        record.done = threading.Event()
+        self.writer.queue.put(record)
+        return record.done
+
+    def payload(self, tag, text, shared=(), level=logging.INFO):
+        """Log text between [tag] markers. Each of the shared strings (e.g.
+        table_info) found in text, and text itself if it is still longer than
+        BLOB_MIN_CHARS, is replaced by a blob reference."""
+        text = str(text)
+        blobs = {}
+        for part in shared:
+            if part and len(part) >= BLOB_MIN_CHARS and part in text:
+                digest = blob_digest(part)
+                blobs[digest] = part
+                text = text.replace(part, BLOB_REF.format(digest))
+        if len(text) >= BLOB_MIN_CHARS:
+            digest = blob_digest(text)
+            blobs[digest] = text
+            text = BLOB_REF.format(digest)
+        self.log(level, f"[{tag}]\n{text}\n[{tag}]", extra={"tag": tag, "blobs": blobs})
+
+
+class RoutingHandler(logging.Handler):
+    """Runs on the listener thread: writes blobs, then routes each record to
+    the file of the logger that emitted it."""
+    def __init__(self, record_queue, log_format="text", compress=None):
+        super().__init__()
+        self.queue = record_queue
+        self.log_format = log_format
+        self.compress = compress
+        self.files = {}
+        self.stores = {}
+        self.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt='%Y-%m-%d %H:%M:%S'))
+
+    def store(self, blob_dir):
+        if blob_dir not in self.stores:
+            self.stores[blob_dir] = BlobStore(blob_dir, self.compress)
+        return self.stores[blob_dir]
+
+    def format_json(self, record):
+        entry = {"ts": record.created, "level": record.levelname, "logger": record.name}
+        entry.update({k: record.context.get(k) for k in CONTEXT_FIELDS})
+        entry.update(tag=record.tag, message=record.getMessage(), blobs=list(record.blobs))
+        return json.dumps(entry, ensure_ascii=False)
+
+    def emit(self, record):
+        try:
+            control = getattr(record, "control", None)
+            if control == "open":
+                self.close_file(record.log_path)
+                self.files[record.log_path] = open(record.log_path, "w", encoding="utf-8")
+            elif control == "close":
+                self.close_file(record.log_path)
+            else:
+                for digest, content in record.blobs.items():
+                    self.store(record.blob_dir).put(digest, content)
+                f = self.files.get(record.log_path)
+                if f is None:
+                    f = self.files[record.log_path] = open(record.log_path, "a", encoding="utf-8")
+                f.write((self.format_json(record) if self.log_format == "jsonl" else self.format(record)) + "\n")
+                if self.queue.empty():
+                    f.flush()
+        except Exception:
+            self.handleError(record)
+        finally:
+            if hasattr(record, "done"):
+                record.done.set()
+
+    def close_file(self, log_path):
+        f = self.files.pop(log_path, None)
+        if f is not None:
+            f.close()
+
+    def close(self):
+        for log_path in list(self.files):
+            self.close_file(log_path)
+        super().close()
+
+
+class LogWriter:
+    def __init__(self, log_format="text", blob_dir=None, compress=None):
+        if compress == "zstd" and zstandard is None:
+            print("zstandard is not installed, compressing log blobs with gzip")
+            compress = "gzip"
+        self.log_format = log_format
+        self.blob_dir = blob_dir
+        self.queue = queue.SimpleQueue()
+        self.handler = RoutingHandler(self.queue, log_format, compress)
+        self.listener = QueueListener(self.queue, self.handler)
+        self.listener.start()
+        self.running = True
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.listener.stop()
+            self.handler.close()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LogWriter()
+        return _writer
+
+
+def init_log_writer(log_format="text", blob_dir=None, compress=None):
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop()
+        _writer = LogWriter(log_format, blob_dir, compress)
+        return _writer
+
+
+def stop_log_writer():
+    with _writer_lock:
+        if _writer is not None:
+            _writer.stop()
+
+
+atexit.register(stop_log_writer)
+
+
+def get_logger(log_path, logger_name=None):
+    """Logger writing to log_path (truncated). Release it with close_logger."""
+    writer = get_writer()
+    if logger_name is None:
+        logger_name = threading.current_thread().name
+    blob_dir = writer.blob_dir or os.path.join(os.path.dirname(os.path.abspath(log_path)), BLOB_DIR_NAME)
+    logger = RunLogger(logger_name, log_path, blob_dir, writer)
+    logger.control("open")
+    return logger
+
+
+def close_logger(logger, timeout=60):
+    """Flush and close the logger's file; blocks until the writer has done so,
+    since the file is read (e.g. copied by vote_result) right after."""
+    if not isinstance(logger, RunLogger) or not logger.writer.running:
+        return
+    logger.control("close").wait(timeout)
+
+
+def expand_blobs(text, blob_dir):
+    store = BlobStore(blob_dir)
+    return BLOB_REF_PATTERN.sub(lambda m: store.get(m.group(1)) or m.group(0), text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--log', type=str, required=True)
+    parser.add_argument('--blob_dir', type=str, default=None, help="defaults to <output_path>/blobs, then <instance>/blobs")
+    args = parser.parse_args()
+    log_dir = os.path.dirname(os.path.abspath(args.log))
+    blob_dir = args.blob_dir or next((d for d in [os.path.join(os.path.dirname(log_dir), BLOB_DIR_NAME), os.path.join(log_dir, BLOB_DIR_NAME)] if os.path.isdir(d)), log_dir)
+    with open(args.log, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("{"):
+                entry = json.loads(line)
+                print(json.dumps(dict(entry, message=expand_blobs(entry["message"], blob_dir)), ensure_ascii=False))
+            else:
+                print(expand_blobs(line, blob_dir), end="")
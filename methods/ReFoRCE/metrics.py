@@ -0,0 +1,148 @@
+"""Per-call LLM usage metrics tagged with instance, vote and pipeline stage.
+
+GPTChat records one entry per API call. Tags come from a thread-local context:
+run.py sets instance_id/vote for each worker thread and the agent methods are
+wrapped with ``stage(...)``.
+"""
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# USD per 1M tokens: (input, cached input, output)
+MODEL_PRICES = {
+    "gpt-4o": (2.5, 1.25, 10.0),
+    "gpt-4o-mini": (0.15, 0.075, 0.6),
+    "gpt-4.1": (2.0, 0.5, 8.0),
+    "gpt-4.1-mini": (0.4, 0.1, 1.6),
+    "o1-preview": (15.0, 7.5, 60.0),
+    "o1": (15.0, 7.5, 60.0),
+    "o1-mini": (1.1, 0.55, 4.4),
+    "o3": (2.0, 0.5, 8.0),
+    "o3-mini": (1.1, 0.55, 4.4),
+    "o3-pro": (20.0, 20.0, 80.0),
+    "o4-mini": (1.1, 0.275, 4.4),
+    "deepseek-reasoner": (0.55, 0.14, 2.19),
+}
+
+_context = threading.local()
+
+
+def get_context():
+    return dict(getattr(_context, "tags", {}))
+
+
+def set_context(**tags):
+    current = get_context()
+    current.update(tags)
+    _context.tags = current
+
+
+def clear_context():
+    _context.tags = {}
+
+
+@contextmanager
+def stage(name):
+    """Tag LLM calls made inside the block (or decorated function) with a stage."""
+    previous = get_context().get("stage")
+    set_context(stage=name)
+    try:
+        yield
+    finally:
+        set_context(stage=previous)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    if model not in MODEL_PRICES:
+        return None
+    input_price, cached_price, output_price = MODEL_PRICES[model]
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1e6
+
+
+def usage_fields(usage):
+    """Normalize chat.completions and responses API usage objects."""
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "reasoning_tokens": 0}
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+    if prompt_tokens is None:
+        prompt_tokens = getattr(usage, "input_tokens", 0)
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    if completion_tokens is None:
+        completion_tokens = getattr(usage, "output_tokens", 0)
+    prompt_details = getattr(usage, "prompt_tokens_details", None) or getattr(usage, "input_tokens_details", None)
+    completion_details = getattr(usage, "completion_tokens_details", None) or getattr(usage, "output_tokens_details", None)
+    return {
+        "prompt_tokens": prompt_tokens or 0,
+        "completion_tokens": completion_tokens or 0,
+        "cached_tokens": getattr(prompt_details, "cached_tokens", 0) or 0,
+        "reasoning_tokens": getattr(completion_details, "reasoning_tokens", 0) or 0,
+    }
+
+
+class MetricsRecorder:
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.file = open(path, "a") if path else None
+
+    def record(self, **fields):
+        record = {"time": time.time(), **get_context(), **fields}
+        with self.lock:
+            self.records.append(record)
+            if self.file:
+                self.file.write(json.dumps(record) + "\n")
+                self.file.flush()
+        for listener in self.listeners:
+            listener(record)
+        return record
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def summary(self, key="stage"):
+        totals = defaultdict(lambda: defaultdict(float))
+        with self.lock:
+            records = [r for r in self.records if r.get("kind", "llm") == "llm"]
+        for r in records:
+            t = totals[r.get(key) or "unknown"]
+            t["calls"] += 1
+            t["errors"] += 1 if r.get("error") else 0
+            t["retries"] += r.get("retries", 0)
+            for field in ["prompt_tokens", "completion_tokens", "cached_tokens", "reasoning_tokens", "latency", "cost"]:
+                t[field] += r.get(field) or 0
+        return {k: dict(v) for k, v in sorted(totals.items())}
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary:
+            return
+        print(f"{'stage':<16}{'calls':>7}{'errors':>7}{'retries':>8}{'prompt':>12}{'cached':>11}{'completion':>12}{'reasoning':>11}{'latency(s)':>12}{'cost($)':>10}")
+        for stage_name, t in summary.items():
+            print(f"{stage_name:<16}{int(t['calls']):>7}{int(t['errors']):>7}{int(t['retries']):>8}{int(t['prompt_tokens']):>12}{int(t['cached_tokens']):>11}{int(t['completion_tokens']):>12}{int(t['reasoning_tokens']):>11}{t['latency']:>12.1f}{t['cost']:>10.2f}")
+        total_cost = sum(t["cost"] for t in summary.values())
+        print(f"Total LLM calls: {int(sum(t['calls'] for t in summary.values()))}, estimated cost: ${total_cost:.2f}")
+        if self.path:
+            print(f"Metrics saved to {self.path}")
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+_recorder = MetricsRecorder()
+
+
+def get_recorder():
+    return _recorder
+
+
+def init_recorder(path=None):
+    global _recorder
+    _recorder.close()
+    _recorder = MetricsRecorder(path)
+    return _recorder
@@ -0,0 +1,207 @@
+"""Gold results executed ahead of evaluation, concurrently and cached.
+
+Each gold query runs on a thread pool of its backend (sqlite, snowflake,
+bigquery), so a slow warehouse cannot hold up local databases and no backend
+gets more than its --limits connections; every thread keeps its own SqlEnv
+and reuses its connections. Outputs are cached in <gold_dir>/.gold_cache.json
+keyed on (sha256 of the SQL, database fingerprint): the sha256 of the sqlite
+file (itself cached by size and mtime), or the backend name for warehouses,
+whose data is not versioned locally. A query whose key did not change and
+whose CSV exists is skipped (as is a CSV from before the cache existed);
+failures are retried on the next run.
+
+    python precompute_gold.py --task lite
+    python precompute_gold.py --task BIRD --omnisql_format_pth ../../data/BIRD/dev.json --db_path ../../data/BIRD
+
+run.py starts the BIRD step in a background thread, and eval.py --update_res
+runs the spider2 step.
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sql import SqlEnv
+from utils import get_api_name, get_db_id, get_sqlite_path
+
+GOLD_CACHE = ".gold_cache.json"
+DEFAULT_LIMITS = {"sqlite": 8, "snowflake": 4, "bigquery": 4}
+
+
+class GoldJob:
+    def __init__(self, instance_id, sql_query, api, save_path, sqlite_path=None, ex_id=None, timeout=300):
+        self.instance_id = instance_id
+        self.sql_query = sql_query
+        self.api = api
+        self.save_path = save_path
+        self.sqlite_path = sqlite_path
+        self.ex_id = ex_id or instance_id
+        self.timeout = timeout
+
+
+def spider2_gold_jobs(gold_result_dir, spider2_dir="../../spider2-lite"):
+    """Jobs for every gold SQL file next to gold_result_dir (.../gold/sql)."""
+    gold_sql_dir = gold_result_dir.replace("exec_result", "sql")
+    jobs = []
+    for sql in sorted(os.listdir(gold_sql_dir)):
+        api = get_api_name(sql)
+        with open(os.path.join(gold_sql_dir, sql)) as f:
+            sql_query = f.read()
+        save_pth = os.path.join(gold_result_dir, sql.replace(".sql", ".csv"))
+        instance_id = sql.replace(".sql", "")
+        if api != "sqlite":
+            jobs.append(GoldJob(instance_id, sql_query, api, save_pth, ex_id=sql.replace("sql", "")))
+        else:
+            db_id = get_db_id(spider2_dir, instance_id)
+            jobs.append(GoldJob(instance_id, sql_query, api, save_pth, sqlite_path=get_sqlite_path(spider2_dir, instance_id, db_id, "lite")))
+    return jobs
+
+
+def bird_gold_jobs(gold_sqls, db_ids, db_path, gold_result_dir):
+    """Jobs for {instance_id: gold SQL} of BIRD instances."""
+    return [GoldJob(instance_id, sql_query, "sqlite", os.path.join(gold_result_dir, instance_id + ".csv"),
+                    sqlite_path=get_sqlite_path(db_path, instance_id, db_ids[instance_id], "BIRD"), timeout=1200)
+            for instance_id, sql_query in gold_sqls.items()]
+
+
+class GoldCache:
+    def __init__(self, gold_dir):
+        self.path = os.path.join(gold_dir, GOLD_CACHE)
+        self.lock = threading.Lock()
+        self.entries, self.databases = {}, {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.entries, self.databases = data["entries"], data["databases"]
+
+    def db_fingerprint(self, job):
+        if job.api != "sqlite":
+            return job.api
+        stat = os.stat(job.sqlite_path)
+        with self.lock:
+            known = self.databases.get(job.sqlite_path)
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = hashlib.sha256()
+        with open(job.sqlite_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        with self.lock:
+            self.databases[job.sqlite_path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def key(self, job):
+        return [hashlib.sha256(job.sql_query.encode("utf-8")).hexdigest(), self.db_fingerprint(job)]
+
+    def is_fresh(self, job, key):
+        """A CSV written before there was a cache entry for it is adopted."""
+        with self.lock:
+            if job.save_path not in self.entries and os.path.exists(job.save_path):
+                self.entries[job.save_path] = key
+            entry = self.entries.get(job.save_path)
+        return entry == key and os.path.exists(job.save_path)
+
+    def store(self, job, key):
+        with self.lock:
+            self.entries[job.save_path] = key
+
+    def save(self):
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"entries": self.entries, "databases": self.databases}, f)
+            os.replace(tmp_path, self.path)
+
+
+def precompute_gold(jobs, limits=None, verbose=True):
+    """Run jobs not already cached, each backend on its own pool of
+    limits[api] threads. Returns {instance_id: result} of executed jobs, where
+    result is "0" on success (as from SqlEnv.execute_sql_api)."""
+    limits = dict(DEFAULT_LIMITS, **(limits or {}))
+    caches = {}
+    for job in jobs:
+        gold_dir = os.path.dirname(os.path.abspath(job.save_path))
+        os.makedirs(gold_dir, exist_ok=True)
+        if gold_dir not in caches:
+            caches[gold_dir] = GoldCache(gold_dir)
+    local = threading.local()
+    envs = []
+    results = {}
+    cached = []
+
+    def run(job):
+        cache = caches[os.path.dirname(os.path.abspath(job.save_path))]
+        try:
+            key = cache.key(job)
+        except OSError as e:
+            results[job.instance_id] = {"status": "error", "error_msg": f"##ERROR## {e}"}
+            return
+        if cache.is_fresh(job, key):
+            cached.append(job.instance_id)
+            return
+        if not hasattr(local, "sql_env"):
+            local.sql_env = SqlEnv()
+            envs.append(local.sql_env)
+        tmp_path = f"{job.save_path}.{threading.get_ident()}.tmp"
+        result = local.sql_env.execute_sql_api(job.sql_query, job.ex_id, tmp_path, job.api, sqlite_path=job.sqlite_path, timeout=job.timeout)
+        if result == "0":
+            os.replace(tmp_path, job.save_path)
+            cache.store(job, key)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        results[job.instance_id] = result
+        if verbose:
+            print(job.instance_id, result)
+
+    executors = {api: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"gold-{api}") for api, limit in limits.items()}
+    try:
+        futures = [executors[job.api].submit(run, job) for job in jobs]
+        for future in futures:
+            future.result()
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
+        for sql_env in envs:
+            sql_env.close_db()
+        for cache in caches.values():
+            cache.save()
+    failed = [instance_id for instance_id, result in results.items() if result != "0"]
+    print(f"Gold results: {len(results) - len(failed)} computed, {len(cached)} cached, {len(failed)} failed {failed if failed else ''}")
+    return results
+
+
+def start_gold_precompute(jobs, limits=None):
+    """precompute_gold in a background thread; join() it before relying on
+    the results."""
+    thread = threading.Thread(target=precompute_gold, args=(jobs, limits, False), name="gold-precompute", daemon=True)
+    thread.start()
+    return thread
+
+
+def parse_limits(items):
+    limits = {}
+    for item in items or []:
+        api, limit = item.split("=")
+        limits[api] = int(limit)
+    return limits
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--task', type=str, default="lite", choices=["lite", "snow", "BIRD"])
+    parser.add_argument('--gold_result_dir', type=str, default=None)
+    parser.add_argument('--omnisql_format_pth', type=str, default=None, help="BIRD questions with gold SQL")
+    parser.add_argument('--db_path', type=str, default=None)
+    parser.add_argument('--limits', nargs="+", default=None, help="threads per backend, e.g. sqlite=8 snowflake=2")
+    args = parser.parse_args()
+
+    if args.task == "BIRD":
+        with open(args.omnisql_format_pth) as f:
+            data = json.load(f)
+        gold_sqls = {f"local_BIRD_{example['question_id']:04d}": example["SQL"] for example in data}
+        db_ids = {f"local_BIRD_{example['question_id']:04d}": example["db_id"] for example in data}
+        jobs = bird_gold_jobs(gold_sqls, db_ids, args.db_path, args.gold_result_dir or "../../data/BIRD/gold_result")
+    else:
+        jobs = spider2_gold_jobs(args.gold_result_dir or f"../../spider2-{args.task}/evaluation_suite/gold/exec_result")
+    precompute_gold(jobs, parse_limits(args.limits))
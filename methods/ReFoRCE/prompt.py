@@ -101,6 +101,9 @@ class Prompts:
 
         return exploration_prompt
 
+    def get_exploration_knowledge_prompt(self, prior_info):
+        return f"These queries were already run on this database for earlier tasks:\n{prior_info}\nDon't repeat them; write queries about what they don't show.\n"
+
     def get_exploration_refine_prompt(self, sql, corrected_sql, sqls):
         return f"```sql\n{sql}``` is corrected to ```sql\n{corrected_sql}```. Please correct other sqls if they have similar errors. SQLs: {sqls}. For each SQL, answer in ```sql\n--Description: \n``` format.\n"
 
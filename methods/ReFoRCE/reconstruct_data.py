@@ -6,8 +6,8 @@ import shutil
 import sqlite3
 from utils import remove_digits, is_file, clear_description, clear_sample_rows, extract_column_names, extract_real_table_names, get_api_name, clear_name, remove_declare_lines, clear_byte
 import json
+from budget import count_tokens, SCHEMA_TOKEN_THRESHOLD
 pd.set_option('display.max_colwidth', None)
-THRESHOLD = 200000
 WRONG_GOLD_TABLES = ["bq095", "bq350", "bq379", "bq396", "sf_bq084", "sf_bq200","sf_bq226", "sf_bq295", "sf_bq358"]
 SKIP_GOLD_SQLS = ["bq350", "local039", "bq095", "bq374", "bq379", "bq396", "bq403", "bq406", "sf_bq233", "sf_bq273", "sf_local039", "sf_bq295"]
 def process_ddl(ddl_file):
@@ -302,7 +302,7 @@ def compress_ddl(example_folder, add_description=False, add_sample_rows=False, r
                 table_names, prompts = get_sqlite_data(sqlite_path, entry, add_description=add_description, add_sample_rows=add_sample_rows, gold_table_names=gold_table_names, gold_column_names=gold_column_names)
             with open(os.path.join(entry1_path, "prompts.txt"), "w") as f:
                 prompts = clear_sample_rows(prompts, byte_limit=1000)
-                if len(prompts) > THRESHOLD and clear_long_eg_des:
+                if clear_long_eg_des and count_tokens(prompts) > SCHEMA_TOKEN_THRESHOLD:
                     # print(f"{entry} len before clearing description: {len(prompts)}")
                     prompts = clear_description(prompts)
                     # print(f"description cleared len: {len(prompts)}")
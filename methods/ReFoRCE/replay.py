@@ -0,0 +1,146 @@
+"""Record LLM and SQL exchanges of a run into a replay bundle and serve them back.
+
+A bundle is a gzip'd JSONL file. Every GPTChat.get_response and
+SqlEnv.execute_sql_api call is stored with its (instance_id, vote, kind, seq)
+position, seq counting calls of that kind within one instance/vote, plus a
+hash of the request. On replay a call is answered from the same position when
+the request hash matches, otherwise from the first unused entry with that
+hash, so orchestration changes that reorder calls still replay.
+
+    python run.py ... --record_bundle runs/o3-lite.bundle.gz
+    python run.py ... --replay_bundle runs/o3-lite.bundle.gz   # no API keys or warehouses needed
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from metrics import get_context
+
+
+class ReplayMiss(Exception):
+    pass
+
+
+def request_hash(*parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(str(part).encode("utf-8", errors="ignore"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def sql_hash(sql_query, api, sqlite_path):
+    # Only the file name, so bundles replay from another checkout or machine.
+    return request_hash(api, os.path.basename(sqlite_path or ""), sql_query)
+
+
+class ReplayBundle:
+    def __init__(self, path, mode):
+        assert mode in ["record", "replay"], mode
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.seq = defaultdict(int)
+        if mode == "record":
+            self.file = gzip.open(path, "at", encoding="utf-8")
+        else:
+            self.file = None
+            self.by_key = {}
+            self.by_hash = defaultdict(deque)
+            self.used = set()
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for i, line in enumerate(f):
+                    entry = json.loads(line)
+                    entry["index"] = i
+                    self.by_key[tuple(entry["key"])] = entry
+                    self.by_hash[(entry["kind"], entry["hash"])].append(entry)
+            self.misses = 0
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def next_key(self, kind):
+        context = get_context()
+        position = (context.get("instance_id"), context.get("vote"), kind)
+        with self.lock:
+            seq = self.seq[position]
+            self.seq[position] += 1
+        return [*position, seq]
+
+    def record(self, kind, digest, response, **extra):
+        entry = {"key": self.next_key(kind), "kind": kind, "hash": digest, "response": response, **extra}
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+        return entry
+
+    def lookup(self, kind, digest):
+        key = tuple(self.next_key(kind))
+        with self.lock:
+            entry = self.by_key.get(key)
+            if entry is None or entry["hash"] != digest or entry["index"] in self.used:
+                candidates = self.by_hash.get((kind, digest), deque())
+                while candidates and candidates[0]["index"] in self.used:
+                    candidates.popleft()
+                entry = candidates[0] if candidates else None
+            if entry is None:
+                self.misses += 1
+                raise ReplayMiss(f"No recorded {kind} response for {key}")
+            self.used.add(entry["index"])
+        return entry
+
+    # LLM calls
+    def record_llm(self, model, prompt, response, usage):
+        return self.record("llm", request_hash(model, prompt), response, model=model, usage=usage, time=time.time())
+
+    def replay_llm(self, model, prompt):
+        return self.lookup("llm", request_hash(model, prompt))
+
+    # SQL calls
+    def record_sql(self, sql_query, api, sqlite_path, result, save_path=None):
+        csv_content = None
+        if save_path and result == "0":
+            with open(save_path, newline='') as f:
+                csv_content = f.read()
+        return self.record("sql", sql_hash(sql_query, api, sqlite_path), result, csv=csv_content)
+
+    def replay_sql(self, sql_query, api, sqlite_path, save_path=None):
+        entry = self.lookup("sql", sql_hash(sql_query, api, sqlite_path))
+        if save_path and entry.get("csv") is not None:
+            with open(save_path, "w", newline='') as f:
+                f.write(entry["csv"])
+        return entry["response"]
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        if self.replaying and self.misses:
+            print(f"Replay: {self.misses} calls had no recorded response")
+
+
+_bundle = None
+
+
+def get_bundle():
+    return _bundle
+
+
+def is_replaying():
+    return _bundle is not None and _bundle.replaying
+
+
+def init_bundle(record_path=None, replay_path=None):
+    global _bundle
+    if record_path and replay_path:
+        raise ValueError("Cannot record and replay in the same run.")
+    if record_path:
+        _bundle = ReplayBundle(record_path, "record")
+    elif replay_path:
+        _bundle = ReplayBundle(replay_path, "replay")
+    else:
+        _bundle = None
+    return _bundle
@@ -1,29 +1,72 @@
 import os
 import argparse
 import glob
-from utils import get_table_info, initialize_logger, get_dictionary, get_sqlite_path
+from utils import get_table_info, initialize_logger, get_dictionary, get_sqlite_path, get_api_name
+from logs import init_log_writer, stop_log_writer, close_logger, BLOB_DIR_NAME
 from agent import REFORCE
 from chat import GPTChat
+from budget import PromptBudget
+from history import get_history_policy, HISTORY_POLICIES
+from metrics import init_recorder, set_context, get_recorder
+from tracing import init_tracer, span, propagate
+from replay import init_bundle
+from cpu_pool import init_cpu_pool, shutdown_cpu_pool
+from precompute_gold import start_gold_precompute, bird_gold_jobs, parse_limits
+from governor import init_governor, get_governor
+from spending import init_spend, get_spend, BudgetSpent
+from deadline import Deadline
+from artifact_store import ArtifactStore
+from run_state import RunState, track
+from voter import IncrementalVoter, cancellable
+from cascade import init_cascade, get_cascade, VOTE_INDEX_STRIDE
+from scheduler import database_keys, schema_size, locality_order, LatencyHistory, WarmResources
+from knowledge import KnowledgeStore, DatabaseKnowledge
 from prompt import Prompts
 import threading, concurrent
 from sql import SqlEnv
 import time
 import json
+import functools
+import shutil
+import tempfile
+import socket
+import contextlib
 
-def execute(question, table_info, args, csv_save_path, log_save_path, sql_save_path, search_directory, format_csv, sql_data):
+def take_sql_env(sql_data):
+    """A SqlEnv for a vote, with the connections of earlier votes on this
+    database when they are kept warm; give it back with release_sql_env."""
+    return warm_resources.sql_env(sql_data) if warm_resources is not None else SqlEnv()
+
+
+def release_sql_env(sql_data, sql_env):
+    if warm_resources is not None:
+        warm_resources.release(sql_data, sql_env)
+    else:
+        sql_env.close_db()
+
+
+@span("vote")
+def execute(question, table_info, args, csv_save_path, log_save_path, sql_save_path, search_directory, format_csv, sql_data, vote=None, stop_event=None, level=0, deadline=None):
+    set_context(instance_id=sql_data, vote=vote)
     db_id = None
     if full_db_id:
         db_id = full_db_id[sql_data]
 
-    # sql
-    sql_env = SqlEnv()
     # revote: execute sql if no csv
     if os.path.exists(os.path.join(search_directory, sql_save_path)) and not os.path.exists(os.path.join(search_directory, csv_save_path)) and args.revote:
         with open(os.path.join(search_directory, sql_save_path)) as f:
             sql = f.read()
-        sql_env.execute_sql_api(sql, sql_data, os.path.join(search_directory, csv_save_path), sqlite_path=get_sqlite_path(args.db_path, sql_data, db_id, args.task))
-
-    if args.rerun:
+        sql_env = take_sql_env(sql_data)
+        try:
+            sql_env.execute_sql_api(sql, sql_data, os.path.join(search_directory, csv_save_path), sqlite_path=get_sqlite_path(args.db_path, sql_data, db_id, args.task))
+        finally:
+            release_sql_env(sql_data, sql_env)
+
+    if run_state is not None:
+        # the state db, not leftover files, tells whether this vote finished
+        if run_state.is_done(sql_data, vote, "vote"):
+            return
+    elif args.rerun:
         if os.path.exists(os.path.join(search_directory, sql_save_path)):
             return
         else:
@@ -40,69 +83,264 @@ def execute(question, table_info, args, csv_save_path, log_save_path, sql_save_p
     # log
     log_file_path = os.path.join(search_directory, log_save_path)
     logger = initialize_logger(log_file_path)
-    if format_csv:
-        logger.info("[Answer format]\n" + format_csv + "\n[Answer format]")
-    table_struct = table_info[table_info.find("The table structure information is "):]
-
-    # chat
-    chat_session_ex = None
-    chat_session = None
-    if args.do_column_exploration:
-        chat_session_ex = GPTChat(args.azure, args.column_exploration_model, temperature=args.temperature)
-    if args.generation_model:
-        chat_session = GPTChat(args.azure, args.generation_model, temperature=args.temperature)
-
-    # agent
-    agent = REFORCE(args.db_path, sql_data, search_directory, prompt_all, sql_env, chat_session_ex, chat_session, sql_data+'/'+log_save_path, db_id, task=args.task)
-
-    # do_column_exploration
-    pre_info, response_pre_txt = None, None
-    if args.do_column_exploration:
-        pre_info, response_pre_txt, max_try = agent.exploration(question, table_struct, table_info, logger)
-        if max_try <= 0:
-            print(f"{sql_data+'/'+log_save_path} Inadequate preparation, skip")
-            return
-        print(f"{sql_data+'/'+log_save_path}: chat_session_ex len: {chat_session_ex.get_message_len()}")
-
-    csv_save_path = os.path.join(search_directory, csv_save_path)
-    sql_save_path = os.path.join(search_directory, sql_save_path)
-
-    # answer
-    if args.do_self_refinement:
-        agent.self_refine(args, logger, question, format_csv, table_struct, table_info, response_pre_txt, pre_info, csv_save_path, sql_save_path, task=args.task)
-    elif args.generation_model:
-        agent.gen(args, logger, question, format_csv, table_struct, table_info, response_pre_txt, pre_info, csv_save_path, sql_save_path, task=args.task)
-    if args.generation_model:
-        agent.sql_env.close_db()
-    
+    sql_env = None
+    try:
+        sql_env = take_sql_env(sql_data)
+        with track(run_state, sql_data, vote, "vote"), cancellable(os.path.join(search_directory, csv_save_path), os.path.join(search_directory, sql_save_path), logger):
+            if format_csv:
+                logger.info("[Answer format]\n" + format_csv + "\n[Answer format]")
+            table_struct = table_info[table_info.find("The table structure information is "):]
+
+            # chat, with the models of this cascade level
+            cascade = get_cascade()
+
+            def new_session(model):
+                # a budget-degraded instance runs on the fallback model
+                session = GPTChat(args.azure, args.fallback_model or model, temperature=args.temperature, history_policy=get_history_policy(args.history_policy, args.history_turns))
+                session.stop_event = stop_event
+                return session
+
+            chat_session_ex = None
+            chat_session = None
+            if args.do_column_exploration:
+                chat_session_ex = new_session(cascade.model("exploration", level))
+            if args.generation_model:
+                chat_session = new_session(cascade.model("generation", level))
+
+            # agent
+            budget = PromptBudget(args.fallback_model or cascade.model("generation", level) or cascade.model("exploration", level))
+            agent = REFORCE(args.db_path, sql_data, search_directory, prompt_all, sql_env, chat_session_ex, chat_session, sql_data+'/'+log_save_path, db_id, task=args.task, budget=budget)
+            agent.stop_event = stop_event
+            agent.deadline = deadline
+            if knowledge_store is not None:
+                agent.knowledge = DatabaseKnowledge(knowledge_store, db_keys[sql_data], agent.api, sql_data, args.knowledge_skip_probes)
+
+            # do_column_exploration
+            pre_info, response_pre_txt = None, None
+            if args.do_column_exploration and (deadline is None or deadline.allow("exploration")):
+                explored = run_state.output(sql_data, vote, "exploration") if run_state is not None else None
+                if explored:
+                    pre_info, response_pre_txt, max_try = explored
+                    logger.info("[Exploration]\nRestored from the run state db\n[Exploration]")
+                else:
+                    def explore(model):
+                        agent.chat_session_pre = new_session(model)
+                        return agent.exploration(question, table_struct, table_info, logger)
+
+                    with track(run_state, sql_data, vote, "exploration") as unit:
+                        pre_info, response_pre_txt, max_try = cascade.run("exploration", "inadequate", explore, lambda explored: explored[2] <= 0, level)
+                        unit.output = [pre_info, response_pre_txt, max_try]
+                if max_try <= 0:
+                    print(f"{sql_data+'/'+log_save_path} Inadequate preparation, skip")
+                    return
+                print(f"{sql_data+'/'+log_save_path}: chat_session_ex len: {agent.chat_session_pre.get_message_len()}")
+
+            csv_save_path = os.path.join(search_directory, csv_save_path)
+            sql_save_path = os.path.join(search_directory, sql_save_path)
+
+            # answer
+            if args.do_self_refinement or args.generation_model:
+                generate = agent.gen
+                if args.do_self_refinement:
+                    generate = agent.self_refine_branches if args.refine_branches > 1 else agent.self_refine
+
+                def answer(model):
+                    agent.chat_session = new_session(model)
+                    generate(args, logger, question, format_csv, table_struct, table_info, response_pre_txt, pre_info, csv_save_path, sql_save_path, task=args.task)
+                    return os.path.exists(sql_save_path)
+
+                cascade.run("generation", "no_convergence", answer, lambda saved: not saved, level)
+    finally:
+        if sql_env is not None:
+            release_sql_env(sql_data, sql_env)
+        close_logger(logger)
+        if artifact_store is not None and vote is not None:
+            artifact_store.sync_dir(sql_data, search_directory, vote)
+
 
 def main(args):
+    os.makedirs(args.output_path, exist_ok=True)
+    metrics_path = args.metrics_path or os.path.join(args.output_path, f"metrics-{time.strftime('%Y%m%d-%H%M%S')}{'-' + worker_id if args.role else ''}.jsonl")
+    metrics = init_recorder(metrics_path)
+    tracer = init_tracer(enabled=bool(args.trace_path))
+    bundle = init_bundle(args.record_bundle, args.replay_bundle)
+    init_log_writer(args.log_format, os.path.join(args.output_path, BLOB_DIR_NAME), args.log_compress)
+    init_cpu_pool(args.cpu_workers)
+    governor = init_governor(parse_limits(args.warehouse_limits), args.bigquery_budget_gb, args.snowflake_budget_credits, args.snowflake_credits_per_hour)
+    spend = init_spend(args.run_budget_usd if args.run_budget_usd is not None else args.run_budget_tokens, "usd" if args.run_budget_usd is not None else "tokens",
+                       args.output_path, args.instance_allocation, args.instance_overrun, args.budget_fallback_model)
+    spend.set_instances(expected)
+    metrics.add_listener(spend.on_record)
+    cascade = init_cascade(args.cascade_config, {"format": args.format_model, "exploration": args.column_exploration_model,
+                                                 "generation": args.generation_model, "model_vote": args.model_vote})
+    # BIRD gold results are computed next to generation, not by its workers
+    gold_thread = None
+    if args.task == "BIRD" and full_gold_sql and args.role != "worker":
+        gold_thread = start_gold_precompute(bird_gold_jobs(full_gold_sql, full_db_id, args.db_path, args.BIRD_gold_result_path))
+
     # Use ThreadPoolExecutor to process each sql_data in parallel
     with concurrent.futures.ThreadPoolExecutor(max_workers=args.num_workers) as executor:
-        list(executor.map(process_sql_data, dictionaries))
+        if run_state is not None:
+            run_state.add_instances(schedule)
+            if args.role is None:
+                reset = run_state.recover(args.max_attempts)
+                if reset:
+                    print(f"Resuming: {reset} unfinished units reset to pending")
+            if args.role == "coordinator":
+                wait_for_workers()
+            else:
+                if args.role == "worker":
+                    run_state.start_heartbeat()
+                for future in [executor.submit(drain_queue) for _ in range(args.num_workers)]:
+                    future.result()
+                run_state.stop_heartbeat()
+        else:
+            list(executor.map(process_sql_data, schedule))
 
+    shutdown_cpu_pool()
+    if warm_resources is not None:
+        warm_resources.close()
+    if gold_thread is not None:
+        gold_thread.join()
     print("Finished")
-
+    if run_state is not None:
+        run_state.print_summary()
+    metrics.print_summary()
+    cascade.print_summary()
+    governor.print_summary()
+    spend.save()
+    spend.print_summary()
+    if knowledge_store is not None:
+        knowledge_store.print_summary()
+        knowledge_store.close()
+    metrics.close()
+    if args.trace_path:
+        tracer.export(args.trace_path)
+    if bundle:
+        bundle.close()
+    stop_log_writer()
+    if artifact_store is not None:
+        shutil.rmtree(scratch_root, ignore_errors=True)
+        artifact_store.close()
+
+
+def execute_vote(voter, question, table_info, args, csv_save_path, log_save_path, sql_save_path, search_directory, format_csv, sql_data, vote, level=0, deadline=None):
+    """execute() of one vote that reports its result to the instance's voter;
+    with --adaptive_votes it runs in one of the shared vote_slots."""
+    try:
+        with vote_slots or contextlib.nullcontext():
+            execute(question, table_info, args, csv_save_path, log_save_path, sql_save_path, search_directory, format_csv, sql_data, vote, voter.stop_event, level, deadline)
+    finally:
+        voter.finish(os.path.join(search_directory, csv_save_path))
+
+
+def drain_queue():
+    """Worker loop for --state_db: process instances until the queue is empty.
+    Workers of a shared run then keep polling while other workers hold
+    instances, to take over any whose lease expires."""
+    while True:
+        sql_data = run_state.claim(args.max_attempts)
+        if sql_data is None:
+            if args.role == "worker" and run_state.remaining():
+                time.sleep(args.poll_interval)
+                continue
+            return
+        try:
+            with track(run_state, sql_data, None, "instance"):
+                process_sql_data(sql_data)
+        except Exception as e:
+            print(f"{sql_data}: failed with {e!r}")
+
+
+def wait_for_workers():
+    """Coordinator loop: the queue is seeded, workers on any node drain it."""
+    while (remaining := run_state.remaining()):
+        print(f"{remaining} instances remaining, {run_state.running()} in progress")
+        time.sleep(args.poll_interval)
+
+
+def instance_directory(sql_data):
+    """Output directory of an instance; with --artifact_store, a local scratch
+    directory holding a copy of its stored artifacts."""
+    if artifact_store is None:
+        return os.path.join(args.output_path, sql_data)
+    search_directory = os.path.join(scratch_root, sql_data)
+    artifact_store.materialize(sql_data, search_directory)
+    return search_directory
+
+
+def sync_artifacts(func):
+    """With --artifact_store, write the scratch directory back to the store."""
+    @functools.wraps(func)
+    def wrapper(sql_data):
+        try:
+            return func(sql_data)
+        finally:
+            search_directory = os.path.join(scratch_root, sql_data) if artifact_store is not None else None
+            if search_directory and os.path.isdir(search_directory):
+                artifact_store.sync_dir(sql_data, search_directory)
+                shutil.rmtree(search_directory, ignore_errors=True)
+    return wrapper
+
+
+def release_warm_resources(func):
+    """With --schedule locality, close a database's connections after the
+    last instance on it."""
+    @functools.wraps(func)
+    def wrapper(sql_data):
+        if warm_resources is not None:
+            warm_resources.instance_start(sql_data)
+        try:
+            return func(sql_data)
+        finally:
+            if warm_resources is not None:
+                warm_resources.instance_done(sql_data, run_state.pending() if run_state is not None else None)
+    return wrapper
+
+
+def release_spend_share(func):
+    """With --run_budget, an instance that returns before it starts takes no
+    share of the budget left."""
+    @functools.wraps(func)
+    def wrapper(sql_data):
+        try:
+            return func(sql_data)
+        finally:
+            get_spend().drop_instance(sql_data)
+    return wrapper
+
+
+@release_warm_resources
+@release_spend_share
+@span("instance")
+@sync_artifacts
 def process_sql_data(sql_data):
     start_time = time.time()
+    set_context(instance_id=sql_data, vote=None)
 
     print(sql_data)
 
     question = task_dict[sql_data]
-    search_directory = os.path.join(args.output_path, sql_data)
+    if get_governor().exhausted(get_api_name(sql_data)):
+        print(f"{sql_data}: {get_api_name(sql_data)} budget spent, skip")
+        return
+    search_directory = instance_directory(sql_data)
 
     # Create agent object
-    agent_format = REFORCE(args.db_path, sql_data, search_directory, prompt_all)
+    cascade = get_cascade()
+    budget = PromptBudget(cascade.model("generation") or cascade.model("exploration"))
+    agent_format = REFORCE(args.db_path, sql_data, search_directory, prompt_all, budget=budget)
     
     # Create the directory if it does not exist
     if not os.path.exists(search_directory):
         os.makedirs(search_directory)
 
     # Skip processing if results already exist and overwrite is not allowed
-    if os.path.exists(agent_format.complete_sql_save_path) and not args.revote:
+    # (with --state_db the work queue has already decided)
+    if run_state is None and os.path.exists(agent_format.complete_sql_save_path) and not args.revote:
         return
     
-    if args.overwrite_unfinished:
+    if run_state is None and args.overwrite_unfinished:
         if not os.path.exists(agent_format.complete_sql_save_path):
             for filename in os.listdir(search_directory):
                 filepath = os.path.join(search_directory, filename)
@@ -120,20 +358,22 @@ def process_sql_data(sql_data):
         if not sql_data.startswith("local"):
             return
 
-    # Get BIRD gold res
-    if args.task == "BIRD":
-        gold_pth = os.path.join(args.BIRD_gold_result_path, sql_data+".csv")
-        if not os.path.exists(gold_pth):
-            sql_env = SqlEnv()
-            res = sql_env.execute_sql_api(full_gold_sql[sql_data], sql_data, gold_pth, sqlite_path=get_sqlite_path(args.db_path, sql_data, full_db_id[sql_data], args.task), timeout=1200)
-            assert res == "0", (sql_data, res)
+    # this instance's share of the --run_budget, and the args it degrades to
+    plan = get_spend().start_instance(sql_data, run_state.pending() if run_state is not None and get_spend().enabled else None)
+    if plan is None:
+        print(f"{sql_data}: run budget spent, skip")
+        return
+    instance_args = plan.apply(args)
+    deadline = Deadline(args.deadline, start_time) if args.deadline else None
 
     # Get table information
     table_info = get_table_info(args.db_path, sql_data, agent_format.api, clear_des=True, full_tb_info=full_tb_info)
-    if len(table_info) > 300000:
-        print(f"Table info len: {len(table_info)}, return")
+    table_info_tokens = budget.count(table_info)
+    if table_info_tokens > budget.section_limit("schema"):
+        table_info = budget.fit_table_info(table_info)
+        print(f"{sql_data}: table info trimmed from {table_info_tokens} to {budget.count(table_info)} tokens")
 
-    if args.do_format_restriction:
+    if args.do_format_restriction and (deadline is None or deadline.allow("format")):
         if args.use_gold_format:
             csv_pth = os.path.join("../../spider2-lite/evaluation_suite/gold/exec_result", sql_data+".csv")
             if not os.path.exists(csv_pth):
@@ -142,39 +382,80 @@ def process_sql_data(sql_data):
                 format_csv = "```sql\n"+f.read().split("\n")[0]+"\n```"
         else:
             # Initialize sessions at the beginning of each thread
-            chat_session_format = GPTChat(args.azure, args.format_model, temperature=args.temperature)
+            chat_session_format = GPTChat(args.azure, cascade.model("format"), temperature=args.temperature)
             # Format answer and update the pre-chat session
-            format_csv = agent_format.format_answer(question, chat_session_format)
+            format_csv = run_state.output(sql_data, None, "format") if run_state is not None else None
+            if format_csv is None:
+                try:
+                    with track(run_state, sql_data, None, "format") as unit:
+                        format_csv = unit.output = agent_format.format_answer(question, chat_session_format)
+                except BudgetSpent as e:
+                    print(f"{sql_data}: {e}, no answer format")
+                    format_csv = None
     else:
         format_csv = None
 
     if args.do_vote:
-        num_votes = args.num_votes
-        sql_paths = {}
-        threads = []
-
-        for i in range(num_votes):
-            csv_save_pathi = str(i) + agent_format.csv_save_name
-            log_pathi = str(i) + agent_format.log_save_name
-            sql_save_pathi = str(i) + agent_format.sql_save_name
-            sql_paths[sql_save_pathi] = csv_save_pathi
-
-            thread = threading.Thread(
-                target=execute,
-                args=(
-                    question, table_info, args,
-                    csv_save_pathi, log_pathi, sql_save_pathi,
-                    search_directory, format_csv, sql_data
-                )
-            )
-            threads.append(thread)
-            thread.start()
-
-        # wait
-        for thread in threads:
-            thread.join()
+        def run_votes(level):
+            """One round of votes with the models of a cascade level; returns
+            its {sql file: csv file} and voter."""
+            num_votes = instance_args.min_votes if args.adaptive_votes else instance_args.num_votes
+            sql_paths = {}
+            threads = []
+            voter = None
+            if args.early_majority or args.adaptive_votes or cascade.escalates("vote", "disagreement", level):
+                voter = IncrementalVoter(0, args.early_majority, sql_data)
+
+            def start_votes(count):
+                if voter is not None:
+                    voter.add_votes(count)
+                first = level * VOTE_INDEX_STRIDE + len(threads)
+                for i in range(first, first + count):
+                    csv_save_pathi = str(i) + agent_format.csv_save_name
+                    log_pathi = str(i) + agent_format.log_save_name
+                    sql_save_pathi = str(i) + agent_format.sql_save_name
+                    sql_paths[sql_save_pathi] = csv_save_pathi
+
+                    thread = threading.Thread(
+                        target=propagate(functools.partial(execute, level=level, deadline=deadline) if voter is None else functools.partial(execute_vote, voter, level=level, deadline=deadline)),
+                        args=(
+                            question, table_info, instance_args,
+                            csv_save_pathi, log_pathi, sql_save_pathi,
+                            search_directory, format_csv, sql_data, i
+                        )
+                    )
+                    threads.append(thread)
+                    thread.start()
+
+            start_votes(num_votes)
+            if args.adaptive_votes:
+                # sequential sampling: add votes while the finished ones disagree
+                with voter.changed:
+                    while True:
+                        voter.changed.wait_for(lambda: voter.pending == 0)
+                        if voter.stop_event.is_set() or voter.agreement() >= args.vote_confidence or voter.num_votes >= instance_args.max_votes:
+                            break
+                        needed = voter.votes_needed(args.vote_confidence, instance_args.max_votes)
+                        print(f"{sql_data}: agreement {voter.agreement():.2f} after {voter.num_votes} votes, adding {needed}")
+                        start_votes(needed)
+                    get_recorder().record(kind="adaptive_votes", votes=voter.num_votes, agreement=voter.agreement())
+
+            # wait
+            for thread in threads:
+                thread.join()
+            return sql_paths, voter
+
+        level = 0
+        sql_paths, voter = run_votes(level)
+        # cascade: vote again one rung up while the votes disagree
+        while cascade.vote_disagrees(voter, level):
+            print(f"{sql_data}: {voter.agreement():.2f} of the votes agree, voting again with {cascade.model('generation', level + 1)}")
+            level += 1
+            sql_paths, voter = run_votes(level)
+        if cascade.escalates("vote", "disagreement"):
+            cascade.record("vote", 0, level, "disagreement")
         
-        if args.revote:
+        if args.revote or run_state is not None:
             print(search_directory)
             if "result.sql" in os.listdir(search_directory):
                 print("Revote, remove", os.path.join(search_directory, "result.sql"))
@@ -185,17 +466,22 @@ def process_sql_data(sql_data):
         if "result.sql" not in os.listdir(search_directory):
             if any(file.endswith('.sql') for file in os.listdir(search_directory) if os.path.isfile(os.path.join(search_directory, file))):
                 # After all processes have completed, perform the vote result
-                agent_format.vote_result(search_directory, args, sql_paths, table_info, question)
+                with track(run_state, sql_data, None, "voting"):
+                    agent_format.vote_result(search_directory, instance_args, sql_paths, table_info, question)
             else:
                 print(f"{sql_data}: Empty")
     else:
         # Directly execute the task
         execute(
-            question, table_info, args,
+            question, table_info, instance_args,
             agent_format.csv_save_name, agent_format.log_save_name, agent_format.sql_save_name,
-            search_directory, format_csv, sql_data
+            search_directory, format_csv, sql_data, deadline=deadline
         )
 
+    if deadline is not None:
+        deadline.save(search_directory)
+    latency_history.update(sql_data, time.time() - start_time)
+    get_spend().finish_instance(sql_data)
     print(f"Time for {sql_data}: {int((time.time() - start_time) // 60)} min")
 
 if __name__ == '__main__':
@@ -211,6 +497,8 @@ if __name__ == '__main__':
 
     parser.add_argument('--do_column_exploration', action="store_true")
     parser.add_argument('--column_exploration_model', type=str, default="o3")    
+    parser.add_argument('--knowledge_store', type=str, default=None, help="SQLite file of exploration results shared by the instances of a database, see knowledge.py")
+    parser.add_argument('--knowledge_skip_probes', action="store_true", help="use the stored result of an exploration query instead of running it again")
 
     parser.add_argument('--do_self_refinement', action="store_true")
     parser.add_argument('--do_self_consistency', action="store_true")
@@ -220,6 +508,11 @@ if __name__ == '__main__':
     parser.add_argument('--max_iter', type=int, default=5)
     parser.add_argument('--temperature', type=float, default=1)
     parser.add_argument('--early_stop', action="store_true")
+    parser.add_argument('--deadline', type=float, default=None, help="seconds per instance; stages that no longer fit are skipped, see deadline.py")
+    parser.add_argument('--refine_branches', type=int, default=1, help="self-refine candidates asked in parallel per iteration")
+    parser.add_argument('--branch_budget', type=int, default=0, help="self-refine candidates per vote over all iterations with --refine_branches, 0 for refine_branches * max_iter")
+    parser.add_argument('--history_policy', type=str, default="full", choices=HISTORY_POLICIES)
+    parser.add_argument('--history_turns', type=int, default=2)
 
     parser.add_argument('--do_vote', action="store_true")
     parser.add_argument('--revote', action="store_true")
@@ -227,16 +520,59 @@ if __name__ == '__main__':
     parser.add_argument('--random_vote_for_tie', action="store_true")
     parser.add_argument('--model_vote', type=str, default=None)
     parser.add_argument('--final_choose', action="store_true")
+    parser.add_argument('--adaptive_votes', action="store_true", help="start with --min_votes and add votes while they disagree")
+    parser.add_argument('--min_votes', type=int, default=3)
+    parser.add_argument('--max_votes', type=int, default=8)
+    parser.add_argument('--vote_confidence', type=float, default=0.75, help="share of finished votes that must agree to stop adding votes")
+    parser.add_argument('--vote_capacity', type=int, default=None, help="votes running at once over all instances, defaults to num_workers * min_votes")
+    parser.add_argument('--early_majority', type=int, default=0, help="stop the remaining votes once this many agree and no other answer can still win")
+
+    parser.add_argument('--cascade_config', type=str, default=None, help="JSON file of per-stage model ladders and escalation triggers, see cascade.py")
 
     parser.add_argument('--save_all_results', action="store_true")
     parser.add_argument('--rerun', action="store_true")
     parser.add_argument('--overwrite_unfinished', action="store_true")
     parser.add_argument('--num_workers', type=int, default=16)
+    parser.add_argument('--run_budget_usd', type=float, default=None, help="LLM spend limit of the run (all runs on this output_path), see spending.py")
+    parser.add_argument('--run_budget_tokens', type=int, default=None, help="the same limit in prompt + completion tokens")
+    parser.add_argument('--instance_allocation', type=str, default="fixed", choices=["fixed", "proportional"], help="equal budget shares, or shares by expected difficulty")
+    parser.add_argument('--instance_overrun', type=float, default=2.0, help="end an instance's votes once it spent this many times its allocation")
+    parser.add_argument('--budget_fallback_model', type=str, default="gpt-4o-mini", help="model of instances whose allocation is far below the mean spend")
+    # set by spending.InstancePlan.apply on the args of a degraded instance
+    parser.set_defaults(fallback_model=None)
+    parser.add_argument('--warehouse_limits', nargs="+", default=None, help="concurrent queries per warehouse, e.g. snowflake=4 bigquery=8 snowflake:COMPUTE_WH=2")
+    parser.add_argument('--bigquery_budget_gb', type=float, default=None, help="stop BigQuery queries after this many GB billed")
+    parser.add_argument('--snowflake_budget_credits', type=float, default=None, help="stop Snowflake queries after this many (estimated) credits")
+    parser.add_argument('--snowflake_credits_per_hour', type=float, default=1.0, help="credit rate of the warehouse, 1 for X-Small")
+    parser.add_argument('--schedule', type=str, default="listed", choices=["locality", "listed"], help="locality: group instances by database, longest first, keeping its connections open; listed: as listed")
+    parser.add_argument('--cpu_workers', type=int, default=0, help="processes for CSV comparison/summaries and SQL splitting; 0 runs them in the worker threads")
+    parser.add_argument('--metrics_path', type=str, default=None)
+    parser.add_argument('--trace_path', type=str, default=None)
+    parser.add_argument('--record_bundle', type=str, default=None)
+    parser.add_argument('--replay_bundle', type=str, default=None)
+    parser.add_argument('--log_format', type=str, default="text", choices=["text", "jsonl"])
+    parser.add_argument('--artifact_store', type=str, default=None, help="SQLite file holding per-vote/final artifacts instead of per-instance directories")
+    parser.add_argument('--state_db', type=str, default=None, help="SQLite run state; resume redoes only unfinished units")
+    parser.add_argument('--max_attempts', type=int, default=3)
+    parser.add_argument('--role', type=str, default=None, choices=["coordinator", "worker"], help="share --state_db (and --artifact_store) between processes/nodes")
+    parser.add_argument('--worker_id', type=str, default=None, help="defaults to <hostname>-<pid>")
+    parser.add_argument('--lease_seconds', type=float, default=600)
+    parser.add_argument('--poll_interval', type=float, default=10)
+    parser.add_argument('--scratch_dir', type=str, default=None, help="local working directory used with --artifact_store")
+    parser.add_argument('--log_compress', type=str, default=None, choices=["gzip", "zstd"], help="compression of log blobs")
 
     parser.add_argument('--omnisql_format_pth', type=str, default=None)
     parser.add_argument('--BIRD_gold_result_path', type=str, default="../../data/BIRD/gold_result")
     args = parser.parse_args()
     prompt_all = Prompts()
+    artifact_store = ArtifactStore(args.artifact_store, shared=args.role is not None) if args.artifact_store else None
+    scratch_root = tempfile.mkdtemp(prefix="reforce-", dir=args.scratch_dir) if artifact_store else None
+    if args.role and not args.state_db:
+        parser.error("--role requires --state_db")
+    worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    vote_slots = threading.BoundedSemaphore(args.vote_capacity or args.num_workers * args.min_votes) if args.adaptive_votes else None
+    run_state = RunState(args.state_db, worker_id if args.role else None, args.lease_seconds if args.role else None, shared=args.role is not None) if args.state_db else None
+    knowledge_store = KnowledgeStore(args.knowledge_store, shared=args.role is not None) if args.knowledge_store else None
 
     full_db_id = {}
     full_tb_info = {}
@@ -272,4 +608,13 @@ if __name__ == '__main__':
                 full_gold_sql[instance_id] = example["SQL"]                     
     else:
         dictionaries, task_dict = get_dictionary(args.db_path, args.task)
+
+    latency_history = LatencyHistory(args.output_path)
+    expected = latency_history.expected({sql_data: schema_size(sql_data, args.db_path, full_tb_info) for sql_data in dictionaries})
+    db_keys = database_keys(dictionaries, args.db_path, args.task, full_db_id)
+    schedule, warm_resources = dictionaries, None
+    if args.schedule == "locality":
+        schedule = locality_order(dictionaries, db_keys, expected)
+        warm_resources = WarmResources(db_keys, dictionaries)
+        print(f"Schedule: {len(dictionaries)} instances on {len(set(db_keys.values()))} databases")
     main(args)
\ No newline at end of file
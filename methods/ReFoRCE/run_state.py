@@ -0,0 +1,243 @@
+"""Crash-safe run state and work queue for run.py.
+
+Every unit of work (instance_id, vote, stage) has a row in a SQLite database
+moving pending -> running -> done | failed. Transitions are single UPDATEs
+guarded by the expected current state, so a unit is claimed by one worker
+only and a killed run leaves nothing half-recorded: on restart, recover()
+puts running (in flight when the run died) and failed units back to
+pending, and only those are redone. Stage outputs that later stages need
+(the answer format, exploration results) are stored with the unit.
+
+Instance-level units use vote -1: "instance" (the work queue drained by
+run.main), "format" and "voting". Per vote: "vote", "exploration".
+
+With an owner and lease_seconds (run.py --role worker), several processes or
+nodes share one database on a shared volume: running units carry their
+owner and a lease that a heartbeat thread renews; a unit whose lease expired
+(its worker died) is claimed again by another worker, and a worker that lost
+its lease can no longer finish the unit. Failed instances are claimed again
+too; either way an instance is taken at most max_attempts times.
+
+    python run.py ... --state_db runs/o3-lite.state.db
+    python run_state.py --state_db runs/o3-lite.state.db    # progress summary
+"""
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from shared_db import SharedDB
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+INSTANCE = -1
+
+
+def vote_key(vote):
+    return INSTANCE if vote is None else vote
+
+
+class Unit:
+    def __init__(self, output=None):
+        self.output = output
+
+
+class RunState:
+    def __init__(self, path, owner=None, lease_seconds=None, shared=False):
+        self.path = path
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.db = SharedDB(path, shared, synchronous="FULL")
+        self.heartbeat_stop = None
+        with self.db.transaction() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS units (
+                instance_id TEXT NOT NULL,
+                vote INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                output TEXT,
+                error TEXT,
+                updated REAL NOT NULL,
+                owner TEXT,
+                lease_expires REAL,
+                PRIMARY KEY (instance_id, vote, stage))""")
+            conn.execute("CREATE INDEX IF NOT EXISTS units_queue ON units (stage, state)")
+
+    def connect(self):
+        return self.db.connect()
+
+    def lease(self):
+        return time.time() + self.lease_seconds if self.lease_seconds else None
+
+    def transition(self, instance_id, vote, stage, from_states, to_state, **fields):
+        """Atomically move a unit from one of from_states to to_state; returns
+        whether it happened. With leases, only the owner can leave running."""
+        fields = dict(fields, state=to_state, updated=time.time())
+        if to_state == RUNNING:
+            fields.update(owner=self.owner, lease_expires=self.lease())
+        sets = ", ".join(f"{k} = ?" for k in fields)
+        where = f"instance_id = ? AND vote = ? AND stage = ? AND state IN ({', '.join('?' * len(from_states))})"
+        params = [instance_id, vote_key(vote), stage, *from_states]
+        if self.owner is not None and to_state != RUNNING:
+            where += " AND (state != ? OR owner = ?)"
+            params += [RUNNING, self.owner]
+        with self.db.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO units (instance_id, vote, stage, state, updated) VALUES (?, ?, ?, ?, ?)",
+                         (instance_id, vote_key(vote), stage, PENDING, time.time()))
+            cursor = conn.execute(f"UPDATE units SET {sets} WHERE {where}", (*fields.values(), *params))
+            return cursor.rowcount == 1
+
+    def count_attempt(self, instance_id, vote, stage):
+        with self.db.transaction() as conn:
+            conn.execute("UPDATE units SET attempts = attempts + 1 WHERE instance_id = ? AND vote = ? AND stage = ?",
+                         (instance_id, vote_key(vote), stage))
+
+    def start(self, instance_id, vote, stage):
+        started = self.transition(instance_id, vote, stage, [PENDING, FAILED, RUNNING], RUNNING, error=None)
+        if started:
+            self.count_attempt(instance_id, vote, stage)
+        return started
+
+    def finish(self, instance_id, vote, stage, output=None):
+        return self.transition(instance_id, vote, stage, [RUNNING], DONE, output=json.dumps(output))
+
+    def fail(self, instance_id, vote, stage, error):
+        return self.transition(instance_id, vote, stage, [RUNNING], FAILED, error=str(error)[:2000])
+
+    def get(self, instance_id, vote, stage):
+        row = self.connect().execute("SELECT state, output FROM units WHERE instance_id = ? AND vote = ? AND stage = ?",
+                                     (instance_id, vote_key(vote), stage)).fetchone()
+        return row if row else (None, None)
+
+    def is_done(self, instance_id, vote, stage):
+        return self.get(instance_id, vote, stage)[0] == DONE
+
+    def output(self, instance_id, vote, stage):
+        """Stored output of a finished unit, or None."""
+        state, output = self.get(instance_id, vote, stage)
+        return json.loads(output) if state == DONE and output is not None else None
+
+    @contextmanager
+    def unit(self, instance_id, vote, stage):
+        """Run the block as a unit: running on entry, done with the Unit's
+        output on exit, failed if it raises (including SystemExit)."""
+        self.start(instance_id, vote, stage)
+        unit = Unit()
+        try:
+            yield unit
+        except BaseException as e:
+            self.fail(instance_id, vote, stage, repr(e))
+            raise
+        self.finish(instance_id, vote, stage, unit.output)
+
+    # work queue
+    def add_instances(self, instance_ids):
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.executemany("INSERT OR IGNORE INTO units (instance_id, vote, stage, state, updated) VALUES (?, ?, 'instance', ?, ?)",
+                             [(instance_id, INSTANCE, PENDING, now) for instance_id in instance_ids])
+
+    def recover(self, max_attempts=3):
+        """Reset units left running by a dead run, and failed ones with
+        attempts left, to pending; their instances are queued again. Only for
+        a single run owning the database; shared runs rely on lease expiry."""
+        with self.db.transaction() as conn:
+            reset = conn.execute("UPDATE units SET state = ?, updated = ? WHERE state = ? OR (state = ? AND attempts < ?)",
+                                 (PENDING, time.time(), RUNNING, FAILED, max_attempts)).rowcount
+            conn.execute("""UPDATE units SET state = ? WHERE stage IN ('instance', 'voting') AND state = ? AND instance_id IN
+                            (SELECT instance_id FROM units WHERE state = ? AND stage NOT IN ('instance', 'voting'))""",
+                         (PENDING, DONE, PENDING))
+        return reset
+
+    def claim(self, max_attempts=3):
+        """Take the next pending instance off the queue, or a lease-expired or
+        failed one with attempts left, marked running; None when there is
+        none. A lease-expired instance out of attempts (its worker keeps
+        dying on it) is marked failed."""
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute("""UPDATE units SET state = ?, error = ?, updated = ?
+                            WHERE stage = 'instance' AND state = ? AND lease_expires < ? AND attempts >= ?""",
+                         (FAILED, "lease expired, no attempts left", now, RUNNING, now, max_attempts))
+            row = conn.execute("""UPDATE units SET state = ?, owner = ?, lease_expires = ?, updated = ?
+                                  WHERE rowid = (SELECT rowid FROM units WHERE stage = 'instance'
+                                                 AND (state = ? OR (state IN (?, ?) AND attempts < ? AND (state = ? OR lease_expires < ?)))
+                                                 ORDER BY rowid LIMIT 1)
+                                  RETURNING instance_id""",
+                               (RUNNING, self.owner, self.lease(), now, PENDING, RUNNING, FAILED, max_attempts, FAILED, now)).fetchone()
+        return row[0] if row else None
+
+    def running(self):
+        """Instances being worked on under a live lease (or without leases)."""
+        return self.connect().execute("SELECT COUNT(*) FROM units WHERE stage = 'instance' AND state = ? AND (lease_expires IS NULL OR lease_expires >= ?)",
+                                      (RUNNING, time.time())).fetchone()[0]
+
+    def pending(self):
+        """Instances queued and not claimed yet."""
+        return [row[0] for row in self.connect().execute("SELECT instance_id FROM units WHERE stage = 'instance' AND state = ?", (PENDING,))]
+
+    def remaining(self):
+        return self.connect().execute("SELECT COUNT(*) FROM units WHERE stage = 'instance' AND state IN (?, ?)", (PENDING, RUNNING)).fetchone()[0]
+
+    # leases
+    def renew(self):
+        with self.db.transaction() as conn:
+            return conn.execute("UPDATE units SET lease_expires = ? WHERE owner = ? AND state = ?",
+                                (self.lease(), self.owner, RUNNING)).rowcount
+
+    def start_heartbeat(self):
+        """Renew this owner's leases every lease_seconds / 3 in a daemon thread."""
+        self.heartbeat_stop = threading.Event()
+
+        def beat(stop):
+            while not stop.wait(self.lease_seconds / 3):
+                try:
+                    self.renew()
+                except Exception as e:
+                    print(f"Heartbeat of {self.owner} failed: {e!r}")
+        threading.Thread(target=beat, args=(self.heartbeat_stop,), daemon=True).start()
+
+    def stop_heartbeat(self):
+        if self.heartbeat_stop is not None:
+            self.heartbeat_stop.set()
+
+    def summary(self):
+        counts = defaultdict(dict)
+        for stage, state, count in self.connect().execute("SELECT stage, state, COUNT(*) FROM units GROUP BY stage, state"):
+            counts[stage][state] = count
+        return dict(counts)
+
+    def owners(self):
+        """{owner: number of instances it finished}"""
+        return dict(self.connect().execute("SELECT owner, COUNT(*) FROM units WHERE stage = 'instance' AND state = ? AND owner IS NOT NULL GROUP BY owner",
+                                           (DONE,)).fetchall())
+
+    def print_summary(self):
+        print(f"{'stage':<14}" + "".join(f"{s:>10}" for s in [PENDING, RUNNING, DONE, FAILED]))
+        for stage, counts in sorted(self.summary().items()):
+            print(f"{stage:<14}" + "".join(f"{counts.get(s, 0):>10}" for s in [PENDING, RUNNING, DONE, FAILED]))
+        owners = self.owners()
+        if owners:
+            print("Instances done per worker: " + ", ".join(f"{owner}: {count}" for owner, count in sorted(owners.items())))
+
+    def close(self):
+        self.stop_heartbeat()
+        self.db.close()
+
+
+@contextmanager
+def track(state, instance_id, vote, stage):
+    """state.unit(...) when a RunState is configured, otherwise a no-op."""
+    if state is None:
+        yield Unit()
+        return
+    with state.unit(instance_id, vote, stage) as unit:
+        yield unit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--state_db', type=str, required=True)
+    args = parser.parse_args()
+    RunState(args.state_db).print_summary()
@@ -0,0 +1,150 @@
+"""Instance order and per-database warm resources for run.py.
+
+Instances run in the order listed unless --schedule locality groups them by
+database: the db_id of omnisql/BIRD data or of the spider2 jsonl, else the
+instance's sqlite file, with the backend (sqlite/snowflake/bigquery) in the
+key. Groups run one after the other, the longest expected group first, and
+the longest instance first within a group, so the worker pool ends on short
+work instead of a long straggler. An instance is expected to take as long
+as it last took (<output_path>/.instance_latency.json, updated as instances
+finish), or, never run yet, its schema text size at the median seconds per
+byte of the instances that have.
+
+While a database's group runs, its SqlEnvs are kept in WarmResources and
+handed from one vote to the next with their connections open; they are
+closed when the last instance of the group is done. With --state_db the
+group's instances left are those this process runs and those still queued
+(other workers, or an earlier run, take or have done the rest), so a worker
+closes a database's connections once the queue holds none of its instances.
+"""
+import json
+import os
+import statistics
+import threading
+from collections import defaultdict
+from sql import SqlEnv
+from utils import get_api_name, get_sqlite_path, search_file
+
+LATENCY_FILE = ".instance_latency.json"
+
+
+def spider2_db_ids(db_path, task):
+    """{instance_id: db} from the spider2 jsonl of the task, when there is one."""
+    paths = [os.path.join(db_path or "", "spider2-lite.jsonl"), f"../../spider2-{task}/spider2-{task}.jsonl"]
+    for path in paths:
+        if os.path.exists(path):
+            db_ids = {}
+            with open(path) as f:
+                for line in f:
+                    example = json.loads(line)
+                    db_ids[example["instance_id"]] = example.get("db") or example.get("db_id")
+            return db_ids
+    return {}
+
+
+def database_keys(instances, db_path, task, full_db_id=None):
+    """{instance_id: "<api>:<database>"}; an instance whose database is not
+    known is a group of its own."""
+    db_ids = dict(spider2_db_ids(db_path, task), **(full_db_id or {}))
+    keys = {}
+    for sql_data in instances:
+        api = get_api_name(sql_data)
+        db = db_ids.get(sql_data)
+        if db is None and api == "sqlite":
+            db = get_sqlite_path(db_path, sql_data, None, task) or None
+        keys[sql_data] = f"{api}:{db or sql_data}"
+    return keys
+
+
+def schema_size(sql_data, db_path, full_tb_info=None):
+    if full_tb_info:
+        return len(full_tb_info.get(sql_data, ""))
+    return sum(os.path.getsize(path) for path in search_file(os.path.join(db_path, sql_data), "prompts.txt"))
+
+
+class LatencyHistory:
+    def __init__(self, output_path):
+        self.path = os.path.join(output_path, LATENCY_FILE)
+        self.lock = threading.Lock()
+        self.latencies = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.latencies = json.load(f)
+
+    def expected(self, sizes):
+        """{instance_id: expected seconds (or bytes when nothing ran yet)}."""
+        rates = [self.latencies[k] / sizes[k] for k in sizes if k in self.latencies and sizes[k]]
+        rate = statistics.median(rates) if rates else 1.0
+        return {k: self.latencies.get(k, size * rate) for k, size in sizes.items()}
+
+    def update(self, sql_data, seconds):
+        with self.lock:
+            self.latencies[sql_data] = seconds
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.latencies, f)
+            os.replace(tmp_path, self.path)
+
+
+def locality_order(instances, db_keys, expected):
+    """Instances grouped by database, groups and instances longest first."""
+    groups = defaultdict(list)
+    for sql_data in instances:
+        groups[db_keys[sql_data]].append(sql_data)
+    for members in groups.values():
+        members.sort(key=lambda k: expected[k], reverse=True)
+    ordered = sorted(groups.values(), key=lambda members: sum(expected[k] for k in members), reverse=True)
+    return [sql_data for members in ordered for sql_data in members]
+
+
+class WarmResources:
+    def __init__(self, db_keys, instances):
+        self.db_keys = db_keys
+        self.remaining = defaultdict(int)
+        for sql_data in instances:
+            self.remaining[db_keys[sql_data]] += 1
+        self.running = defaultdict(int)
+        self.free = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def sql_env(self, sql_data):
+        """A SqlEnv of the instance's database, with its connections open if
+        another vote used it before."""
+        with self.lock:
+            free = self.free[self.db_keys.get(sql_data)]
+            return free.pop() if free else SqlEnv()
+
+    def release(self, sql_data, sql_env):
+        with self.lock:
+            key = self.db_keys.get(sql_data)
+            if self.remaining[key] > 0:
+                self.free[key].append(sql_env)
+                return
+        sql_env.close_db()
+
+    def instance_start(self, sql_data):
+        with self.lock:
+            self.running[self.db_keys.get(sql_data)] += 1
+
+    def instance_done(self, sql_data, pending=None):
+        """Close the database's SqlEnvs after the last instance of its group.
+        pending: the instances still queued (--state_db); the group's count
+        is then the instances running here plus its queued ones."""
+        with self.lock:
+            key = self.db_keys.get(sql_data)
+            self.running[key] -= 1
+            self.remaining[key] -= 1
+            if pending is not None:
+                self.remaining[key] = self.running[key] + sum(1 for i in pending if self.db_keys.get(i) == key)
+            if self.remaining[key] > 0:
+                return
+            closing = self.free.pop(key, [])
+        for sql_env in closing:
+            sql_env.close_db()
+
+    def close(self):
+        with self.lock:
+            closing = [sql_env for free in self.free.values() for sql_env in free]
+            self.free.clear()
+        for sql_env in closing:
+            sql_env.close_db()
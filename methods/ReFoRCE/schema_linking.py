@@ -1,5 +1,7 @@
 from utils import search_file, get_api_name, get_dictionary, get_tb_info, get_external, compute_precision_recall, is_csv_empty, clear_name
 from reconstruct_data import remove_digits, compress_ddl
+from budget import count_tokens, SCHEMA_TOKEN_THRESHOLD
+from metrics import set_context, stage, init_recorder
 import os
 import json
 import csv
@@ -11,9 +13,12 @@ import sys
 import re
 import numpy as np
 csv.field_size_limit(sys.maxsize)
-THRESHOLD = 200000
 DEPS_DEV_V1 = ["sf_bq016", "sf_bq062", "sf_bq063", "sf_bq028"]
 
+def prompts_tokens(prompts_pth):
+    with open(prompts_pth) as f:
+        return count_tokens(f.read())
+
 def reduce_columns(sql: str, subset_columns: set[str]) -> str:
 
     table_match = re.search(r'create\s+(?:or\s+replace\s+)?table\s+`?([^\s(]+)`?', sql, re.IGNORECASE)
@@ -52,7 +57,7 @@ def reduce_ddl(example_path, dictionaries, linked_json, reduce_col=False):
  
         ddl_paths = search_file(os.path.join(example_path, eg_id), "DDL.csv")
 
-        if os.path.getsize(os.path.join(example_path, eg_id, "prompts.txt")) < THRESHOLD or eg_id in DEPS_DEV_V1:
+        if eg_id in DEPS_DEV_V1 or prompts_tokens(os.path.join(example_path, eg_id, "prompts.txt")) < SCHEMA_TOKEN_THRESHOLD:
             continue
 
         with open(linked_json) as f:
@@ -163,11 +168,13 @@ def ask_model_sl(example_path, json_save_pth):
         with open(tb_info_pth[0]) as f:
             tb_info = f.read()
         task = task_dict[ex_id]
+        set_context(instance_id=ex_id)
         chat_session = GPTChat(azure=True, model="gpt-4o-rag-research", temperature=0)
         result = ask_model_sl_(tb_info, task, chat_session)
         return ex_id, result
 
     linked_dic = {}
+    metrics = init_recorder(json_save_pth.replace(".json", "_metrics.jsonl"))
     print("Doing table-level schema linking")
     with ThreadPoolExecutor(max_workers=32) as executor:
         futures = [executor.submit(process_example, ex_id) for ex_id in dictionaries]
@@ -178,7 +185,9 @@ def ask_model_sl(example_path, json_save_pth):
 
         with open(json_save_pth, "w") as f:
             json.dump(linked_dic, f, indent=4)
+    metrics.print_summary()
 
+@stage("schema_linking")
 def ask_model_sl_(tb_info, task, chat_session):
     tbs = get_tb_info(tb_info)
     external = get_external(tb_info)
@@ -219,7 +228,7 @@ def compute_metrics_sl(file_pth, db_path):
             if ex['instance_id'] == example:
                 gold_table = set(ex["gold_tables"])    
 
-        if os.path.getsize(os.path.join(db_path, example, "prompts.txt")) > THRESHOLD:
+        if prompts_tokens(os.path.join(db_path, example, "prompts.txt")) > SCHEMA_TOKEN_THRESHOLD:
             count += 1
             pred = []
             
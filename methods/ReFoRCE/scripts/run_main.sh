@@ -19,6 +19,11 @@ while [[ $# -gt 0 ]]; do
       shift
       shift
       ;;
+    --budget_usd)
+      BUDGET_USD="$2"
+      shift
+      shift
+      ;;
     *)
       shift
       ;;
@@ -100,6 +105,11 @@ if [ "$AZURE" = true ]; then
   CMD1="$CMD1 --azure"
   CMD2="$CMD2 --azure"
 fi
+# Both steps share the budget (spend is kept in the output path)
+if [ -n "$BUDGET_USD" ]; then
+  CMD1="$CMD1 --run_budget_usd $BUDGET_USD"
+  CMD2="$CMD2 --run_budget_usd $BUDGET_USD"
+fi
 
 eval $CMD1
 echo "Evaluation for Step 1"
@@ -0,0 +1,64 @@
+"""SQLite connections shared by threads, processes or nodes.
+
+Each thread gets its own connection. Local files use WAL. Files on a shared
+volume (NFS and the like, where WAL's shared-memory index does not work)
+use a rollback journal, and write transactions are serialized across
+processes and nodes with an flock on <path>.lock, plus a thread lock because
+flock over NFS is emulated with per-process POSIX locks.
+"""
+import fcntl
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager, nullcontext
+
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.Lock()
+        self.fd = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.thread_lock.release()
+
+
+class SharedDB:
+    def __init__(self, path, shared=False, synchronous="NORMAL"):
+        self.path = path
+        self.shared = shared
+        self.synchronous = synchronous
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = FileLock(path + ".lock") if shared else None
+
+    def connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute(f"PRAGMA journal_mode={'DELETE' if self.shared else 'WAL'}")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Connection for a write transaction, committed on exit."""
+        conn = self.connect()
+        with self.lock or nullcontext():
+            with conn:
+                yield conn
+
+    def close(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
@@ -0,0 +1,201 @@
+"""Run-wide LLM spend budget with per-instance allocations.
+
+run.py --run_budget_usd (or --run_budget_tokens) caps what a run spends on
+LLM calls. Spend comes from the metrics records of GPTChat (cost from
+metrics.MODEL_PRICES, or prompt + completion tokens) and is kept in
+<output_path>/.spend.json, so the steps of run_main.sh that share an output
+path share one budget.
+
+Each instance starting gets an allocation out of what is left: an equal
+share over the instances still to run (--instance_allocation fixed), or
+a share weighted by its expected difficulty (proportional; the expected
+time of scheduler.LatencyHistory). Instances still to run are those of the
+run not finished in an earlier step, not skipped (result already there,
+another subtask) and, with --state_db, still pending in the work queue, so
+instances done or claimed by other workers take no share. Compared with the mean spend of the
+instances finished so far, an allocation that falls short degrades the
+instance step by step:
+
+    below 1x the mean     fewer votes, in proportion
+    below 0.5x            no column exploration
+    below 0.25x           --budget_fallback_model for exploration and generation
+
+The next LLM call of an instance that has spent --instance_overrun times
+its allocation, or of any instance once the run budget is spent, raises
+BudgetSpent: a vote (or the single run without --do_vote) ends like a
+cancelled vote, the answer format is left out and the model vote makes no
+choice; no more instances start. Calls of a model without a
+metrics.MODEL_PRICES entry cost nothing in USD (a warning says so), so
+budget them with --run_budget_tokens.
+"""
+import copy
+import json
+import os
+import threading
+from collections import defaultdict
+from metrics import get_context, get_recorder, MODEL_PRICES
+from voter import VoteCancelled
+
+SPEND_FILE = ".spend.json"
+# (allocation / mean instance spend below which, degradation)
+DEGRADATION_STEPS = [(1.0, "fewer votes"), (0.5, "no exploration"), (0.25, "fallback model")]
+
+
+class BudgetSpent(VoteCancelled):
+    pass
+
+
+class InstancePlan:
+    def __init__(self, allocation=None, vote_scale=1.0, skip_exploration=False, fallback_model=None):
+        self.allocation = allocation
+        self.vote_scale = vote_scale
+        self.skip_exploration = skip_exploration
+        self.fallback_model = fallback_model
+
+    def apply(self, args):
+        """args for the instance, degraded as planned."""
+        if self.vote_scale >= 1 and not self.skip_exploration and not self.fallback_model:
+            return args
+        args = copy.copy(args)
+        args.num_votes = max(1, int(args.num_votes * self.vote_scale))
+        args.min_votes = max(1, int(args.min_votes * self.vote_scale))
+        args.max_votes = max(args.min_votes, int(args.max_votes * self.vote_scale))
+        if self.skip_exploration:
+            args.do_column_exploration = False
+        args.fallback_model = self.fallback_model
+        return args
+
+
+class SpendController:
+    def __init__(self, budget=None, unit="usd", output_path=None, allocation="fixed", overrun=2.0, fallback_model=None):
+        self.budget = budget
+        self.unit = unit
+        self.allocation = allocation
+        self.overrun = overrun
+        self.fallback_model = fallback_model
+        self.path = os.path.join(output_path, SPEND_FILE) if output_path else None
+        self.spent = defaultdict(float)  # instance_id: spend
+        self.finished = {}  # instance_id: spend, of instances that ran to the end
+        self.allocations = {}
+        self.pending_weights = {}
+        self.unpriced = set()
+        self.lock = threading.Lock()
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("unit") == unit:
+                self.spent.update(data["spent"])
+                self.finished = data["finished"]
+
+    @property
+    def enabled(self):
+        return self.budget is not None
+
+    def total(self):
+        return sum(self.spent.values())
+
+    def set_instances(self, weights):
+        """{instance_id: expected difficulty} of the instances to run; those
+        finished in an earlier step are left out."""
+        with self.lock:
+            self.pending_weights = {k: (w if self.allocation == "proportional" else 1.0) or 1.0
+                                    for k, w in weights.items() if k not in self.finished}
+
+    def drop_instance(self, sql_data):
+        """The instance will not start (or has started): it takes no share."""
+        with self.lock:
+            self.pending_weights.pop(sql_data, None)
+
+    def on_record(self, record):
+        """metrics listener: add the spend of an LLM call to its instance."""
+        if not self.enabled or record.get("kind", "llm") != "llm":
+            return
+        if self.unit == "usd":
+            amount = record.get("cost") or 0
+            model = record.get("model")
+            if model not in MODEL_PRICES and model not in self.unpriced:
+                self.unpriced.add(model)
+                print(f"Spend: {model} has no MODEL_PRICES entry, its calls count as $0 against the run budget; use --run_budget_tokens")
+        else:
+            amount = record.get("prompt_tokens", 0) + record.get("completion_tokens", 0)
+        with self.lock:
+            self.spent[record.get("instance_id") or "unknown"] += amount
+
+    def start_instance(self, sql_data, pending=None):
+        """The instance's InstancePlan, or None if the run budget is spent.
+        pending: the instances still queued (--state_db), when known; the
+        others no longer take a share."""
+        if not self.enabled:
+            return InstancePlan()
+        with self.lock:
+            if pending is not None:
+                pending = set(pending)
+                self.pending_weights = {k: w for k, w in self.pending_weights.items() if k in pending or k == sql_data}
+            remaining = self.budget - sum(self.spent.values())
+            if remaining <= 0:
+                return None
+            weight = self.pending_weights.pop(sql_data, 1.0)
+            allocation = remaining * weight / (weight + sum(self.pending_weights.values()))
+            self.allocations[sql_data] = allocation
+            mean = sum(self.finished.values()) / len(self.finished) if self.finished else None
+        plan = InstancePlan(allocation)
+        if mean:
+            ratio = allocation / mean
+            plan.vote_scale = min(1.0, ratio)
+            plan.skip_exploration = ratio < DEGRADATION_STEPS[1][0]
+            plan.fallback_model = self.fallback_model if ratio < DEGRADATION_STEPS[2][0] else None
+            degraded = [name for threshold, name in DEGRADATION_STEPS if ratio < threshold]
+            if degraded:
+                print(f"{sql_data}: allocation {allocation:.4g} {self.unit} is {ratio:.2f}x the mean instance spend, degrading: {', '.join(degraded)}")
+                get_recorder().record(kind="spend_plan", allocation=allocation, ratio=ratio, degraded=degraded)
+        return plan
+
+    def check(self):
+        """Raise BudgetSpent in an instance that (or a run that) is out of budget."""
+        if not self.enabled:
+            return
+        sql_data = get_context().get("instance_id")
+        if sql_data is None:
+            return
+        with self.lock:
+            if sum(self.spent.values()) >= self.budget:
+                raise BudgetSpent("run budget spent")
+            allocation = self.allocations.get(sql_data)
+            if allocation is not None and self.spent[sql_data] >= allocation * self.overrun:
+                raise BudgetSpent(f"{sql_data} spent {self.overrun}x its allocation")
+
+    def finish_instance(self, sql_data):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.finished[sql_data] = self.spent[sql_data]
+        self.save()
+
+    def save(self):
+        if not self.path or not self.enabled:
+            return
+        with self.lock:
+            data = {"unit": self.unit, "spent": dict(self.spent), "finished": self.finished}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+    def print_summary(self):
+        if not self.enabled:
+            return
+        mean = sum(self.finished.values()) / len(self.finished) if self.finished else 0
+        print(f"Spend: {self.total():.4g} of {self.budget:.4g} {self.unit}, {len(self.finished)} instances finished, mean {mean:.4g} {self.unit} each")
+
+
+_controller = SpendController()
+
+
+def get_spend():
+    return _controller
+
+
+def init_spend(budget=None, unit="usd", output_path=None, allocation="fixed", overrun=2.0, fallback_model=None):
+    global _controller
+    _controller = SpendController(budget, unit, output_path, allocation, overrun, fallback_model)
+    return _controller
@@ -8,6 +8,9 @@ import snowflake.connector
 import json
 import pandas as pd
 from func_timeout import func_timeout, FunctionTimedOut
+from tracing import span
+from replay import get_bundle
+from governor import get_governor, credential_field, BudgetExhausted
 
 class SqlEnv:
     def __init__(self):
@@ -103,7 +106,7 @@ class SqlEnv:
             else:
                 return hard_cut(csv_content, max_len)
 
-    def exec_sql_bq(self, sql_query, save_path, max_len):
+    def exec_sql_bq(self, sql_query, save_path, max_len, usage=None):
         bigquery_credential = service_account.Credentials.from_service_account_file("./bigquery_credential.json")
         client = bigquery.Client(credentials=bigquery_credential, project=bigquery_credential.project_id)
         query_job = client.query(sql_query)
@@ -111,6 +114,9 @@ class SqlEnv:
             result_iterator = query_job.result()
         except Exception as e:
             return "##ERROR##"+str(e)
+        finally:
+            if usage is not None:
+                usage["bytes_billed"] = query_job.total_bytes_billed or 0
         rows = []
         current_len = 0
         for row in result_iterator:
@@ -131,22 +137,40 @@ class SqlEnv:
                 return hard_cut(df.to_csv(index=False), max_len)
 
     def execute_sql_api(self, sql_query, ex_id, save_path=None, api="sqlite", max_len=30000, sqlite_path=None, timeout=300):
-        if api == "bigquery":
-            result = self.exec_sql_bq(sql_query, save_path, max_len)
-        elif api == "snowflake":
-            if ex_id not in self.conns.keys():
-                self.start_db_sf(ex_id)
-            result = self.exec_sql_sf(sql_query, save_path, max_len, ex_id)
-        elif api == "sqlite":
-            if sqlite_path not in self.conns.keys():
-                self.start_db_sqlite(sqlite_path)
-            result = self.execute_sqlite_with_timeout(sql_query, save_path, max_len, sqlite_path, timeout=300)
-            # result = self.exec_sql_sqlite(sql_query, save_path, max_len, sqlite_path)
+        bundle = get_bundle()
+        if bundle and bundle.replaying:
+            try:
+                return bundle.replay_sql(sql_query, api, sqlite_path, save_path)
+            except Exception as e:
+                return {"status": "error", "error_msg": f"##ERROR## {e}"}
+        with span(f"sql.{api}") as sql_span:
+            try:
+                if api == "bigquery":
+                    with get_governor().query(api, credential_field("./bigquery_credential.json", "project_id")) as usage:
+                        result = self.exec_sql_bq(sql_query, save_path, max_len, usage)
+                elif api == "snowflake":
+                    # one connection per SqlEnv (queries name their database), reused across instances
+                    if "snowflake" not in self.conns.keys():
+                        self.start_db_sf("snowflake")
+                    with get_governor().query(api, credential_field("./snowflake_credential.json", "warehouse")):
+                        result = self.exec_sql_sf(sql_query, save_path, max_len, "snowflake")
+            except BudgetExhausted as e:
+                result = f"##ERROR## {e}"
+            if api == "sqlite":
+                if sqlite_path not in self.conns.keys():
+                    self.start_db_sqlite(sqlite_path)
+                result = self.execute_sqlite_with_timeout(sql_query, save_path, max_len, sqlite_path, timeout=300)
+                # result = self.exec_sql_sqlite(sql_query, save_path, max_len, sqlite_path)
+            if sql_span:
+                sql_span.set(error="##ERROR##" in str(result))
 
         if "##ERROR##" in str(result):
-            return {"status": "error", "error_msg": str(result)}
+            result = {"status": "error", "error_msg": str(result)}
         else:
-            return str(result)
+            result = str(result)
+        if bundle:
+            bundle.record_sql(sql_query, api, sqlite_path, result, save_path)
+        return result
 
     def execute_sqlite_with_timeout(self, sql_query, save_path, max_len, sqlite_path, timeout=300):
         try:
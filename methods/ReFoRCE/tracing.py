@@ -0,0 +1,216 @@
+"""Span tracing for pipeline stages.
+
+Spans are exported as a Chrome trace-event JSON file (open it in
+chrome://tracing or Perfetto). Every event carries OpenTelemetry-style
+trace_id/span_id/parent_span_id in its args, plus the instance_id/vote tags
+from metrics.get_context().
+
+    python tracing.py --trace_path output/xxx/trace.json
+prints per-stage p50/p95/p99 and the critical path of each instance.
+"""
+import argparse
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import numpy as np
+from metrics import get_context
+
+
+class Span:
+    def __init__(self, tracer, name, parent, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = {**get_context(), **attrs}
+        self.tid = threading.get_ident()
+        self.start = time.time()
+        self.end_time = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def end(self):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        for k, v in get_context().items():
+            if self.attrs.get(k) is None:
+                self.attrs[k] = v
+        self.tracer.finish(self)
+
+    def to_event(self):
+        args = {k: v for k, v in self.attrs.items() if v is not None}
+        args.update(trace_id=self.trace_id, span_id=self.span_id, parent_span_id=self.parent_id)
+        return {
+            "name": self.name,
+            "cat": self.name.split(".")[0],
+            "ph": "X",
+            "ts": int(self.start * 1e6),
+            "dur": int((self.end_time - self.start) * 1e6),
+            "pid": os.getpid(),
+            "tid": self.tid,
+            "args": args,
+        }
+
+
+class Tracer:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def current_span(self):
+        stack = self.stack()
+        if stack:
+            return stack[-1]
+        return getattr(self.local, "remote_parent", None)
+
+    def start_span(self, name, **attrs):
+        if not self.enabled:
+            return None
+        span = Span(self, name, self.current_span(), attrs)
+        self.stack().append(span)
+        return span
+
+    def finish(self, span):
+        stack = self.stack()
+        if span in stack:
+            stack.remove(span)
+        with self.lock:
+            self.events.append(span.to_event())
+
+    def export(self, path):
+        with self.lock:
+            events = sorted(self.events, key=lambda e: e["ts"])
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"Trace saved to {path} ({len(events)} spans)")
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    return _tracer
+
+
+def init_tracer(enabled=True):
+    global _tracer
+    _tracer = Tracer(enabled)
+    return _tracer
+
+
+def start_span(name, **attrs):
+    """Start a span that must be closed with end_span; for loop bodies that
+    break/continue, where a with-block would not fit."""
+    return _tracer.start_span(name, **attrs)
+
+
+def end_span(span):
+    if span is not None:
+        span.end()
+
+
+@contextmanager
+def span(name, **attrs):
+    """Trace the block (or decorated function) as one span."""
+    s = _tracer.start_span(name, **attrs)
+    try:
+        yield s
+    finally:
+        end_span(s)
+
+
+def propagate(func):
+    """Bind func to the current span so that spans opened by it in another
+    thread are parented correctly (threads don't share the span stack)."""
+    tracer = _tracer
+    parent = tracer.current_span()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tracer.local.remote_parent = parent
+        try:
+            return func(*args, **kwargs)
+        finally:
+            tracer.local.remote_parent = None
+    return wrapper
+
+
+def load_spans(trace_path):
+    with open(trace_path) as f:
+        data = json.load(f)
+    events = data["traceEvents"] if isinstance(data, dict) else data
+    return [e for e in events if e.get("ph") == "X"]
+
+
+def stage_percentiles(spans):
+    durations = defaultdict(list)
+    for e in spans:
+        durations[e["name"]].append(e["dur"] / 1e6)
+    return {
+        name: {
+            "count": len(d),
+            "total": float(np.sum(d)),
+            "p50": float(np.percentile(d, 50)),
+            "p95": float(np.percentile(d, 95)),
+            "p99": float(np.percentile(d, 99)),
+        }
+        for name, d in durations.items()
+    }
+
+
+def critical_paths(spans, root_name="instance"):
+    """Follow, from each root span, the child that finished last."""
+    children = defaultdict(list)
+    for e in spans:
+        children[e["args"].get("parent_span_id")].append(e)
+    paths = {}
+    for root in (e for e in spans if e["name"] == root_name):
+        path = [root]
+        node = root
+        while children.get(node["args"]["span_id"]):
+            node = max(children[node["args"]["span_id"]], key=lambda e: e["ts"] + e["dur"])
+            path.append(node)
+        paths[root["args"].get("instance_id", root["args"]["span_id"])] = path
+    return paths
+
+
+def report(trace_path, top=20):
+    spans = load_spans(trace_path)
+    stats = stage_percentiles(spans)
+    print(f"{'stage':<28}{'count':>8}{'total(s)':>12}{'p50(s)':>10}{'p95(s)':>10}{'p99(s)':>10}")
+    for name, s in sorted(stats.items(), key=lambda item: -item[1]["total"]):
+        print(f"{name:<28}{s['count']:>8}{s['total']:>12.1f}{s['p50']:>10.2f}{s['p95']:>10.2f}{s['p99']:>10.2f}")
+
+    paths = critical_paths(spans)
+    print(f"\nCritical path of the {min(top, len(paths))} slowest instances:")
+    for instance_id, path in sorted(paths.items(), key=lambda item: -item[1][0]["dur"])[:top]:
+        steps = []
+        for e in path:
+            label = e["name"]
+            if e["args"].get("vote") is not None and e["name"] == "vote":
+                label += f"[{e['args']['vote']}]"
+            steps.append(f"{label} {e['dur'] / 1e6:.1f}s")
+        print(f"{instance_id}: " + " > ".join(steps))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--trace_path', type=str, required=True)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+    report(args.trace_path, args.top)
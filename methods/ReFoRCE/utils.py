@@ -1,13 +1,15 @@
 import os
 import pandas as pd
 import json
-import logging
 import math
 import re
 import sqlglot
 from sqlglot.expressions import Table, Column, CTE
 import numpy as np
 import sqlparse
+import hashlib
+from io import StringIO
+from budget import count_tokens, SCHEMA_TOKEN_THRESHOLD
 
 def extract_all_blocks(main_content, code_format):
     sql_blocks = []
@@ -57,22 +59,9 @@ def get_shortest(sql_list):
     sql_list_len_index = sql_list_len.index(min(sql_list_len))
     return sql_list[sql_list_len_index]
 
-import threading
 def initialize_logger(log_path, logger_name=None):
-    if logger_name is None:
-        logger_name = threading.current_thread().name
-    logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.INFO)
-    file_handler = logging.FileHandler(log_path, mode='w')
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    file_handler.setFormatter(formatter)
-
-    logger.handlers.clear()
-    logger.addHandler(file_handler)
-    return logger
+    from logs import get_logger
+    return get_logger(log_path, logger_name)
 
 def extract_between(file_path, start_str, end_str):
     with open(file_path, 'r', encoding='utf-8') as file:
@@ -97,8 +86,104 @@ def extract_between(file_path, start_str, end_str):
     return results
 
 
+def vectors_match(v1, v2, tol=0.001, ignore_order_=False):
+    if ignore_order_:
+        v1, v2 = (sorted(v1, key=lambda x: (x is None, str(x), isinstance(x, (int, float)))),
+                sorted(v2, key=lambda x: (x is None, str(x), isinstance(x, (int, float)))))
+    if len(v1) != len(v2):
+        return False
+    for a, b in zip(v1, v2):
+        if pd.isna(a) and pd.isna(b):
+            continue
+        elif isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            if not math.isclose(float(a), float(b), abs_tol=tol):
+                return False
+        elif a != b:
+            return False
+    return True
+
+def compare_pandas_table_legacy(pred, gold, condition_cols=[], ignore_order=False, tolerance=0.001):
+    """Element-by-element compare_pandas_table, kept as the reference for
+    benchmarks/check_compare_equivalence.py."""
+    if condition_cols != []:
+        gold_cols = gold.iloc[:, condition_cols]
+    else:
+        gold_cols = gold
+    pred_cols = pred
+
+    t_gold_list = gold_cols.transpose().values.tolist()
+    t_pred_list = pred_cols.transpose().values.tolist()
+    score = 1
+    for _, gold in enumerate(t_gold_list):
+        if not any(vectors_match(gold, pred, tol=tolerance, ignore_order_=ignore_order) for pred in t_pred_list):
+            score = 0
+    return score
+
+
+NA_VALUE, NUMBER_VALUE, STRING_VALUE, OTHER_VALUE = 0, 1, 2, 3
+
+
+def value_kind(x):
+    if type(x) is str:
+        return STRING_VALUE
+    if type(x) is float:
+        return NA_VALUE if x != x else NUMBER_VALUE
+    if type(x) is int or type(x) is bool:
+        return NUMBER_VALUE
+    if pd.isna(x):
+        return NA_VALUE
+    return NUMBER_VALUE if isinstance(x, (int, float)) else STRING_VALUE if isinstance(x, str) else OTHER_VALUE
+
+
+class ColumnVector:
+    """One column prepared for vectors_match semantics once instead of per
+    column pair: sorted if order is ignored, split into value kinds, numbers
+    as a float array and strings as a tuple, with a signature of everything
+    but the numbers that two matching columns must share."""
+    def __init__(self, values, ignore_order=False):
+        types = set(map(type, values))
+        if ignore_order:
+            if types == {str}:
+                values = sorted(values)
+            elif len(types) == 1 and types != {type(None)}:
+                values = sorted(values, key=str)
+            else:
+                values = sorted(values, key=lambda x: (x is None, str(x), isinstance(x, (int, float))))
+        self.values = values
+        if types <= {float, int, bool}:
+            numbers = np.array(values, dtype=float)
+            missing = np.isnan(numbers)
+            self.kinds = np.where(missing, NA_VALUE, NUMBER_VALUE).astype(np.int8)
+            self.numbers = numbers[~missing]
+            self.strings = ()
+            self.has_other = False
+        else:
+            kinds = [value_kind(x) for x in values]
+            self.kinds = np.array(kinds, dtype=np.int8)
+            self.numbers = np.array([float(x) for x, kind in zip(values, kinds) if kind == NUMBER_VALUE], dtype=float)
+            self.strings = tuple(x for x, kind in zip(values, kinds) if kind == STRING_VALUE)
+            self.has_other = OTHER_VALUE in kinds
+        self.signature = (len(values), hash(self.kinds.tobytes()), hash(self.strings))
+
+    def matches(self, other, tol):
+        if self.has_other or other.has_other:
+            return vectors_match(self.values, other.values, tol)
+        if self.signature != other.signature or not np.array_equal(self.kinds, other.kinds) or self.strings != other.strings:
+            return False
+        a, b = self.numbers, other.numbers
+        with np.errstate(invalid="ignore", over="ignore"):
+            close = (a == b) | (np.isfinite(a) & np.isfinite(b) & (np.abs(a - b) <= np.maximum(1e-09 * np.maximum(np.abs(a), np.abs(b)), tol)))
+        return bool(close.all())
+
+
 def compare_pandas_table(pred, gold, condition_cols=[], ignore_order=False, tolerance=0.001):
-    """_summary_
+    """1 if every (condition) column of gold matches some column of pred,
+    else 0. Numbers match within tolerance (math.isclose with abs_tol), NaN
+    and None match each other, anything else must be equal; with
+    ignore_order, both columns are first sorted by the string of their
+    values. Same results as compare_pandas_table_legacy: each column is
+    prepared once, column pairs that cannot match are skipped by signature
+    and numbers are compared with NumPy.
 
     Args:
         pred (Dataframe): _description_
@@ -107,42 +192,18 @@ def compare_pandas_table(pred, gold, condition_cols=[], ignore_order=False, tole
         ignore_order (bool, optional): _description_. Defaults to True.
 
     """
-    # print('condition_cols', condition_cols)
-
-    def vectors_match(v1, v2, tol=tolerance, ignore_order_=False):
-        if ignore_order_:
-            v1, v2 = (sorted(v1, key=lambda x: (x is None, str(x), isinstance(x, (int, float)))),
-                    sorted(v2, key=lambda x: (x is None, str(x), isinstance(x, (int, float)))))
-        if len(v1) != len(v2):
-            return False
-        for a, b in zip(v1, v2):
-            if pd.isna(a) and pd.isna(b):
-                continue
-            elif isinstance(a, (int, float)) and isinstance(b, (int, float)):
-                if not math.isclose(float(a), float(b), abs_tol=tol):
-                    return False
-            elif a != b:
-                return False
-        return True
-    
     if condition_cols != []:
         gold_cols = gold.iloc[:, condition_cols]
     else:
         gold_cols = gold
     pred_cols = pred
 
-    t_gold_list = gold_cols.transpose().values.tolist()
-    t_pred_list = pred_cols.transpose().values.tolist()
-    score = 1
-    for _, gold in enumerate(t_gold_list):
-        if not any(vectors_match(gold, pred, ignore_order_=ignore_order) for pred in t_pred_list):
-            score = 0
-        else:
-            for j, pred in enumerate(t_pred_list):
-                if vectors_match(gold, pred, ignore_order_=ignore_order):
-                    break
-
-    return score
+    t_gold_list = [ColumnVector(values, ignore_order) for values in gold_cols.transpose().values.tolist()]
+    t_pred_list = [ColumnVector(values, ignore_order) for values in pred_cols.transpose().values.tolist()]
+    for gold in t_gold_list:
+        if not any(gold.matches(pred, tolerance) for pred in t_pred_list):
+            return 0
+    return 1
 
 def clear_description(table_info):
     return re.sub(r"Description:[^\n]*", "", table_info)
@@ -159,7 +220,7 @@ def get_table_info(test_path, sql_data, api, clear_des=False, full_tb_info=None)
                 with open(path) as f:
                     table_info += f.read()
         if clear_des:
-            if len(table_info) > 200000:
+            if count_tokens(table_info) > SCHEMA_TOKEN_THRESHOLD:
                 table_info = clear_description(table_info)
         return table_info
 
@@ -396,6 +457,88 @@ def is_valid_result(df_csv):
 
     return True
 
+def column_fingerprint(values):
+    """Order-insensitive hash of a column for grouping vote results. Strings
+    are hashed as they are; numbers, which compare_pandas_table matches
+    within a tolerance, only count, so that values on either side of a
+    rounding boundary cannot end up in different classes."""
+    missing = pd.isna(values)
+    strings = []
+    if values.dtype == object:
+        strings = sorted(x for x, is_missing in zip(values, missing) if not is_missing and not isinstance(x, (int, float)))
+    digest = hashlib.blake2b("\x1f".join(map(str, strings)).encode("utf-8", errors="surrogatepass"), digest_size=16).hexdigest()
+    return f"{len(values) - int(missing.sum()) - len(strings)}:{int(missing.sum())}:{digest}"
+
+def result_fingerprint(df):
+    """Shape and sorted column fingerprints: tables that match under
+    compare_pandas_table(ignore_order=True) with the same columns in any
+    order share it."""
+    return df.shape, tuple(sorted(column_fingerprint(df.iloc[:, i].to_numpy()) for i in range(df.shape[1])))
+
+class ResultClasses:
+    """Results grouped by result_fingerprint. A result joins a class if
+    compare_pandas_table matches it with the first result of the class in
+    both directions; otherwise (a hash collision) it starts a new one, so N
+    results cost N comparisons instead of N^2.
+
+    Classes are an equivalence, unlike the pairwise check vote_result made
+    before them: compare_pandas_table(v, c) one way, which holds when every
+    column of c is found in v, and which chains within tolerance (a ~ b and
+    b ~ c without a ~ c). Votes agree the same way when the candidates'
+    matches are symmetric and transitive, as for one answer up to row order
+    and float noise; otherwise classes count fewer agreements, and the
+    outcome can differ (benchmarks/bench_vote.py --cases)."""
+    def __init__(self, tolerance=0.001):
+        self.tolerance = tolerance
+        self.classes = {}
+        self.valid = {}
+
+    def add(self, pth, df=None):
+        """Add a result; returns the members of its class."""
+        df = pd.read_csv(pth) if df is None else df
+        self.valid[pth] = is_valid_result(df)
+        candidates = self.classes.setdefault(result_fingerprint(df), [])
+        for rep_df, members in candidates:
+            if compare_pandas_table(df, rep_df, ignore_order=True, tolerance=self.tolerance) and compare_pandas_table(rep_df, df, ignore_order=True, tolerance=self.tolerance):
+                members.append(pth)
+                return members
+        candidates.append((df, [pth]))
+        return candidates[-1][1]
+
+    def groups(self):
+        return [members for candidates in self.classes.values() for _, members in candidates]
+
+def compare_result_files(csv_paths, tolerance=0.001):
+    """Vote agreement between result CSVs: {path: [other paths whose table
+    matches it]}. Each file is read once and grouped with ResultClasses;
+    only valid results (is_valid_result) count as agreeing with another."""
+    result_classes = ResultClasses(tolerance)
+    for pth in csv_paths:
+        result_classes.add(pth)
+    matches = {}
+    for members in result_classes.groups():
+        for complete_value in members:
+            matches[complete_value] = [v for v in members if v != complete_value and result_classes.valid[v]]
+    return {pth: matches[pth] for pth in csv_paths}
+
+def summarize_result_csv(csv_path):
+    """Self-consistency checks of one self-refine result: (values with floats
+    rounded to 2 digits, nested values, columns that are all empty or 0)."""
+    with open(csv_path) as f:
+        csv_data_str = ''.join(f.readlines())
+    df_csv = pd.read_csv(StringIO(csv_data_str)).fillna("")
+
+    nested_val = [(item) for i, row in enumerate(df_csv.values.tolist()) for j, item in enumerate(row) if isinstance(item, str) and '\n' in item in item]
+    df_csv_copy = df_csv.copy()
+    for col in df_csv.select_dtypes(include=['float']):
+        df_csv_copy[col] = df_csv[col].round(2)
+    sort_col = df_csv_copy.columns[0]
+    df_csv_copy_sorted = df_csv_copy[sort_col].astype(str)
+    csv_data_str_round2 = df_csv_copy_sorted.to_string()
+    df_csv_str = df_csv.astype(str)
+    empty_columns = df_csv_str.columns[((df_csv_str == "0") | (df_csv_str == "")).all()].to_list()
+    return get_values_from_table(csv_data_str_round2), nested_val, empty_columns
+
 def filter_bijection_like_dict(d):
     keys = set(d.keys())
     new_d = {}
@@ -0,0 +1,105 @@
+"""Incremental voting: stop the remaining votes of an instance once the
+outcome of vote_result can no longer change.
+
+Each vote thread reports its result CSV to the instance's IncrementalVoter
+when it ends; results are grouped as they arrive (utils.ResultClasses, as in
+vote_result). With L valid results in the leading class, O in the best other
+class and P votes still running, the leader wins whatever the running votes
+return once L > O + P. When that holds and L reaches --early_majority, the
+voter sets its stop event: GPTChat raises VoteCancelled instead of sending
+another request, self_refine stops before its next iteration, and the
+cancelled votes leave no result behind, so vote_result sees the same winning
+answer with fewer votes.
+
+run.py --adaptive_votes uses the voter for sequential sampling: an instance
+starts with --min_votes votes and, while the agreement of its finished votes
+is below --vote_confidence, adds the votes its leader would need, up to
+--max_votes. All vote threads share --vote_capacity slots, so capacity
+saved on instances that agree goes to the ones that do not.
+"""
+import math
+import os
+import threading
+from contextlib import contextmanager
+from utils import ResultClasses
+from metrics import get_recorder
+
+
+class VoteCancelled(Exception):
+    pass
+
+
+def check_cancelled(stop_event):
+    if stop_event is not None and stop_event.is_set():
+        raise VoteCancelled("the majority is decided")
+
+
+@contextmanager
+def cancellable(csv_path, sql_path, logger=None):
+    """End a cancelled vote (VoteCancelled or a subclass) quietly. Its result CSV is removed unless the SQL
+    was saved with it, as an intermediate result is not an answer."""
+    try:
+        yield
+    except VoteCancelled as e:
+        if logger is not None:
+            logger.info(f"Vote cancelled, {e}.")
+        if not os.path.exists(sql_path) and os.path.exists(csv_path):
+            os.remove(csv_path)
+
+
+class IncrementalVoter:
+    def __init__(self, num_votes=0, majority=None, name=""):
+        self.num_votes = num_votes
+        self.majority = max(majority, 2) if majority else None  # a lone result gets no votes in vote_result
+        self.name = name
+        self.pending = num_votes
+        self.result_classes = ResultClasses()
+        self.stop_event = threading.Event()
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+
+    def add_votes(self, count):
+        with self.lock:
+            self.num_votes += count
+            self.pending += count
+
+    def finish(self, csv_path):
+        """A vote ended; csv_path is its result, if it wrote one."""
+        with self.lock:
+            self.pending -= 1
+            if os.path.exists(csv_path):
+                try:
+                    self.result_classes.add(csv_path)
+                except Exception as e:
+                    print(f"{self.name}: could not read {csv_path} for voting: {e!r}")
+            if self.pending > 0 and not self.stop_event.is_set() and self.decided():
+                sizes = self.class_sizes()
+                print(f"{self.name}: {sizes[0]} of {self.num_votes} votes agree, stopping the {self.pending} still running")
+                get_recorder().record(kind="vote_stop", agreeing=sizes[0], pending=self.pending, num_votes=self.num_votes)
+                self.stop_event.set()
+            self.changed.notify_all()
+
+    def class_sizes(self):
+        """Valid results per class, largest first."""
+        valid = self.result_classes.valid
+        return sorted((sum(valid[pth] for pth in members) for members in self.result_classes.groups()), reverse=True) or [0]
+
+    def decided(self):
+        if self.majority is None:
+            return False
+        sizes = self.class_sizes() + [0]
+        leader, other = sizes[0], sizes[1]
+        return leader >= self.majority and leader > other + self.pending
+
+    def agreement(self):
+        """Share of the finished votes in the leading class."""
+        finished = self.num_votes - self.pending
+        return self.class_sizes()[0] / finished if finished else 0.0
+
+    def votes_needed(self, confidence, max_votes):
+        """Votes to add so that the leader reaches confidence if they all
+        agree with it (at least 1, at most max_votes - num_votes)."""
+        finished = self.num_votes - self.pending
+        leader = self.class_sizes()[0]
+        needed = max_votes - self.num_votes if confidence >= 1 else math.ceil((confidence * finished - leader) / (1 - confidence))
+        return max(1, min(needed, max_votes - self.num_votes))